@@ -2,9 +2,12 @@ from typing import List
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 
-from models import Account, Seller
+from models import Account, Seller, RefreshToken
 from db import get_db
-from auth import admin_only, get_password_hash, get_current_account  # get_current_account 추가
+from auth import (
+    admin_only, get_password_hash, get_current_account, bump_token_version, invalidate_principal,
+    run_password_task_sync, Principal
+)
 from crud import get_korea_time_naive
 from schemas import AccountCreate, AccountUpdate, AccountOut
 
@@ -12,7 +15,7 @@ router = APIRouter()
 
 # === Accounts CRUD ===
 @router.post("/accounts", response_model=AccountOut)
-def create_account(body: AccountCreate, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def create_account(body: AccountCreate, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     if db.query(Account).filter(Account.username == body.username).first():
         raise HTTPException(status_code=400, detail="이미 존재하는 아이디")
     if body.type == "seller" and body.seller_id and not db.query(Seller).filter(Seller.id == body.seller_id).first():
@@ -20,7 +23,7 @@ def create_account(body: AccountCreate, db: Session = Depends(get_db), current:
 
     acc = Account(
         username=body.username,
-        password_hash=get_password_hash(body.password),
+        password_hash=run_password_task_sync(get_password_hash, body.password),
         type=body.type,
         seller_id=body.seller_id,
         created_at=get_korea_time_naive(),  # 추가
@@ -32,7 +35,7 @@ def create_account(body: AccountCreate, db: Session = Depends(get_db), current:
     return acc
 
 @router.get("/accounts", response_model=List[AccountOut])
-def list_accounts(db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def list_accounts(db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     # 단순 쿼리로 빠르게 조회
     accounts = db.query(Account).all()
     
@@ -54,14 +57,14 @@ def update_account(
     account_id: int,
     body: AccountUpdate,
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     acc = db.query(Account).filter(Account.id == account_id).first()
     if not acc:
         raise HTTPException(status_code=404, detail="계정 없음")
 
     if body.password:
-        acc.password_hash = get_password_hash(body.password)
+        acc.password_hash = run_password_task_sync(get_password_hash, body.password)
     if body.type:
         acc.type = body.type
     if body.seller_id is not None:
@@ -71,12 +74,15 @@ def update_account(
                 raise HTTPException(status_code=400, detail="존재하지 않는 입점사 id")
         acc.seller_id = body.seller_id
 
+    # 비밀번호/권한이 바뀌었으므로 기존 토큰 무효화
+    bump_token_version(acc)
     db.commit()
+    invalidate_principal(acc.username)
     db.refresh(acc)
     return acc
 
 @router.delete("/accounts/{account_id}")
-def delete_account(account_id: int, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def delete_account(account_id: int, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     account = db.query(Account).filter(Account.id == account_id).first()
     if not account:
         raise HTTPException(status_code=404, detail="계정 없음")
@@ -85,6 +91,9 @@ def delete_account(account_id: int, db: Session = Depends(get_db), current: Acco
     if account.username == current.username:
         raise HTTPException(status_code=400, detail="자기 자신은 삭제할 수 없습니다")
     
+    username = account.username
+    db.query(RefreshToken).filter(RefreshToken.account_id == account_id).delete(synchronize_session=False)
     db.delete(account)
     db.commit()
+    invalidate_principal(username)
     return {"ok": True, "message": "계정이 삭제되었습니다"}
@@ -4,14 +4,14 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from models import DashboardSummary, ProductRankings, Order, OrderItem, Account  # Account 추가!
+from models import DashboardSummary, ProductRankings, Order, OrderItem
 from db import get_db
 from auth import get_current_account
 from crud import TOTAL_STATS_SELLER_ID, VALID_STATUS_FOR_STATS, get_korea_time_naive
 from models import Order, OrderItem, Product  # Product 추가 필요
 from fastapi import Query
 from fastapi import APIRouter, Depends, Query, Body  # Body 추가
-from auth import get_current_account, admin_only  # admin_only 추가
+from auth import get_current_account, admin_only, Principal  # admin_only 추가
 
 router = APIRouter()
 
@@ -20,7 +20,7 @@ router = APIRouter()
 @router.get("/api/dashboard-summary")
 def get_dashboard_summary(
     seller_id: Optional[int] = Query(None), 
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     
@@ -100,7 +100,7 @@ def get_dashboard_summary(
 @router.get("/api/rankings")
 def get_rankings(
     seller_id: Optional[int] = Query(None),
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """TOP5 랭킹 데이터"""
@@ -158,7 +158,7 @@ def get_rankings(
 def get_monthly_chart(
     product_ids: Optional[str] = Query(None),
     seller_id: Optional[int] = Query(None),  
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """월별 차트 데이터 (실시간 계산)"""
@@ -203,7 +203,7 @@ def get_monthly_chart(
 def get_daily_chart(
     product_ids: Optional[str] = Query(None),
     seller_id: Optional[int] = Query(None),
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """일별 차트 데이터 (최근 30일)"""
@@ -248,7 +248,7 @@ def get_range_chart(
     start_date: str,
     end_date: str,
     product_ids: Optional[str] = None,
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """특정 기간 차트 데이터"""
@@ -297,7 +297,7 @@ def get_range_chart(
 @router.get("/api/last-month-stats")
 def get_last_month_stats(
     seller_id: Optional[int] = Query(None),  # 🔴 seller_id 파라미터 추가
-    current: Account = Depends(get_current_account),
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """전월 통계 데이터"""
@@ -413,10 +413,10 @@ def get_last_month_stats(
 def refresh_statistics(
     body: dict = Body({"days": 30}),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     """통계 데이터 재계산 - 전체 재계산 방식"""
-    from crud import recalculate_dashboard_summary_full, update_product_rankings
+    from crud import recalculate_dashboard_summary_full, update_product_rankings, rebuild_product_sales
     from models import Seller
     
     days = body.get("days", 30)
@@ -445,6 +445,9 @@ def refresh_statistics(
     # 랭킹 재계산
     update_product_rankings(db)
     
+    # 제품별 판매 지표 재구성
+    rebuild_product_sales(db)
+    
     db.commit()
     
     return {
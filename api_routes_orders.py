@@ -6,26 +6,39 @@ from decimal import Decimal
 from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
 from sqlalchemy.orm import Session
+from sqlalchemy import or_, func, case, select, union_all
 
 
 from models import Order, OrderItem, Product, Seller, ImportBatch, DashboardSummary, Account, OrderItemAudit
 from db import get_db
-from auth import get_current_account, admin_only
+from auth import get_current_account, admin_only, Principal
 from crud import (
     get_korea_time_naive,
     ORDER_STATUS_MAP, 
     VALID_STATUS_FOR_STATS,
+    DEDUCT_STOCK_STATUSES,
     TOTAL_STATS_SELLER_ID,
-    update_dashboard_summary,
+    apply_stats_deltas,
+    allocate_fifo_batch,
+    allocate_unallocated_items,
+    release_fifo_allocations,
+    take_inventory_snapshots_if_needed,
     update_product_rankings,
     recalculate_stats_for_status_change,
     recalculate_total_stats,
-    get_week_start,
-    recalculate_dashboard_summary_full  # ✅ 추가
+    get_week_start
 )
 
 router = APIRouter()
 
+def _add_item_delta(deltas: dict, item, order_time, sign: int = 1):
+    """주문 아이템 1건을 apply_stats_deltas용 증감분에 누적 (sign=-1이면 차감)"""
+    key = (item.seller_id_snapshot, item.product_id, order_time.date())
+    acc = deltas.setdefault(key, [Decimal('0'), Decimal('0'), 0])
+    acc[0] += sign * item.supply_price * item.quantity
+    acc[1] += sign * item.sale_price * item.quantity
+    acc[2] += sign * item.quantity
+
 # 주의사항:
 # - Order.order_time은 엑셀의 지불시간 그대로 저장 (중국시간)
 # - ImportBatch.imported_at은 get_korea_time_naive() 사용 (한국시간)
@@ -36,7 +49,7 @@ router = APIRouter()
 async def upload_orders(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     # 1. 파일 타입 체크
     if not file.filename.endswith(('.xlsx', '.xls')):
@@ -124,7 +137,8 @@ async def upload_orders(
     # 13. DB 저장 (주문번호별 그룹)
     new_orders = []
     new_items = []
-    affected_sellers_from_status_change = set()  # 추가: 상태 변경으로 영향받은 입점사들
+    status_changes = []  # (주문, 이전 상태) - 통계 반영 여부가 바뀐 주문만
+    stock_changes = []   # 재고 차감 여부가 바뀐 주문만
 
     for order_no, group in df_filtered.groupby('order_no'):
         first_row = group.iloc[0]
@@ -142,14 +156,11 @@ async def upload_orders(
                 order.status = new_status
                 stats['updated_orders'] += 1
                 
-                # 영향받은 입점사들 수집만 (재계산은 나중에)
-                order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-                for oi in order_items:
-                    if oi.seller_id_snapshot:
-                        affected_sellers_from_status_change.add(oi.seller_id_snapshot)
-                
-                # flush 제거 (마지막에 한 번만)
-                # 재계산 코드 모두 삭제
+                # 통계 반영 여부가 바뀐 주문만 수집 (증감분은 나중에 한 번에)
+                if (old_status in VALID_STATUS_FOR_STATS) != (new_status in VALID_STATUS_FOR_STATS):
+                    status_changes.append((order, old_status))
+                if (old_status in DEDUCT_STOCK_STATUSES) != (new_status in DEDUCT_STOCK_STATUSES):
+                    stock_changes.append(order)
                 
         else:
             # 신규 주문
@@ -214,6 +225,46 @@ async def upload_orders(
         db.bulk_save_objects(new_items)
         db.flush()  # 여기서 한 번만 flush
 
+    # 12-1. FIFO 재고 할당 (재고 차감 상태인 새 주문만) - 선적 입고순 차감 + 선적가로 아이템 가격 재설정
+    new_orders_by_id = {o.id: o for o in new_orders}
+    saved_item_columns = (
+        OrderItem.id, OrderItem.order_id, OrderItem.seller_id_snapshot, OrderItem.product_id,
+        OrderItem.supply_price, OrderItem.sale_price, OrderItem.quantity
+    )
+    if new_items:
+        fifo_items = [
+            {"id": item.id, "product_id": item.product_id, "quantity": item.quantity,
+             "order_time": new_orders_by_id[item.order_id].order_time}
+            for item in db.query(*saved_item_columns).filter(
+                OrderItem.order_id.in_(new_orders_by_id.keys()),
+                OrderItem.product_id != None
+            ).all()
+            if new_orders_by_id[item.order_id].status in DEDUCT_STOCK_STATUSES
+        ]
+        fifo = allocate_fifo_batch(db, fifo_items)
+        stats['fifo_allocated_items'] = fifo['items']
+        stats['fifo_shortage_quantity'] = fifo['shortage']
+
+    # 12-2. 재고 차감 여부가 바뀐 기존 주문 - 취소 등으로 벗어나면 할당 해제(재고 복원), 돌아오면 재할당
+    if stock_changes:
+        db.flush()  # 바뀐 상태 기준으로 재할당 대상 조회
+        changed_item_ids = {o.id: [] for o in stock_changes}
+        for item_id, order_id in db.query(OrderItem.id, OrderItem.order_id).filter(
+            OrderItem.order_id.in_(changed_item_ids.keys())
+        ).all():
+            changed_item_ids[order_id].append(item_id)
+        
+        released = release_fifo_allocations(db, [
+            item_id for o in stock_changes if o.status not in DEDUCT_STOCK_STATUSES
+            for item_id in changed_item_ids[o.id]
+        ])
+        reallocated, _ = allocate_unallocated_items(db, [
+            item_id for o in stock_changes if o.status in DEDUCT_STOCK_STATUSES
+            for item_id in changed_item_ids[o.id]
+        ])
+        stats['fifo_released_items'] = released['items']
+        stats['fifo_reallocated_items'] = reallocated['items']
+
 
     ## 13. ImportBatch 기록
     import_batch = ImportBatch(
@@ -226,16 +277,31 @@ async def upload_orders(
     )
     db.add(import_batch)
 
-    # 13-1. 통계 업데이트 - 마지막에 한 번만!
+    # 13-1. 통계 증감분 (대시보드 + 제품 판매 지표) - 마지막에 한 번만!
+    stats_deltas = {}
+    
+    # 새 주문 아이템 (통계 반영 상태만, FIFO로 재설정된 가격 기준)
     if new_items:
-        # 새 주문 아이템들 부분 계산
-        update_dashboard_summary(db, new_items)
+        for item in db.query(*saved_item_columns).filter(
+            OrderItem.order_id.in_(new_orders_by_id.keys())
+        ).all():
+            order = new_orders_by_id[item.order_id]
+            if order.status in VALID_STATUS_FOR_STATS:
+                _add_item_delta(stats_deltas, item, order.order_time)
 
-    # 13-2. 상태 변경된 주문들 처리
-    if affected_sellers_from_status_change:
-        # 상태 변경은 이미 DB에 반영되었으므로 전체 재계산 필요
-        for seller_id in affected_sellers_from_status_change:
-            recalculate_dashboard_summary_full(db, seller_id)
+    # 13-2. 상태 변경된 주문들 (정상 ↔ 취소/환불) - 아이템 한 번에 조회
+    if status_changes:
+        changed_orders = {o.id: o for o, _ in status_changes}
+        changed_items = db.query(
+            OrderItem.order_id, OrderItem.seller_id_snapshot, OrderItem.product_id,
+            OrderItem.supply_price, OrderItem.sale_price, OrderItem.quantity
+        ).filter(OrderItem.order_id.in_(changed_orders.keys())).all()
+        for item in changed_items:
+            order = changed_orders[item.order_id]
+            sign = 1 if order.status in VALID_STATUS_FOR_STATS else -1
+            _add_item_delta(stats_deltas, item, order.order_time, sign)
+    
+    apply_stats_deltas(db, stats_deltas)
 
     # 13-3. 랭킹은 맨 마지막에 한 번만
     if new_items or stats['updated_orders'] > 0:
@@ -244,6 +310,9 @@ async def upload_orders(
     # 14. 커밋
     db.commit()
     
+    # 14-1. 주기 재고 스냅샷 (마지막 스냅샷이 오래됐을 때만, 시점 재고 조회의 원장 재생 구간 제한)
+    take_inventory_snapshots_if_needed(db)
+    
     
     # 15. 결과 반환
     return {
@@ -257,7 +326,7 @@ def list_orders(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     orders = db.query(Order).offset(skip).limit(limit).all()
     
@@ -280,10 +349,83 @@ def list_orders(
 def get_order_items(
     order_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     items = db.query(OrderItem).filter(OrderItem.order_id == order_id).all()
     return items
+
+# === Batched Order Items API ===
+MAX_BATCH_ORDERS = 200  # 한 번에 조회 가능한 최대 주문 수
+
+@router.get("/orders/items")
+def get_orders_items_batch(
+    order_ids: Optional[str] = None,  # 콤마 구분 (예: 1,2,3)
+    order_nos: Optional[str] = None,  # 콤마 구분 주문번호
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    """여러 주문의 아이템을 IN 쿼리 한 번으로 조회 (주문별 그룹)"""
+    try:
+        ids = [int(i) for i in order_ids.split(',') if i.strip()] if order_ids else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="order_ids 형식 오류")
+    nos = [n.strip() for n in order_nos.split(',') if n.strip()] if order_nos else []
+
+    if not ids and not nos:
+        raise HTTPException(status_code=400, detail="order_ids 또는 order_nos가 필요합니다")
+    if len(ids) + len(nos) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"최대 {MAX_BATCH_ORDERS}개 주문까지 조회 가능합니다")
+
+    # 필요한 컬럼만 조회 (ORM 객체 전체 직렬화 X)
+    query = db.query(
+        Order.id.label('order_id'),
+        Order.order_no,
+        OrderItem.id,
+        OrderItem.product_id,
+        OrderItem.product_code,
+        OrderItem.seller_id_snapshot,
+        OrderItem.quantity,
+        OrderItem.supply_price,
+        OrderItem.sale_price,
+        OrderItem.cny_amount
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    )
+
+    if ids and nos:
+        query = query.filter(or_(Order.id.in_(ids), Order.order_no.in_(nos)))
+    elif ids:
+        query = query.filter(Order.id.in_(ids))
+    else:
+        query = query.filter(Order.order_no.in_(nos))
+
+    # 입점사는 자기 아이템만
+    if current.type == "seller":
+        query = query.filter(OrderItem.seller_id_snapshot == current.seller_id)
+
+    rows = query.order_by(Order.id, OrderItem.id).all()
+
+    # 주문별 그룹핑
+    grouped = {}
+    for row in rows:
+        if row.order_id not in grouped:
+            grouped[row.order_id] = {
+                "order_id": row.order_id,
+                "order_no": row.order_no,
+                "items": []
+            }
+        grouped[row.order_id]["items"].append({
+            "id": row.id,
+            "product_id": row.product_id,
+            "product_code": row.product_code,
+            "seller_id": row.seller_id_snapshot,
+            "quantity": row.quantity,
+            "supply_price": float(row.supply_price),
+            "sale_price": float(row.sale_price),
+            "cny_amount": float(row.cny_amount) if row.cny_amount is not None else None
+        })
+
+    return {"orders": list(grouped.values())}
 # === Orders with Items API ===
 @router.get("/orders/with-items")
 def list_orders_with_items(
@@ -293,7 +435,7 @@ def list_orders_with_items(
     product_id: Optional[int] = None,  # 파라미터로 추가
     unmatched_only: bool = False,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):  # 괄호 정리
     # 권한별 필터링
     if current.type == "seller":
@@ -375,6 +517,69 @@ def list_orders_with_items(
             "pages": (total_count + limit - 1) // limit
         }
 
+# === Unmatched Product Code Aggregation API ===
+@router.get("/orders/unmatched-codes")
+def list_unmatched_codes(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    """미연결 제품코드별 집계 (건수/수량/CNY 합계/최초·최근 주문일)"""
+    item_columns = (
+        OrderItem.id,
+        OrderItem.order_id,
+        OrderItem.product_id,
+        OrderItem.product_code,
+        OrderItem.quantity,
+        OrderItem.cny_amount
+    )
+    # OR 조건 대신 인덱스를 타는 두 쿼리를 UNION ALL
+    unmatched = union_all(
+        select(*item_columns).where(OrderItem.product_id == None),
+        select(*item_columns).where(
+            OrderItem.supply_price == 0,
+            OrderItem.product_id != None
+        )
+    ).subquery()
+
+    query = db.query(
+        unmatched.c.product_code,
+        func.count(unmatched.c.id).label('item_count'),
+        func.count(func.distinct(unmatched.c.order_id)).label('order_count'),
+        func.sum(unmatched.c.quantity).label('quantity'),
+        func.sum(unmatched.c.cny_amount).label('cny_total'),
+        func.sum(case((unmatched.c.product_id != None, 1), else_=0)).label('price_missing_count'),
+        func.min(Order.order_time).label('first_seen'),
+        func.max(Order.order_time).label('last_seen')
+    ).join(
+        Order, unmatched.c.order_id == Order.id
+    ).group_by(
+        unmatched.c.product_code
+    )
+
+    total_count = db.query(func.count(func.distinct(unmatched.c.product_code))).scalar() or 0
+    rows = query.order_by(
+        func.count(unmatched.c.id).desc(),
+        unmatched.c.product_code
+    ).offset(skip).limit(limit).all()
+
+    return {
+        "codes": [{
+            "product_code": row.product_code,
+            "item_count": row.item_count,
+            "order_count": row.order_count,
+            "quantity": int(row.quantity or 0),
+            "cny_total": float(row.cny_total or 0),
+            "price_missing_count": int(row.price_missing_count or 0),  # 제품은 연결됐지만 가격이 0인 건
+            "first_seen": row.first_seen,
+            "last_seen": row.last_seen
+        } for row in rows],
+        "total": total_count,
+        "page": skip // limit + 1,
+        "pages": (total_count + limit - 1) // limit
+    }
+
 # === Order Item Price Update API ===
 @router.put("/order-items/{item_id}/price")
 def update_order_item_price(
@@ -383,7 +588,7 @@ def update_order_item_price(
     sale_price: float = Form(...),
     note: str = Form(None),  # ✅ note 파라미터 추가
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     item = db.query(OrderItem).filter(OrderItem.id == item_id).first()
     if not item:
@@ -418,39 +623,17 @@ def update_order_item_price(
         item.last_modified_at = get_korea_time_naive()
         item.last_modified_by = current.id
     
-    # 커밋
-    db.commit()
-    
-    # 해당 입점사만 재계산
-    seller_id = item.seller_id_snapshot if item.seller_id_snapshot else None
+        # 차액을 통계 증감분으로 반영 (통계 반영 상태인 주문만, 기간별/제품 지표 포함)
+        order = db.query(Order).filter(Order.id == item.order_id).first()
+        if order and order.status in VALID_STATUS_FOR_STATS:
+            apply_stats_deltas(db, {
+                (item.seller_id_snapshot, item.product_id, order.order_time.date()): [
+                    (new_supply_price - old_supply_price) * item.quantity,
+                    (new_sale_price - old_sale_price) * item.quantity,
+                    0
+                ]
+            })
     
-    # 커밋 전에 차액 계산
-    if old_supply_price != new_supply_price or old_sale_price != new_sale_price:
-        # 차액 계산
-        supply_diff = (new_supply_price - old_supply_price) * item.quantity
-        sale_diff = (new_sale_price - old_sale_price) * item.quantity
-        
-        # 해당 입점사 통계 업데이트
-        seller_id = item.seller_id_snapshot if item.seller_id_snapshot else TOTAL_STATS_SELLER_ID
-        summary = db.query(DashboardSummary).filter(
-            DashboardSummary.seller_id == seller_id
-        ).first()
-        
-        if summary:
-            summary.total_supply_amount += supply_diff
-            summary.total_sale_amount += sale_diff
-            summary.last_updated = get_korea_time_naive()
-        
-        # 전체(0) 통계도 업데이트
-        if seller_id != TOTAL_STATS_SELLER_ID:
-            total_summary = db.query(DashboardSummary).filter(
-                DashboardSummary.seller_id == TOTAL_STATS_SELLER_ID
-            ).first()
-            if total_summary:
-                total_summary.total_supply_amount += supply_diff
-                total_summary.total_sale_amount += sale_diff
-                total_summary.last_updated = get_korea_time_naive()
-
     db.commit()
     return {"success": True, "message": "가격이 수정되었습니다"}
 
@@ -460,7 +643,7 @@ def update_order_item_price(
 def get_order_item_audit_history(
     item_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     """주문 아이템의 가격 변경 이력 조회"""
     
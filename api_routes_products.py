@@ -1,21 +1,34 @@
 import os
+import base64
+import hashlib
+import pandas as pd
+from io import BytesIO
 from os.path import basename
 from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, BackgroundTasks, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, or_, and_, insert, select, union_all, literal, Integer, Numeric, DateTime, String
 
 from models import Product, Seller, Order, OrderItem, StockAdjustment, Account  # Account 추가
 from db import get_db
-from auth import get_current_account, admin_only
-from crud import get_korea_time_naive, DEDUCT_STOCK_STATUSES, UPLOAD_DIR
+from auth import get_current_account, admin_only, Principal
+from crud import (
+    get_korea_time_naive, DEDUCT_STOCK_STATUSES, VALID_STATUS_FOR_STATS, UPLOAD_DIR,
+    relink_unmatched_items, apply_stats_deltas, update_product_rankings,
+    rematch_unmatched_items, run_rematch_sweep, query_products_with_inventory,
+    refresh_product_inventory_state, recent_sales_subquery,
+    get_inventory_projection, PROJECTION_WINDOWS, record_inventory_movements,
+    release_fifo_allocations
+)
 from schemas import ProductBase, ProductOut
 from models import ProductImage  # 상단 import에 추가
 import json  # 상단 import에 추가
-from models import ProductCodeMapping
-from models import Product, Seller, Order, OrderItem, StockAdjustment, Account, ProductShipment, ShipmentPriceHistory
+from models import ProductCodeMapping, ProductInventoryState, ProductSalesMetrics, ProductDailySales, StockAlert, InventorySnapshot, FifoAllocation, InventoryLedger, ProductRankings
+from models import Product, Seller, Order, OrderItem, StockAdjustment, Account, ProductShipment, ShipmentPriceHistory, ShipmentStockAdjustment
+from product_index import product_index
+from shipment_price_index import shipment_price_index
 
 
 router = APIRouter()
@@ -26,6 +39,7 @@ router = APIRouter()
 # === Products CRUD ===
 @router.post("/products", response_model=ProductOut)
 async def create_product(
+    background_tasks: BackgroundTasks,
     name: str = Form(...),
     product_code: str = Form(...),
     seller_id: int = Form(...),
@@ -38,7 +52,7 @@ async def create_product(
     # 선적 정보 (JSON 문자열로 받음)
     shipments: str = Form(None),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     if not db.query(Seller).filter(Seller.id == seller_id).first():
         raise HTTPException(status_code=400, detail="입점사 없음")
@@ -116,26 +130,235 @@ async def create_product(
             created_at=korea_time
         )
         db.add(price_history)
+        
+        # 재고 원장: 입고
+        record_inventory_movements(db, [{
+            "shipment_id": shipment.id,
+            "product_id": prod.id,
+            "entry_type": "receipt",
+            "quantity_delta": shipment.remaining_quantity,
+            "occurred_at": korea_time,
+            "reference_type": "shipment",
+            "reference_id": shipment.id,
+            "created_by": current.id
+        }])
     
-    # 미연결 OrderItem 업데이트 (기존 코드 유지)
-    updated_count = db.query(OrderItem).filter(
-        OrderItem.product_code == product_code,
-        OrderItem.supply_price == 0,
-        OrderItem.sale_price == 0
-    ).update({
-        "product_id": prod.id,
-        "seller_id_snapshot": prod.seller_id,
-        "supply_price": prod.supply_price,
-        "sale_price": prod.sale_price
-    })
+    # 재고 상태 초기화
+    refresh_product_inventory_state(db, [prod.id])
     
     db.commit()
+    product_index.upsert_product(prod)
+    shipment_price_index.refresh(db)
     
-    if updated_count > 0:
-         print(f"✅ {updated_count}개 미연결 주문 가격 자동 설정")
+    # 미연결 OrderItem 연결 + 통계 반영은 백그라운드 재매칭으로
+    background_tasks.add_task(run_rematch_sweep)
     
     return prod
 
+# === 제품/선적 일괄 등록 (엑셀/CSV) ===
+# 같은 제품코드가 여러 행이면 한 제품의 여러 선적으로 처리
+PRODUCT_IMPORT_COLUMNS = {
+    '제품코드': 'product_code',
+    '제품명': 'name',
+    '입점사': 'seller',          # 입점사명 또는 ID
+    '선적번호': 'shipment_no',
+    '입고일': 'arrival_date',
+    '수량': 'quantity',
+    '공급가': 'supply_price',
+    '판매가': 'sale_price',
+    '썸네일': 'thumbnail_url'
+}
+
+def _cell(row, col):
+    value = row.get(col)
+    if value is None or pd.isna(value) or str(value).strip() == '':
+        return None
+    return str(value).strip()
+
+@router.post("/upload/products")
+async def upload_products(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    # 1. 파일 읽기 (코드 앞자리 0 유지를 위해 전부 문자열로)
+    contents = await file.read()
+    if file.filename.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(BytesIO(contents), dtype=str)
+    elif file.filename.endswith('.csv'):
+        df = pd.read_csv(BytesIO(contents), dtype=str, encoding='utf-8-sig')
+    else:
+        raise HTTPException(status_code=400, detail="엑셀 또는 CSV 파일만 업로드 가능합니다")
+    
+    df = df.rename(columns=PRODUCT_IMPORT_COLUMNS)
+    missing = [c for c in ('product_code', 'name', 'seller') if c not in df.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"필수 컬럼 없음: {', '.join(missing)}")
+    if df.empty:
+        raise HTTPException(status_code=400, detail="파일에 데이터가 없습니다")
+    
+    # 2. 입점사 (이름/ID 모두 허용)
+    sellers = db.query(Seller.id, Seller.name).all()
+    seller_by_key = {s.name: s.id for s in sellers}
+    seller_by_key.update({str(s.id): s.id for s in sellers})
+    
+    # 3. 행 검증 (제품코드는 인덱스로 기존 제품/매핑코드와 중복 확인)
+    korea_time = get_korea_time_naive()
+    errors = []
+    products = {}  # product_code -> {"product": dict, "shipments": [dict]}
+    for idx, row in df.iterrows():
+        line = idx + 2  # 헤더 1행
+        code = _cell(row, 'product_code')
+        if not code:
+            errors.append(f"{line}행: 제품코드 없음")
+            continue
+        
+        if code not in products:
+            if product_index.resolve(db, code)[0]:
+                errors.append(f"{line}행: 이미 존재하는 제품코드 ({code})")
+                continue
+            seller_id = seller_by_key.get(_cell(row, 'seller'))
+            if not seller_id:
+                errors.append(f"{line}행: 입점사 없음 ({_cell(row, 'seller')})")
+                continue
+            if not _cell(row, 'name'):
+                errors.append(f"{line}행: 제품명 없음")
+                continue
+            products[code] = {
+                "product": {
+                    "name": _cell(row, 'name'),
+                    "product_code": code,
+                    "seller_id": seller_id,
+                    "thumbnail_url": _cell(row, 'thumbnail_url')
+                },
+                "shipments": []
+            }
+        
+        if _cell(row, 'quantity') is None:
+            continue
+        try:
+            arrival = _cell(row, 'arrival_date')
+            products[code]["shipments"].append({
+                "shipment_no": _cell(row, 'shipment_no') or '초기재고',
+                "arrival_date": pd.to_datetime(arrival).to_pydatetime() if arrival else korea_time,
+                "quantity": int(float(_cell(row, 'quantity'))),
+                "supply_price": Decimal(_cell(row, 'supply_price') or '0'),
+                "sale_price": Decimal(_cell(row, 'sale_price') or '0')
+            })
+        except Exception:
+            errors.append(f"{line}행: 수량/가격/입고일 형식 오류")
+    
+    if errors:
+        raise HTTPException(status_code=400, detail=errors[:100])
+    
+    # 4. 제품 일괄 INSERT (첫 선적 가격/선적 수량 합계 기준 - 단건 등록과 동일)
+    product_rows = []
+    for entry in products.values():
+        shipments = entry["shipments"]
+        product_rows.append({
+            **entry["product"],
+            "initial_stock": sum(s["quantity"] for s in shipments),
+            "supply_price": shipments[0]["supply_price"] if shipments else Decimal('0'),
+            "sale_price": shipments[0]["sale_price"] if shipments else Decimal('0'),
+            "is_active": 1,
+            "created_at": korea_time,
+            "updated_at": korea_time
+        })
+    db.execute(insert(Product), product_rows)
+    
+    product_ids = dict(db.query(Product.product_code, Product.id).filter(
+        Product.product_code.in_(products.keys())
+    ).all())
+    
+    # 5. 선적 일괄 INSERT
+    shipment_rows = []
+    for code, entry in products.items():
+        for s in entry["shipments"]:
+            shipment_rows.append({
+                "product_id": product_ids[code],
+                "shipment_no": s["shipment_no"],
+                "arrival_date": s["arrival_date"],
+                "initial_quantity": s["quantity"],
+                "current_quantity": s["quantity"],
+                "remaining_quantity": s["quantity"],
+                "supply_price": s["supply_price"],
+                "sale_price": s["sale_price"],
+                "is_active": 1,
+                "created_by": current.id,
+                "created_at": korea_time,
+                "updated_at": korea_time
+            })
+    
+    if shipment_rows:
+        db.execute(insert(ProductShipment), shipment_rows)
+        
+        # 6. 초기 가격 이력 일괄 INSERT (신규 제품의 선적만 있으므로 product_id로 조회)
+        new_shipments = db.query(
+            ProductShipment.id, ProductShipment.product_id, ProductShipment.arrival_date,
+            ProductShipment.remaining_quantity, ProductShipment.supply_price, ProductShipment.sale_price
+        ).filter(
+            ProductShipment.product_id.in_(product_ids.values())
+        ).all()
+        db.execute(insert(ShipmentPriceHistory), [{
+            "shipment_id": s.id,
+            "supply_price": s.supply_price,
+            "sale_price": s.sale_price,
+            "effective_date": s.arrival_date,
+            "reason": "초기 등록",
+            "changed_by": current.id,
+            "created_at": korea_time
+        } for s in new_shipments])
+        
+        # 재고 원장: 입고
+        record_inventory_movements(db, [{
+            "shipment_id": s.id,
+            "product_id": s.product_id,
+            "entry_type": "receipt",
+            "quantity_delta": s.remaining_quantity,
+            "occurred_at": korea_time,
+            "reference_type": "shipment",
+            "reference_id": s.id,
+            "created_by": current.id
+        } for s in new_shipments])
+    
+    # 7. 재고 상태
+    refresh_product_inventory_state(db, product_ids.values())
+    db.commit()
+    
+    # 8. 인덱스 재로드 후 미연결 주문 한 번에 재매칭
+    product_index.invalidate()
+    shipment_price_index.refresh(db)
+    rematch = rematch_unmatched_items(db)
+    
+    return {
+        "success": True,
+        "message": "제품 일괄 등록 완료",
+        "products": len(product_rows),
+        "shipments": len(shipment_rows),
+        "linked_items": rematch["linked"] + rematch["priced"]
+    }
+
+def _product_out(product, supply_price, sale_price, current_stock, metrics=None, sold_last_30d=0):
+    """ProductOut 응답 dict (현재 가격 = 가장 오래된 활성 선적 가격, 없으면 제품 가격)"""
+    return {
+        "id": product.id,
+        "name": product.name,
+        "product_code": product.product_code,
+        "seller_id": product.seller_id,
+        "initial_stock": product.initial_stock,
+        "supply_price": supply_price if supply_price is not None else product.supply_price,
+        "sale_price": sale_price if sale_price is not None else product.sale_price,
+        "is_active": product.is_active,
+        "thumbnail_url": product.thumbnail_url,
+        "detail_image_url": product.detail_image_url,
+        "current_stock": int(current_stock or 0),
+        "sold_quantity": metrics.sold_quantity if metrics else 0,
+        "sold_supply_amount": metrics.sold_supply_amount if metrics else Decimal('0'),
+        "sold_sale_amount": metrics.sold_sale_amount if metrics else Decimal('0'),
+        "sold_last_30d": int(sold_last_30d or 0),
+        "last_sold_at": metrics.last_sold_at if metrics else None
+    }
+
 # main.py의 제품 목록 조회 부분만 수정
 # 기존의 중복된 /products 엔드포인트를 하나로 통합
 
@@ -143,66 +366,507 @@ async def create_product(
 def list_products(
     include_inactive: int = 0,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
-    q = db.query(Product)
+    # 제품 + 현재 가격/재고(선적 기준) + 판매 지표를 한 쿼리로 조회
+    q = query_products_with_inventory(db)
     if not include_inactive:
         q = q.filter(Product.is_active == 1)
     
-    products = q.all()
+    return [_product_out(*row) for row in q.all()]
+
+# === 제품 목록 (서버 페이지네이션/필터/정렬) ===
+PRODUCT_LIST_FIELDS = {
+    "id": Product.id,
+    "name": Product.name,
+    "product_code": Product.product_code,
+    "seller_id": Product.seller_id,
+    "initial_stock": Product.initial_stock,
+    "supply_price": func.coalesce(ProductInventoryState.current_supply_price, Product.supply_price),
+    "sale_price": func.coalesce(ProductInventoryState.current_sale_price, Product.sale_price),
+    "is_active": Product.is_active,
+    "thumbnail_url": Product.thumbnail_url,
+    "detail_image_url": Product.detail_image_url,
+    "current_stock": func.coalesce(ProductInventoryState.current_stock, 0),
+    "reorder_threshold": ProductInventoryState.reorder_threshold,
+    "sold_quantity": func.coalesce(ProductSalesMetrics.sold_quantity, 0),
+    "sold_supply_amount": func.coalesce(ProductSalesMetrics.sold_supply_amount, 0),
+    "sold_sale_amount": func.coalesce(ProductSalesMetrics.sold_sale_amount, 0),
+    "sold_last_30d": None,  # 조회 시점 기준 최근 30일 (search_products에서 서브쿼리로 채움)
+    "last_sold_at": ProductSalesMetrics.last_sold_at,
+    "created_at": Product.created_at
+}
+MAX_PRODUCT_PAGE_SIZE = 500
+
+@router.get("/products/search")
+def search_products(
+    skip: int = 0,
+    limit: int = 50,
+    seller_id: Optional[int] = None,
+    is_active: Optional[int] = None,
+    min_stock: Optional[int] = None,
+    max_stock: Optional[int] = None,
+    low_stock: Optional[int] = None,    # 1이면 재고 <= 기준수량인 제품만
+    q: Optional[str] = None,            # 제품명/제품코드 앞부분 일치
+    sort: str = "created_at",           # stock | price | sales | sales_30d | revenue | last_sold | created_at
+    order: str = "desc",                # asc | desc
+    fields: Optional[str] = None,       # 콤마 구분 (예: id,name,current_stock)
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    # 권한별 필터링
+    if current.type == "seller":
+        seller_id = current.seller_id
     
-    # 각 제품의 현재 가격/재고 계산 (선적 기준)
-    for product in products:
-        # 현재 판매 가능한 가장 오래된 선적 찾기
-        current_shipment = db.query(ProductShipment).filter(
-            ProductShipment.product_id == product.id,
-            ProductShipment.remaining_quantity > 0,
-            ProductShipment.is_active == 1
-        ).order_by(ProductShipment.arrival_date.asc()).first()
-        
-        if current_shipment:
-            # 현재 가격 = 가장 오래된 활성 선적 가격
-            product.supply_price = current_shipment.supply_price
-            product.sale_price = current_shipment.sale_price
-            
-        # 총 재고 = 모든 활성 선적의 remaining_quantity 합
-        total_stock = db.query(func.sum(ProductShipment.remaining_quantity)).filter(
-            ProductShipment.product_id == product.id,
-            ProductShipment.is_active == 1
-        ).scalar() or 0
-        
-        product.current_stock = total_stock
+    limit = max(1, min(limit, MAX_PRODUCT_PAGE_SIZE))
+    recent = recent_sales_subquery(db)
+    list_fields = {**PRODUCT_LIST_FIELDS, "sold_last_30d": func.coalesce(recent.c.sold_last_30d, 0)}
+    
+    # 필요한 컬럼만 조회
+    if fields:
+        field_names = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in field_names if f not in PRODUCT_LIST_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"알 수 없는 필드: {', '.join(unknown)}")
+        if "id" not in field_names:
+            field_names.insert(0, "id")
+    else:
+        field_names = list(PRODUCT_LIST_FIELDS)
+    
+    query = db.query(
+        *[list_fields[f].label(f) for f in field_names]
+    ).select_from(Product).outerjoin(
+        ProductInventoryState, ProductInventoryState.product_id == Product.id
+    ).outerjoin(
+        ProductSalesMetrics, ProductSalesMetrics.product_id == Product.id
+    )
+    if "sold_last_30d" in field_names or sort == "sales_30d":
+        query = query.outerjoin(recent, recent.c.product_id == Product.id)
+    
+    # 필터
+    if seller_id:
+        query = query.filter(Product.seller_id == seller_id)
+    if is_active is not None:
+        query = query.filter(Product.is_active == is_active)
+    if min_stock is not None:
+        query = query.filter(ProductInventoryState.current_stock >= min_stock)
+    if max_stock is not None:
+        query = query.filter(func.coalesce(ProductInventoryState.current_stock, 0) <= max_stock)
+    if low_stock:
+        query = query.filter(ProductInventoryState.current_stock <= ProductInventoryState.reorder_threshold)
+    if q:
+        query = query.filter(or_(
+            Product.name.startswith(q, autoescape=True),
+            Product.product_code.startswith(q, autoescape=True)
+        ))
+    
+    total_count = query.order_by(None).count()
+    
+    # 정렬
+    if sort == "stock":
+        sort_column = ProductInventoryState.current_stock
+    elif sort == "price":
+        sort_column = list_fields["sale_price"]  # 반환값과 같은 식 (재고 상태 없으면 제품 가격)
+    elif sort == "sales":
+        sort_column = func.coalesce(ProductSalesMetrics.sold_quantity, 0)
+    elif sort == "sales_30d":
+        sort_column = list_fields["sold_last_30d"]
+    elif sort == "revenue":
+        sort_column = func.coalesce(ProductSalesMetrics.sold_sale_amount, 0)
+    elif sort == "last_sold":
+        sort_column = ProductSalesMetrics.last_sold_at
+    elif sort == "created_at":
+        sort_column = Product.created_at
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail="정렬 기준은 stock, price, sales, sales_30d, revenue, last_sold, created_at 중 하나"
+        )
+    
+    if order == "asc":
+        query = query.order_by(sort_column.asc(), Product.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Product.id.desc())
+    
+    rows = query.offset(skip).limit(limit).all()
+    
+    money_fields = {"supply_price", "sale_price", "sold_supply_amount", "sold_sale_amount"}
+    count_fields = {"current_stock", "sold_quantity", "sold_last_30d"}
+    products = []
+    for row in rows:
+        item = row._asdict()
+        for f in money_fields & item.keys():
+            item[f] = float(item[f]) if item[f] is not None else None
+        for f in count_fields & item.keys():
+            item[f] = int(item[f] or 0)
+        products.append(item)
+    
+    return {
+        "products": products,
+        "total": total_count,
+        "page": skip // limit + 1,
+        "pages": (total_count + limit - 1) // limit
+    }
+
+# 미연결 주문 재매칭 (수동 실행)
+@router.post("/products/rematch")
+def rematch_products(
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    result = rematch_unmatched_items(db)
+    return {"success": True, **result}
+
+# 미연결 코드 → 유사 제품 후보 (일괄)
+@router.get("/products/code-suggestions")
+def suggest_products_for_codes(
+    codes: Optional[str] = None,  # 콤마 구분, 없으면 전체 미연결 코드
+    limit: int = 5,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    if codes:
+        code_list = [c.strip() for c in codes.split(',') if c.strip()]
+    else:
+        code_list = [row[0] for row in db.query(OrderItem.product_code).filter(
+            OrderItem.product_id == None
+        ).distinct().all()]
+
+    return {
+        code: product_index.suggest(db, code, limit=limit)
+        for code in code_list
+    }
+
+# === 판매 속도 / 재고 소진 예측 (전체 카탈로그 한 번에) ===
+@router.get("/products/inventory-projection")
+def inventory_projection(
+    basis_days: int = 30,                   # 소진 예측 기준 기간 (7 | 30 | 90)
+    seller_id: Optional[int] = None,
+    max_cover_days: Optional[float] = None, # 이 일수 안에 소진되는 제품만
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    if basis_days not in PROJECTION_WINDOWS:
+        raise HTTPException(status_code=400, detail="기준 기간은 7, 30, 90 중 하나")
+    
+    # 권한별 필터링
+    if current.type == "seller":
+        seller_id = current.seller_id
+    
+    frame = get_inventory_projection(db, basis_days)
+    if seller_id:
+        frame = frame[frame['seller_id'] == seller_id]
+    if max_cover_days is not None:
+        frame = frame[frame['days_of_cover'] <= max_cover_days]
+    
+    # 빨리 소진되는 순 (판매 없는 제품은 뒤로)
+    frame = frame.sort_values(['days_of_cover', 'current_stock'], na_position='last')
+    
+    products = []
+    for product_id, row in frame.iterrows():
+        selling = pd.notna(row['days_of_cover'])
+        products.append({
+            "product_id": int(product_id),
+            "product_code": row['product_code'],
+            "name": row['name'],
+            "seller_id": int(row['seller_id']),
+            "current_stock": int(row['current_stock']),
+            **{f"velocity_{d}d": round(float(row[f'velocity_{d}d']), 3) for d in PROJECTION_WINDOWS},
+            "days_of_cover": round(float(row['days_of_cover']), 1) if selling else None,
+            "stockout_date": row['stockout_date'].date().isoformat() if pd.notna(row['stockout_date']) else None
+        })
+    
+    return {
+        "as_of": get_korea_time_naive().date().isoformat(),
+        "basis_days": basis_days,
+        "products": products
+    }
+
+# === 제품 이미지 일괄 조회 ===
+# ETag = 요청 제품들의 images_version 조합 → 변경 없으면 304 (이미지 쿼리 생략)
+MAX_IMAGE_BATCH = 200
+IMAGE_CACHE_CONTROL = "private, no-cache"
+
+def _images_etag(versions):
+    raw = ",".join(f"{pid}:{ver}" for pid, ver in sorted(versions))
+    return '"' + hashlib.md5(raw.encode()).hexdigest() + '"'
+
+def _images_not_modified(request: Request, etag):
+    return request.headers.get("if-none-match") == etag
+
+@router.get("/products/images")
+def get_products_images(
+    ids: str,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    try:
+        product_ids = list(dict.fromkeys(int(x) for x in ids.split(",") if x.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="잘못된 제품 ID")
+    if not product_ids:
+        raise HTTPException(status_code=400, detail="제품 ID를 입력하세요")
+    if len(product_ids) > MAX_IMAGE_BATCH:
+        raise HTTPException(status_code=400, detail=f"한 번에 최대 {MAX_IMAGE_BATCH}개까지 조회 가능합니다")
+    
+    versions = db.query(Product.id, Product.images_version).filter(
+        Product.id.in_(product_ids)
+    ).all()
+    etag = _images_etag(versions)
+    if _images_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL})
+    
+    images = db.query(
+        ProductImage.product_id, ProductImage.image_url, ProductImage.display_order
+    ).filter(
+        ProductImage.product_id.in_(product_ids)
+    ).order_by(ProductImage.product_id, ProductImage.display_order).all()
     
-    return products
+    grouped = {pid: [] for pid, _ in versions}
+    for img in images:
+        grouped[img.product_id].append({"url": img.image_url, "order": img.display_order})
+    
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+    return {
+        "images": grouped,
+        "versions": {pid: ver for pid, ver in versions}
+    }
 
 @router.get("/products/{product_id}", response_model=ProductOut)
-def get_product(product_id: int, db: Session = Depends(get_db), current: Account = Depends(get_current_account)):
-    p = db.query(Product).filter(Product.id == product_id).first()
-    if not p:
+def get_product(product_id: int, db: Session = Depends(get_db), current: Principal = Depends(get_current_account)):
+    row = query_products_with_inventory(db).filter(Product.id == product_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="제품 없음")
     
-    # 현재 가격 (가장 오래된 활성 선적)
-    current_shipment = db.query(ProductShipment).filter(
-        ProductShipment.product_id == product_id,
-        ProductShipment.remaining_quantity > 0,
-        ProductShipment.is_active == 1
-    ).order_by(ProductShipment.arrival_date.asc()).first()
+    return _product_out(*row)
+
+# === 제품 상세 (수정 모달용 일괄 조회) ===
+# 제품/이미지/매핑/활성 선적/선적별 최근 가격·재고 이력을 테이블당 1쿼리로 조회
+DETAIL_HISTORY_LIMIT = 20
+
+def _recent_per_shipment(db: Session, model, time_column, shipment_ids, limit):
+    """선적별 최근 이력 limit건 (ROW_NUMBER 윈도우로 한 쿼리)"""
+    ranked = db.query(
+        model.id.label('id'),
+        func.row_number().over(
+            partition_by=model.shipment_id,
+            order_by=(time_column.desc(), model.id.desc())
+        ).label('rn')
+    ).filter(model.shipment_id.in_(shipment_ids)).subquery()
     
-    if current_shipment:
-        p.supply_price = current_shipment.supply_price
-        p.sale_price = current_shipment.sale_price
+    rows = db.query(model).join(ranked, ranked.c.id == model.id).filter(
+        ranked.c.rn <= limit
+    ).order_by(model.shipment_id, ranked.c.rn).all()
     
-    # 총 재고
-    p.current_stock = db.query(func.sum(ProductShipment.remaining_quantity)).filter(
+    grouped = {}
+    for r in rows:
+        grouped.setdefault(r.shipment_id, []).append(r)
+    return grouped
+
+@router.get("/products/{product_id}/detail")
+def get_product_detail(
+    product_id: int,
+    history_limit: int = DETAIL_HISTORY_LIMIT,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    row = query_products_with_inventory(db).filter(Product.id == product_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="제품 없음")
+    history_limit = max(1, min(history_limit, 100))
+    
+    images = db.query(ProductImage).filter(
+        ProductImage.product_id == product_id
+    ).order_by(ProductImage.display_order).all()
+    
+    mappings = db.query(ProductCodeMapping).filter(
+        ProductCodeMapping.product_id == product_id
+    ).all()
+    
+    shipments = db.query(ProductShipment).filter(
         ProductShipment.product_id == product_id,
         ProductShipment.is_active == 1
-    ).scalar() or 0
+    ).order_by(ProductShipment.arrival_date.asc()).all()
     
-    return p
+    # limit+1건 조회 → 넘치면 *_has_more (화면은 전체 이력 API로 다시 조회)
+    shipment_ids = [s.id for s in shipments]
+    price_history, stock_history = {}, {}
+    if shipment_ids:
+        price_history = _recent_per_shipment(
+            db, ShipmentPriceHistory, ShipmentPriceHistory.created_at, shipment_ids, history_limit + 1
+        )
+        stock_history = _recent_per_shipment(
+            db, ShipmentStockAdjustment, ShipmentStockAdjustment.adjusted_at, shipment_ids, history_limit + 1
+        )
+    
+    return {
+        "product": _product_out(*row),
+        "images": [{"url": img.image_url, "order": img.display_order} for img in images],
+        "mappings": [{
+            "id": m.id,
+            "mapped_code": m.mapped_code,
+            "quantity_multiplier": m.quantity_multiplier,
+            "mapping_type": m.mapping_type,
+            "note": m.note
+        } for m in mappings],
+        "shipments": [{
+            "id": s.id,
+            "shipment_no": s.shipment_no,
+            "arrival_date": s.arrival_date.isoformat(),
+            "initial_quantity": s.initial_quantity,
+            "current_quantity": s.current_quantity,
+            "remaining_quantity": s.remaining_quantity,
+            "supply_price": float(s.supply_price),
+            "sale_price": float(s.sale_price),
+            "price_history": [{
+                "supply_price": float(h.supply_price),
+                "sale_price": float(h.sale_price),
+                "reason": h.reason,
+                "effective_date": h.effective_date.isoformat() if h.effective_date else None,
+                "created_at": h.created_at.isoformat() if h.created_at else None
+            } for h in price_history.get(s.id, [])[:history_limit]],
+            "price_history_has_more": len(price_history.get(s.id, [])) > history_limit,
+            "stock_history": [{
+                "adjustment_type": a.adjustment_type,
+                "quantity": a.quantity_delta,
+                "reason": a.reason,
+                "created_at": a.adjusted_at.isoformat() if a.adjusted_at else None
+            } for a in stock_history.get(s.id, [])[:history_limit]],
+            "stock_history_has_more": len(stock_history.get(s.id, [])) > history_limit
+        } for s in shipments]
+    }
+
+# === 제품 선적 타임라인 (가격 변경 / 재고 조정 / 판매 할당) ===
+# 선적별 (shipment_id, 시각) 인덱스를 쓰는 3개 조회를 UNION ALL 한 쿼리로 합쳐서 최신순 키셋 페이지네이션
+# 정렬 키: (occurred_at, event_type, event_id) 내림차순, cursor = 마지막 행의 정렬 키
+TIMELINE_EVENT_TYPES = ('adjustment', 'price', 'sale')
+TIMELINE_LIMIT = 50
+
+def _encode_timeline_cursor(occurred_at, event_type, event_id):
+    raw = f"{occurred_at.isoformat()}|{event_type}|{event_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_timeline_cursor(cursor: str):
+    try:
+        occurred_at, event_type, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if event_type not in TIMELINE_EVENT_TYPES:
+            raise ValueError
+        return datetime.fromisoformat(occurred_at), event_type, int(event_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="잘못된 cursor")
+
+def _timeline_before(time_column, id_column, event_type, cursor):
+    """cursor보다 뒤(더 오래된) 행 조건 - 이벤트 유형이 고정이라 (시각, id) 비교로 단순화"""
+    occurred_at, cursor_type, cursor_id = cursor
+    if event_type < cursor_type:
+        return time_column <= occurred_at
+    if event_type > cursor_type:
+        return time_column < occurred_at
+    return or_(time_column < occurred_at, and_(time_column == occurred_at, id_column < cursor_id))
+
+def _timeline_branch(event_type, model, time_column, shipment_ids, cursor, **columns):
+    """이벤트 유형 1개의 SELECT (없는 컬럼은 NULL)"""
+    typed_nulls = {
+        "quantity": Integer, "supply_price": Numeric(18, 2), "sale_price": Numeric(18, 2),
+        "effective_at": DateTime, "adjustment_type": String(20), "reason": String(255),
+        "actor_id": Integer, "order_item_id": Integer
+    }
+    query = select(
+        literal(event_type).label('event_type'),
+        model.id.label('event_id'),
+        model.shipment_id.label('shipment_id'),
+        time_column.label('occurred_at'),
+        *[columns.get(name, literal(None, type_=type_)).label(name) for name, type_ in typed_nulls.items()]
+    ).where(model.shipment_id.in_(shipment_ids), time_column != None)
+    if cursor:
+        query = query.where(_timeline_before(time_column, model.id, event_type, cursor))
+    return query
+
+@router.get("/products/{product_id}/timeline")
+def get_product_timeline(
+    product_id: int,
+    cursor: Optional[str] = None,
+    limit: int = TIMELINE_LIMIT,
+    types: Optional[str] = None,  # 콤마 구분 (adjustment,price,sale), 없으면 전체
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    product = db.query(Product.id, Product.seller_id).filter(Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="제품 없음")
+    if current.type == "seller" and product.seller_id != current.seller_id:
+        raise HTTPException(status_code=403, detail="권한이 없습니다")
+    
+    event_types = set(TIMELINE_EVENT_TYPES)
+    if types:
+        event_types = {t.strip() for t in types.split(',') if t.strip()}
+        if not event_types or not event_types <= set(TIMELINE_EVENT_TYPES):
+            raise HTTPException(status_code=400, detail="types는 adjustment, price, sale 중에서 선택")
+    limit = max(1, min(limit, 200))
+    position = _decode_timeline_cursor(cursor) if cursor else None
+    
+    shipment_ids = select(ProductShipment.id).where(ProductShipment.product_id == product_id)
+    branches = []
+    if 'price' in event_types:
+        branches.append(_timeline_branch(
+            'price', ShipmentPriceHistory, ShipmentPriceHistory.created_at, shipment_ids, position,
+            supply_price=ShipmentPriceHistory.supply_price, sale_price=ShipmentPriceHistory.sale_price,
+            effective_at=ShipmentPriceHistory.effective_date, reason=ShipmentPriceHistory.reason,
+            actor_id=ShipmentPriceHistory.changed_by
+        ))
+    if 'adjustment' in event_types:
+        branches.append(_timeline_branch(
+            'adjustment', ShipmentStockAdjustment, ShipmentStockAdjustment.adjusted_at, shipment_ids, position,
+            quantity=ShipmentStockAdjustment.quantity_delta, adjustment_type=ShipmentStockAdjustment.adjustment_type,
+            reason=ShipmentStockAdjustment.reason, actor_id=ShipmentStockAdjustment.adjusted_by
+        ))
+    if 'sale' in event_types:
+        branches.append(_timeline_branch(
+            'sale', FifoAllocation, FifoAllocation.allocated_at, shipment_ids, position,
+            quantity=-FifoAllocation.quantity, supply_price=FifoAllocation.supply_price,
+            sale_price=FifoAllocation.sale_price, effective_at=FifoAllocation.order_time,
+            order_item_id=FifoAllocation.order_item_id
+        ))
+    events = union_all(*branches).subquery('events') if len(branches) > 1 else branches[0].subquery('events')
+    
+    # 선적번호/작업자 이름까지 한 번에
+    rows = db.query(
+        events, ProductShipment.shipment_no, Account.username
+    ).join(
+        ProductShipment, ProductShipment.id == events.c.shipment_id
+    ).outerjoin(
+        Account, Account.id == events.c.actor_id
+    ).order_by(
+        events.c.occurred_at.desc(), events.c.event_type.desc(), events.c.event_id.desc()
+    ).limit(limit + 1).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "events": [{
+            "event_type": r.event_type,
+            "event_id": r.event_id,
+            "shipment_id": r.shipment_id,
+            "shipment_no": r.shipment_no,
+            "occurred_at": r.occurred_at.isoformat(),
+            "quantity": r.quantity,
+            "supply_price": float(r.supply_price) if r.supply_price is not None else None,
+            "sale_price": float(r.sale_price) if r.sale_price is not None else None,
+            "effective_at": r.effective_at.isoformat() if r.effective_at else None,
+            "adjustment_type": r.adjustment_type,
+            "reason": r.reason,
+            "actor": r.username,
+            "order_item_id": r.order_item_id
+        } for r in rows],
+        "next_cursor": _encode_timeline_cursor(rows[-1].occurred_at, rows[-1].event_type, rows[-1].event_id) if has_more else None
+    }
 
 @router.put("/products/{product_id}", response_model=ProductOut)
 async def update_product(
     product_id: int,
+    background_tasks: BackgroundTasks,
     name: str = Form(None),
     product_code: str = Form(None),
     seller_id: int = Form(None),
@@ -213,7 +877,7 @@ async def update_product(
     thumbnail_url: str = Form(None),      # 추가
     detail_image_url: str = Form(None),   # 추가
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     p = db.query(Product).filter(Product.id == product_id).first()
     if not p:
@@ -250,6 +914,11 @@ async def update_product(
 
     db.commit()
     db.refresh(p)
+    product_index.upsert_product(p)
+    
+    # 제품코드/가격이 바뀌었으면 미연결 주문 재매칭
+    if product_code is not None or supply_price is not None or sale_price is not None:
+        background_tasks.add_task(run_rematch_sweep)
     
     print(f"✅ 제품 {product_id} 업데이트 완료")
     print(f"   - thumbnail_url: {p.thumbnail_url}")
@@ -258,19 +927,41 @@ async def update_product(
     return p
 
 @router.delete("/products/{product_id}")
-def delete_product(product_id: int, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def delete_product(product_id: int, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     p = db.query(Product).filter(Product.id == product_id).first()
     if not p:
         raise HTTPException(status_code=404, detail="제품 없음")
     
+    # 연결된 주문 아이템의 FIFO 할당 해제 (선적 잔여 수량 복원, 할당 내역 삭제)
+    item_ids = [row.id for row in db.query(OrderItem.id).filter(OrderItem.product_id == product_id).all()]
+    release_fifo_allocations(db, item_ids, note="제품 삭제로 할당 해제")
+    db.query(FifoAllocation).filter(FifoAllocation.product_id == product_id).delete(synchronize_session=False)
+    
     # order_items의 product_id를 NULL로 변경 (연결 해제)
     db.query(OrderItem).filter(OrderItem.product_id == product_id).update(
         {"product_id": None}
     )
     
-    # 제품 완전 삭제
+    # 재고 상태/판매 지표 삭제 후 제품 완전 삭제
+    db.query(ProductInventoryState).filter(ProductInventoryState.product_id == product_id).delete()
+    db.query(ProductSalesMetrics).filter(ProductSalesMetrics.product_id == product_id).delete()
+    db.query(ProductDailySales).filter(ProductDailySales.product_id == product_id).delete()
+    db.query(StockAlert).filter(StockAlert.product_id == product_id).delete()
+    db.query(InventorySnapshot).filter(InventorySnapshot.product_id == product_id).delete()
+    # 재고 원장 → 선적(가격 이력/재고 조정) → 매핑/이미지/랭킹/재고 조정 순으로 삭제 (FK)
+    db.query(InventoryLedger).filter(InventoryLedger.product_id == product_id).delete(synchronize_session=False)
+    shipment_ids = select(ProductShipment.id).where(ProductShipment.product_id == product_id)
+    db.query(ShipmentPriceHistory).filter(ShipmentPriceHistory.shipment_id.in_(shipment_ids)).delete(synchronize_session=False)
+    db.query(ShipmentStockAdjustment).filter(ShipmentStockAdjustment.shipment_id.in_(shipment_ids)).delete(synchronize_session=False)
+    db.query(ProductShipment).filter(ProductShipment.product_id == product_id).delete(synchronize_session=False)
+    db.query(ProductCodeMapping).filter(ProductCodeMapping.product_id == product_id).delete(synchronize_session=False)
+    db.query(ProductImage).filter(ProductImage.product_id == product_id).delete(synchronize_session=False)
+    db.query(ProductRankings).filter(ProductRankings.product_id == product_id).delete(synchronize_session=False)
+    db.query(StockAdjustment).filter(StockAdjustment.product_id == product_id).delete(synchronize_session=False)
     db.delete(p)
     db.commit()
+    product_index.remove_product(product_id)
+    shipment_price_index.invalidate()
     return {"ok": True, "message": "제품이 완전히 삭제되었습니다"}
 
 
@@ -281,7 +972,7 @@ def adjust_stock(
     quantity: int = Form(...),
     note: str = Form(...),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     # 선적 시스템으로 대체됨
     raise HTTPException(
@@ -299,10 +990,13 @@ async def save_product_images(
     product_id: int,
     images: str = Form(...),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     try:
         db.query(ProductImage).filter(ProductImage.product_id == product_id).delete()
+        db.query(Product).filter(Product.id == product_id).update(
+            {Product.images_version: Product.images_version + 1}, synchronize_session=False
+        )
         image_list = json.loads(images)
         for img_data in image_list[:10]:
             new_image = ProductImage(
@@ -320,8 +1014,17 @@ async def save_product_images(
 @router.get("/products/{product_id}/images")
 def get_product_images(
     product_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db)
 ):
+    version = db.query(Product.images_version).filter(Product.id == product_id).scalar()
+    etag = _images_etag([(product_id, version)])
+    if _images_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+    
     images = db.query(ProductImage).filter(
         ProductImage.product_id == product_id
     ).order_by(ProductImage.display_order).all()
@@ -330,12 +1033,13 @@ def get_product_images(
 @router.post("/products/{product_id}/mappings")
 def add_product_mapping(
     product_id: int,
+    background_tasks: BackgroundTasks,
     mapped_code: str = Form(...),
     quantity_multiplier: int = Form(1),
     mapping_type: str = Form('alias'),
     note: str = Form(None),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     # 제품 존재 확인
     product = db.query(Product).filter(Product.id == product_id).first()
@@ -359,71 +1063,25 @@ def add_product_mapping(
         note=note
     )
     db.add(mapping)
-    db.commit()
+    db.flush()
     
-    # 미확인 주문들 가져오기 (update 대신 select)
-    unmatched_items = db.query(OrderItem).filter(
-        OrderItem.product_code == mapped_code,
-        OrderItem.product_id == None
-    ).all()
+    # 미확인 주문들 일괄 연결 (UPDATE 1회) + 일자별 통계 증감분
+    updated_count, deltas = relink_unmatched_items(db, product, mapped_code, quantity_multiplier)
+    
+    # 통계 부분 반영 (누적/이번달/이번주/전일)
+    if updated_count > 0:
+        apply_stats_deltas(db, deltas)
     
-    # 각 아이템 업데이트 및 차액 계산
-    updated_count = 0
-    total_supply_diff = Decimal('0')
-    total_sale_diff = Decimal('0')
-    affected_seller_id = product.seller_id
-
-    for item in unmatched_items:
-        # 이전 값 저장
-        old_supply_total = item.supply_price * item.quantity
-        old_sale_total = item.sale_price * item.quantity
-        
-        # 업데이트
-        item.product_id = product.id
-        item.seller_id_snapshot = product.seller_id
-        item.quantity = item.quantity * quantity_multiplier
-        
-        if item.supply_price == 0:
-            item.supply_price = product.supply_price
-            item.sale_price = product.sale_price
-        
-        # 차액 계산
-        new_supply_total = item.supply_price * item.quantity
-        new_sale_total = item.sale_price * item.quantity
-        total_supply_diff += (new_supply_total - old_supply_total)
-        total_sale_diff += (new_sale_total - old_sale_total)
-        
-        updated_count += 1
-
     db.commit()
-
-    # 통계 부분 계산
+    product_index.add_mapping(mapping)
+    
+    # 랭킹은 해당 입점사 + 전체만 갱신
     if updated_count > 0:
-        from models import DashboardSummary
-        from crud import TOTAL_STATS_SELLER_ID, update_product_rankings
-        
-        # 해당 입점사 통계 업데이트
-        summary = db.query(DashboardSummary).filter(
-            DashboardSummary.seller_id == affected_seller_id
-        ).first()
-        if summary:
-            summary.total_supply_amount += total_supply_diff
-            summary.total_sale_amount += total_sale_diff
-            summary.last_updated = get_korea_time_naive()
-        
-        # 전체 통계 업데이트
-        total_summary = db.query(DashboardSummary).filter(
-            DashboardSummary.seller_id == TOTAL_STATS_SELLER_ID
-        ).first()
-        if total_summary:
-            total_summary.total_supply_amount += total_supply_diff
-            total_summary.total_sale_amount += total_sale_diff
-            total_summary.last_updated = get_korea_time_naive()
-        
-        # 랭킹 업데이트
-        update_product_rankings(db)
-        
+        update_product_rankings(db, seller_id=product.seller_id)
         db.commit()
+    
+    # 남은 미연결 주문 재매칭
+    background_tasks.add_task(run_rematch_sweep)
 
     return {
         "success": True, 
@@ -435,7 +1093,7 @@ def add_product_mapping(
 def get_product_mappings(
     product_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     mappings = db.query(ProductCodeMapping).filter(
         ProductCodeMapping.product_id == product_id
@@ -454,7 +1112,7 @@ def get_product_mappings(
 def delete_product_mapping(
     mapping_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     mapping = db.query(ProductCodeMapping).filter(
         ProductCodeMapping.id == mapping_id
@@ -465,5 +1123,6 @@ def delete_product_mapping(
     
     db.delete(mapping)
     db.commit()
+    product_index.remove_mapping(mapping)
     
     return {"success": True}
\ No newline at end of file
@@ -6,9 +6,9 @@ from sqlalchemy import func, case
 from datetime import datetime
 
 
-from models import Seller, Product, Order, OrderItem, Account  # Account 추가
+from models import Seller, Product, Order, OrderItem
 from db import get_db
-from auth import get_current_account, admin_only
+from auth import get_current_account, admin_only, Principal
 from crud import VALID_STATUS_FOR_STATS, get_korea_time_naive
 from schemas import SellerCreate, SellerOut  # 추가!
 
@@ -17,7 +17,7 @@ router = APIRouter()
 
 # === Sellers CRUD ===
 @router.post("/sellers", response_model=SellerOut)
-def create_seller(seller: SellerCreate, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def create_seller(seller: SellerCreate, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     if db.query(Seller).filter(Seller.name == seller.name).first():
         raise HTTPException(status_code=400, detail="이미 존재하는 입점사명")
     new = Seller(
@@ -32,7 +32,7 @@ def create_seller(seller: SellerCreate, db: Session = Depends(get_db), current:
     return new
 
 @router.get("/sellers")
-def list_sellers(db: Session = Depends(get_db), current: Account = Depends(get_current_account)):
+def list_sellers(db: Session = Depends(get_db), current: Principal = Depends(get_current_account)):
     from sqlalchemy import func, case, text
     
     # 제품 수 계산
@@ -73,14 +73,14 @@ def list_sellers(db: Session = Depends(get_db), current: Account = Depends(get_c
     
     return result
 @router.get("/sellers/{seller_id}", response_model=SellerOut)
-def get_seller(seller_id: int, db: Session = Depends(get_db), current: Account = Depends(get_current_account)):
+def get_seller(seller_id: int, db: Session = Depends(get_db), current: Principal = Depends(get_current_account)):
     s = db.query(Seller).filter(Seller.id == seller_id).first()
     if not s:
         raise HTTPException(status_code=404, detail="입점사 없음")
     return s
 
 @router.put("/sellers/{seller_id}", response_model=SellerOut)
-def update_seller(seller_id: int, body: SellerCreate, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def update_seller(seller_id: int, body: SellerCreate, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     s = db.query(Seller).filter(Seller.id == seller_id).first()
     if not s:
         raise HTTPException(status_code=404, detail="입점사 없음")
@@ -93,7 +93,7 @@ def update_seller(seller_id: int, body: SellerCreate, db: Session = Depends(get_
     return s
 
 @router.delete("/sellers/{seller_id}")
-def delete_seller(seller_id: int, db: Session = Depends(get_db), current: Account = Depends(admin_only)):
+def delete_seller(seller_id: int, db: Session = Depends(get_db), current: Principal = Depends(admin_only)):
     seller = db.query(Seller).filter(Seller.id == seller_id).first()
     if not seller:
         raise HTTPException(status_code=404, detail="입점사 없음")
@@ -1,14 +1,24 @@
+import json
 from typing import List, Optional
 from decimal import Decimal
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from fastapi import APIRouter, HTTPException, Depends, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, update, insert
 
-from models import ProductShipment, ShipmentPriceHistory, ShipmentStockAdjustment, Product, Account
+from models import (
+    ProductShipment, ShipmentPriceHistory, ShipmentStockAdjustment, Product,
+    ProductInventoryState, StockAlert
+)
 from db import get_db
-from auth import get_current_account, admin_only
-from crud import get_korea_time_naive
+from auth import get_current_account, admin_only, Principal
+from crud import (
+    get_korea_time_naive, refresh_product_inventory_state, sync_stock_alerts, resolve_stock_alerts,
+    reprice_shipment_allocations, record_inventory_movements, get_stock_at, get_inventory_movements,
+    decrement_shipment_stock
+)
+from product_index import product_index
+from shipment_price_index import shipment_price_index
 
 router = APIRouter()
 
@@ -17,7 +27,7 @@ router = APIRouter()
 def get_product_shipments(
     product_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     shipments = db.query(ProductShipment).filter(
         ProductShipment.product_id == product_id,
@@ -49,7 +59,7 @@ def add_shipment(
     supply_price: float = Form(...),
     sale_price: float = Form(...),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     # 날짜 처리
     if arrival_date:
@@ -86,9 +96,157 @@ def add_shipment(
     )
     db.add(price_history)
     
+    # 재고 원장: 입고
+    record_inventory_movements(db, [{
+        "shipment_id": shipment.id,
+        "product_id": product_id,
+        "entry_type": "receipt",
+        "quantity_delta": quantity,
+        "reference_type": "shipment",
+        "reference_id": shipment.id,
+        "created_by": current.id
+    }])
+    
+    refresh_product_inventory_state(db, [product_id])
     db.commit()
+    shipment_price_index.refresh(db)
     return {"success": True, "shipment_id": shipment.id}
 
+# 선적 일괄 입고 (컨테이너 1개 = 선적번호 1개, 여러 제품)
+# lines: [{"product_code", "quantity", "supply_price", "sale_price"}] JSON 문자열
+# 매핑코드(세트 등)는 수량배수만큼 수량을 늘리고 가격은 개당 가격으로 나눔
+@router.post("/shipments/receipts")
+def receive_shipment(
+    shipment_no: str = Form(...),
+    arrival_date: str = Form(None),
+    lines: str = Form(...),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    try:
+        line_list = json.loads(lines)
+        if not isinstance(line_list, list):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="입고 품목 형식 오류")
+    if not line_list:
+        raise HTTPException(status_code=400, detail="입고 품목이 없습니다")
+    
+    korea_time = get_korea_time_naive()
+    if arrival_date:
+        try:
+            arrival = datetime.strptime(arrival_date + ' 00:00:00', '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="입고일 형식은 YYYY-MM-DD")
+    else:
+        arrival = korea_time
+    
+    # 1. 행 검증 + 제품코드 해석 (제품코드 인덱스, DB 조회 없음)
+    errors = []
+    receipts = {}  # product_id -> {"product_code", "quantity", "supply_price", "sale_price"}
+    for number, line in enumerate(line_list, start=1):
+        code = str(line.get("product_code") or "").strip() if isinstance(line, dict) else ""
+        if not code:
+            errors.append(f"{number}번째 품목: 제품코드 없음")
+            continue
+        product_id, multiplier = product_index.resolve(db, code)
+        if not product_id:
+            errors.append(f"{number}번째 품목: 등록되지 않은 제품코드 ({code})")
+            continue
+        if product_id in receipts:
+            errors.append(f"{number}번째 품목: 같은 제품이 중복됨 ({code})")
+            continue
+        try:
+            quantity = int(line.get("quantity"))
+            supply = Decimal(str(line.get("supply_price", 0)))
+            sale = Decimal(str(line.get("sale_price", 0)))
+        except (TypeError, ValueError, ArithmeticError):
+            errors.append(f"{number}번째 품목: 수량/가격 형식 오류 ({code})")
+            continue
+        if quantity <= 0 or supply < 0 or sale < 0:
+            errors.append(f"{number}번째 품목: 수량은 1 이상, 가격은 0 이상 ({code})")
+            continue
+        receipts[product_id] = {
+            "product_code": code,
+            "quantity": quantity * multiplier,
+            "supply_price": (supply / multiplier).quantize(Decimal('0.01')),
+            "sale_price": (sale / multiplier).quantize(Decimal('0.01'))
+        }
+    
+    # 같은 선적번호로 이미 입고된 제품
+    if receipts:
+        duplicated = db.query(ProductShipment.product_id).filter(
+            ProductShipment.shipment_no == shipment_no,
+            ProductShipment.product_id.in_(receipts.keys())
+        ).all()
+        for row in duplicated:
+            errors.append(f"이미 입고된 선적: {shipment_no} ({receipts[row.product_id]['product_code']})")
+    
+    if errors:
+        raise HTTPException(status_code=400, detail=errors[:100])
+    
+    # 2. 선적 일괄 INSERT
+    db.execute(insert(ProductShipment), [{
+        "product_id": product_id,
+        "shipment_no": shipment_no,
+        "arrival_date": arrival,
+        "initial_quantity": r["quantity"],
+        "current_quantity": r["quantity"],
+        "remaining_quantity": r["quantity"],
+        "supply_price": r["supply_price"],
+        "sale_price": r["sale_price"],
+        "is_active": 1,
+        "created_by": current.id,
+        "created_at": korea_time,
+        "updated_at": korea_time
+    } for product_id, r in receipts.items()])
+    
+    # 3. 초기 가격 이력 / 재고 원장 일괄 INSERT (선적번호 + 제품으로 새 선적 id 조회)
+    new_shipments = db.query(
+        ProductShipment.id, ProductShipment.product_id, ProductShipment.remaining_quantity,
+        ProductShipment.supply_price, ProductShipment.sale_price
+    ).filter(
+        ProductShipment.shipment_no == shipment_no,
+        ProductShipment.product_id.in_(receipts.keys())
+    ).all()
+    db.execute(insert(ShipmentPriceHistory), [{
+        "shipment_id": s.id,
+        "supply_price": s.supply_price,
+        "sale_price": s.sale_price,
+        "effective_date": arrival,
+        "reason": "초기 등록",
+        "changed_by": current.id,
+        "created_at": korea_time
+    } for s in new_shipments])
+    record_inventory_movements(db, [{
+        "shipment_id": s.id,
+        "product_id": s.product_id,
+        "entry_type": "receipt",
+        "quantity_delta": s.remaining_quantity,
+        "occurred_at": korea_time,
+        "reference_type": "shipment",
+        "reference_id": s.id,
+        "created_by": current.id
+    } for s in new_shipments])
+    
+    # 4. 재고 상태
+    refresh_product_inventory_state(db, receipts.keys())
+    db.commit()
+    shipment_price_index.refresh(db)
+    
+    return {
+        "success": True,
+        "shipment_no": shipment_no,
+        "products": len(new_shipments),
+        "quantity": sum(r["quantity"] for r in receipts.values()),
+        "shipments": [{
+            "shipment_id": s.id,
+            "product_id": s.product_id,
+            "product_code": receipts[s.product_id]["product_code"],
+            "quantity": s.remaining_quantity
+        } for s in new_shipments]
+    }
+
 # 선적 가격 수정
 @router.put("/shipments/{shipment_id}/price")
 def update_shipment_price(
@@ -98,7 +256,7 @@ def update_shipment_price(
     reason: str = Form(None),
     effective_date: str = Form(None),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
     shipment = db.query(ProductShipment).filter(ProductShipment.id == shipment_id).first()
     if not shipment:
@@ -127,34 +285,53 @@ def update_shipment_price(
     shipment.sale_price = Decimal(str(sale_price))
     shipment.updated_at = get_korea_time_naive()
     
+    # 과거 적용일이면 이미 판매된 아이템 가격/통계 소급 반영
+    repriced = {"items": 0, "skipped_manual": 0}
+    if effective_date:
+        db.flush()
+        repriced = reprice_shipment_allocations(db, shipment_id, eff_date, current.id, reason)
+    
+    refresh_product_inventory_state(db, [shipment.product_id])
     db.commit()
-    return {"success": True}
+    shipment_price_index.refresh(db)
+    return {"success": True, "repriced_items": repriced["items"], "skipped_manual_items": repriced["skipped_manual"]}
 
 # 선적 재고 조정
 @router.post("/shipments/{shipment_id}/adjust-stock")
 def adjust_shipment_stock(
     shipment_id: int,
-    adjustment_type: str = Form(...),  # 'add' or 'subtract'
+    adjustment_type: str = Form(...),  # 'add', 'subtract' or 'dispose'(폐기)
     quantity: int = Form(...),
     reason: str = Form(...),
     db: Session = Depends(get_db),
-    current: Account = Depends(admin_only)
+    current: Principal = Depends(admin_only)
 ):
-    shipment = db.query(ProductShipment).filter(ProductShipment.id == shipment_id).first()
+    if adjustment_type not in ('add', 'subtract', 'dispose'):
+        raise HTTPException(status_code=400, detail="조정 유형은 add, subtract, dispose 중 하나")
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="수량은 1 이상이어야 합니다")
+    
+    shipment = db.query(ProductShipment.id, ProductShipment.product_id).filter(ProductShipment.id == shipment_id).first()
     if not shipment:
         raise HTTPException(status_code=404, detail="선적을 찾을 수 없습니다")
     
-    # 수량 조정
+    # 수량 조정 - 읽은 값으로 쓰지 않고 DB에서 원자적으로 증감 (동시 조정/주문 업로드와 경합 없음)
     if adjustment_type == 'add':
         delta = quantity
-        shipment.current_quantity += quantity
-        shipment.remaining_quantity += quantity
-    else:  # subtract
+        db.execute(
+            update(ProductShipment)
+            .where(ProductShipment.id == shipment_id)
+            .values(
+                current_quantity=ProductShipment.current_quantity + quantity,
+                remaining_quantity=ProductShipment.remaining_quantity + quantity,
+                updated_at=get_korea_time_naive()
+            )
+            .execution_options(synchronize_session=False)
+        )
+    else:  # subtract / dispose: 잔량이 충분할 때만 차감
         delta = -quantity
-        if shipment.remaining_quantity < quantity:
+        if not decrement_shipment_stock(db, shipment_id, quantity, current_quantity=True):
             raise HTTPException(status_code=400, detail="재고가 부족합니다")
-        shipment.current_quantity -= quantity
-        shipment.remaining_quantity -= quantity
     
     # 조정 이력 저장
     adjustment = ShipmentStockAdjustment(
@@ -166,17 +343,31 @@ def adjust_shipment_stock(
         adjusted_at=get_korea_time_naive()
     )
     db.add(adjustment)
+    db.flush()
     
-    shipment.updated_at = get_korea_time_naive()
+    # 재고 원장: 조정 / 폐기
+    record_inventory_movements(db, [{
+        "shipment_id": shipment_id,
+        "product_id": shipment.product_id,
+        "entry_type": "disposal" if adjustment_type == 'dispose' else "adjustment",
+        "quantity_delta": delta,
+        "reference_type": "shipment_adjustment",
+        "reference_id": adjustment.id,
+        "note": reason,
+        "created_by": current.id
+    }])
+    
+    refresh_product_inventory_state(db, [shipment.product_id])
+    new_quantity = db.query(ProductShipment.remaining_quantity).filter(ProductShipment.id == shipment_id).scalar()
     db.commit()
     
-    return {"success": True, "new_quantity": shipment.remaining_quantity}
+    return {"success": True, "new_quantity": new_quantity}
 
 @router.get("/shipments/{shipment_id}/price-history")
 def get_shipment_price_history(
     shipment_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     """선적 가격 변동 이력 조회"""
     history = db.query(ShipmentPriceHistory).filter(
@@ -195,16 +386,181 @@ def get_shipment_price_history(
 def get_shipment_stock_history(
     shipment_id: int,
     db: Session = Depends(get_db),
-    current: Account = Depends(get_current_account)
+    current: Principal = Depends(get_current_account)
 ):
     """선적 재고 조정 이력 조회"""
     adjustments = db.query(ShipmentStockAdjustment).filter(
         ShipmentStockAdjustment.shipment_id == shipment_id
-    ).order_by(ShipmentStockAdjustment.created_at.desc()).all()
+    ).order_by(ShipmentStockAdjustment.adjusted_at.desc(), ShipmentStockAdjustment.id.desc()).all()
     
     return [{
         "adjustment_type": a.adjustment_type,
-        "quantity": a.quantity,
+        "quantity": a.quantity_delta,
         "reason": a.reason,
-        "created_at": a.created_at.isoformat() if a.created_at else None
-    } for a in adjustments]
\ No newline at end of file
+        "created_at": a.adjusted_at.isoformat() if a.adjusted_at else None
+    } for a in adjustments]
+
+# === 재고 부족 알림 ===
+# 재고 기준수량 설정 (빈 값이면 해제)
+@router.put("/products/{product_id}/reorder-threshold")
+def set_reorder_threshold(
+    product_id: int,
+    threshold: Optional[int] = Form(None),
+    db: Session = Depends(get_db),
+    current: Principal = Depends(admin_only)
+):
+    if threshold is not None and threshold < 0:
+        raise HTTPException(status_code=400, detail="기준수량은 0 이상이어야 합니다")
+    
+    state = db.query(ProductInventoryState).filter(ProductInventoryState.product_id == product_id).first()
+    if not state:
+        if not db.query(Product.id).filter(Product.id == product_id).first():
+            raise HTTPException(status_code=404, detail="제품 없음")
+        refresh_product_inventory_state(db, [product_id])
+        db.flush()
+        state = db.query(ProductInventoryState).filter(ProductInventoryState.product_id == product_id).first()
+    
+    state.reorder_threshold = threshold
+    if threshold is None:
+        resolve_stock_alerts(db, product_id)
+    else:
+        sync_stock_alerts(db, [state])
+    db.commit()
+    
+    return {"success": True, "product_id": product_id, "reorder_threshold": threshold, "current_stock": state.current_stock}
+
+# 알림 피드 (기본: 열린 알림, 최근 변경순)
+@router.get("/stock-alerts")
+def list_stock_alerts(
+    status: str = "open",  # open | resolved | all
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    query = db.query(
+        StockAlert, Product.product_code, Product.name, Product.seller_id
+    ).join(Product, Product.id == StockAlert.product_id)
+    
+    if status == "open":
+        query = query.filter(StockAlert.resolved_at == None)
+    elif status == "resolved":
+        query = query.filter(StockAlert.resolved_at != None)
+    elif status != "all":
+        raise HTTPException(status_code=400, detail="status는 open, resolved, all 중 하나")
+    
+    # 권한별 필터링
+    if current.type == "seller":
+        query = query.filter(Product.seller_id == current.seller_id)
+    
+    limit = max(1, min(limit, 500))
+    total_count = query.count()
+    rows = query.order_by(StockAlert.updated_at.desc(), StockAlert.id.desc()).offset(skip).limit(limit).all()
+    
+    return {
+        "alerts": [{
+            "id": alert.id,
+            "product_id": alert.product_id,
+            "product_code": product_code,
+            "name": name,
+            "seller_id": seller_id,
+            "alert_type": alert.alert_type,
+            "current_stock": alert.current_stock,
+            "threshold": alert.threshold,
+            "created_at": alert.created_at.isoformat(),
+            "updated_at": alert.updated_at.isoformat(),
+            "resolved_at": alert.resolved_at.isoformat() if alert.resolved_at else None
+        } for alert, product_code, name, seller_id in rows],
+        "total": total_count,
+        "page": skip // limit + 1,
+        "pages": (total_count + limit - 1) // limit
+    }
+
+# === 재고 원장 조회 ===
+def _ledger_product_filter(db: Session, current: Principal, seller_id: Optional[int], product_id: Optional[int]):
+    """권한/필터에 맞는 제품 id 목록 (전체면 None)"""
+    if current.type == "seller":
+        seller_id = current.seller_id
+    if product_id:
+        query = db.query(Product.id).filter(Product.id == product_id)
+        if seller_id:
+            query = query.filter(Product.seller_id == seller_id)
+        return [row.id for row in query.all()]
+    if seller_id:
+        return [row.id for row in db.query(Product.id).filter(Product.seller_id == seller_id).all()]
+    return None
+
+def _parse_day(value: str):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="날짜 형식은 YYYY-MM-DD")
+
+# 특정 날짜 말일 기준 제품별 재고
+@router.get("/inventory/stock-at")
+def get_stock_on_date(
+    date: str,
+    seller_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    day = _parse_day(date)
+    product_ids = _ledger_product_filter(db, current, seller_id, product_id)
+    
+    stock = get_stock_at(db, day + timedelta(days=1), product_ids)
+    products = {p.id: p for p in db.query(Product.id, Product.product_code, Product.name, Product.seller_id).filter(
+        Product.id.in_(stock.keys())
+    ).all()} if stock else {}
+    
+    return {
+        "date": day.date().isoformat(),
+        "products": [{
+            "product_id": pid,
+            "product_code": products[pid].product_code,
+            "name": products[pid].name,
+            "seller_id": products[pid].seller_id,
+            "stock": quantity
+        } for pid, quantity in sorted(stock.items()) if pid in products]
+    }
+
+# 기간 입출고 현황 (기초 + 입고/판매/조정/폐기 = 기말)
+@router.get("/inventory/movements")
+def get_stock_movements(
+    start_date: str,
+    end_date: str,
+    seller_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current: Principal = Depends(get_current_account)
+):
+    start = _parse_day(start_date)
+    end = _parse_day(end_date) + timedelta(days=1)  # end_date 포함
+    if start >= end:
+        raise HTTPException(status_code=400, detail="시작일이 종료일보다 늦습니다")
+    product_ids = _ledger_product_filter(db, current, seller_id, product_id)
+    
+    report = get_inventory_movements(db, start, end, product_ids)
+    products = {p.id: p for p in db.query(Product.id, Product.product_code, Product.name, Product.seller_id).filter(
+        Product.id.in_(report.keys())
+    ).all()} if report else {}
+    rows = sorted((pid for pid in report if pid in products), key=lambda pid: products[pid].product_code)
+    
+    limit = max(1, min(limit, 500))
+    total_count = len(rows)
+    return {
+        "start_date": start.date().isoformat(),
+        "end_date": (end - timedelta(days=1)).date().isoformat(),
+        "movements": [{
+            "product_id": pid,
+            "product_code": products[pid].product_code,
+            "name": products[pid].name,
+            "seller_id": products[pid].seller_id,
+            **report[pid]
+        } for pid in rows[skip:skip + limit]],
+        "total": total_count,
+        "page": skip // limit + 1,
+        "pages": (total_count + limit - 1) // limit
+    }
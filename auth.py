@@ -1,23 +1,65 @@
 import os
+import time
+import secrets
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends, APIRouter, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+from sqlalchemy import update
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from db import get_db
-from models import Account
+from models import Account, RefreshToken
+from crud import get_korea_time_naive
 
 # === JWT 설정 ===
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# === 리프레시 토큰 ===
+# 액세스 토큰이 만료되면 비밀번호(bcrypt) 없이 /token/refresh로 재발급 - 리프레시 토큰은 매번 교체
+# 저장은 sha256 (무작위 32바이트라 bcrypt 불필요), 계정 token_version이 바뀌면 같이 무효
+REFRESH_TOKEN_EXPIRE_DAYS = 14
+REFRESH_REUSE_GRACE = 30  # 초, 다른 탭이 방금 교체한 토큰은 탈취로 보지 않고 409
+
+# === 인증 주체 캐시 ===
+# 토큰 서명/만료는 매 요청 검증하고, 계정 행은 PRINCIPAL_CACHE_TTL 동안 메모리에서 재사용 (LRU)
+# 토큰의 ver 클레임과 계정 token_version이 다르면 401 → 권한 변경/비밀번호 변경/삭제 시 버전 증가
+# 워커별 캐시라 다른 워커에서 바꾼 버전은 최대 TTL 뒤에 반영됨
+PRINCIPAL_CACHE_TTL = 30  # 초
+PRINCIPAL_CACHE_SIZE = 1024
+
+# === 비밀번호 해시 전용 풀 ===
+# bcrypt(요청당 ~250ms)를 이벤트 루프/기본 스레드풀 밖의 고정 크기 풀에서 실행
+# 대기 작업이 PASSWORD_QUEUE_LIMIT를 넘으면 바로 503 (로그인 폭주가 일반 API를 굶기지 않도록)
+# BCRYPT_ROUNDS를 바꾸면 기존 해시는 다음 로그인 때 새 설정으로 다시 해시됨
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+SLOW_QUEUE_WAIT = 1.0  # 초, 이보다 오래 기다린 작업은 로그
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_lock = threading.Lock()
+_password_stats = {
+    "pending": 0,          # 대기 + 실행 중
+    "completed": 0,
+    "rejected": 0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0
+}
+
 # === Auth helpers ===
 def verify_password(plain, hashed): 
     return pwd_context.verify(plain, hashed)
@@ -25,6 +67,47 @@ def verify_password(plain, hashed):
 def get_password_hash(password): 
     return pwd_context.hash(password)
 
+def _submit_password_task(fn, *args):
+    """해시 풀에 작업 제출 (대기 한도 초과 시 503), 큐 대기 시간 기록"""
+    with _password_lock:
+        if _password_stats["pending"] >= PASSWORD_QUEUE_LIMIT:
+            _password_stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="요청이 많습니다. 잠시 후 다시 시도하세요")
+        _password_stats["pending"] += 1
+    submitted = time.monotonic()
+
+    def task():
+        waited = time.monotonic() - submitted
+        try:
+            return fn(*args)
+        finally:
+            with _password_lock:
+                _password_stats["pending"] -= 1
+                _password_stats["completed"] += 1
+                _password_stats["queue_wait_total"] += waited
+                _password_stats["queue_wait_max"] = max(_password_stats["queue_wait_max"], waited)
+            if waited > SLOW_QUEUE_WAIT:
+                print(f"⚠️ 비밀번호 해시 대기 {waited:.2f}초")
+
+    return _password_executor.submit(task)
+
+async def run_password_task(fn, *args):
+    """async 라우트용: 해시 풀에서 실행하고 결과 대기 (이벤트 루프는 막지 않음)"""
+    return await asyncio.wrap_future(_submit_password_task(fn, *args))
+
+def run_password_task_sync(fn, *args):
+    """sync 라우트용: 해시 풀에서 실행 (bcrypt 동시 실행 수를 풀 크기로 제한)"""
+    return _submit_password_task(fn, *args).result()
+
+def password_pool_stats():
+    with _password_lock:
+        stats = dict(_password_stats)
+    completed = stats["completed"]
+    stats["queue_wait_avg"] = stats["queue_wait_total"] / completed if completed else 0.0
+    stats["workers"] = PASSWORD_HASH_WORKERS
+    stats["queue_limit"] = PASSWORD_QUEUE_LIMIT
+    return stats
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -34,6 +117,49 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def get_account_by_username(db: Session, username: str):
     return db.query(Account).filter(Account.username == username).first()
 
+class Principal:
+    """인증된 계정 (요청 간 공유되는 읽기 전용 값 - DB 세션과 무관)"""
+    __slots__ = ("id", "username", "type", "seller_id", "token_version")
+
+    def __init__(self, account: Account):
+        self.id = account.id
+        self.username = account.username
+        self.type = account.type
+        self.seller_id = account.seller_id
+        self.token_version = account.token_version or 0
+
+_principal_cache = OrderedDict()  # username -> (Principal, 만료 시각)
+_principal_lock = threading.Lock()
+
+def invalidate_principal(username: str):
+    """이 워커의 캐시에서 계정 제거 (커밋 후 호출)"""
+    with _principal_lock:
+        _principal_cache.pop(username, None)
+
+def bump_token_version(account: Account):
+    """기존 토큰 무효화 (커밋은 호출하는 쪽에서, 커밋 후 invalidate_principal)"""
+    account.token_version = (account.token_version or 0) + 1
+
+def _cached_principal(db: Session, username: str):
+    now = time.monotonic()
+    with _principal_lock:
+        entry = _principal_cache.get(username)
+        if entry and entry[1] > now:
+            _principal_cache.move_to_end(username)
+            return entry[0]
+
+    account = get_account_by_username(db, username)
+    if not account:
+        invalidate_principal(username)
+        return None
+    principal = Principal(account)
+    with _principal_lock:
+        _principal_cache[username] = (principal, now + PRINCIPAL_CACHE_TTL)
+        _principal_cache.move_to_end(username)
+        while len(_principal_cache) > PRINCIPAL_CACHE_SIZE:
+            _principal_cache.popitem(last=False)
+    return principal
+
 def get_current_account(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401, 
@@ -47,12 +173,91 @@ def get_current_account(db: Session = Depends(get_db), token: str = Depends(oaut
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_account_by_username(db, username)
-    if not user:
+    principal = _cached_principal(db, username)
+    if not principal or principal.token_version != payload.get("ver", 0):
         raise credentials_exception
-    return user
+    return principal
+
+def create_account_token(account: Account):
+    return create_access_token({
+        "sub": account.username,
+        "type": account.type,
+        "seller_id": account.seller_id,
+        "ver": account.token_version or 0
+    })
+
+def _hash_refresh_token(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
 
-def admin_only(current: Account = Depends(get_current_account)):
+def issue_refresh_token(db: Session, account: Account, family_id: str = None):
+    """새 리프레시 토큰 원문 반환 (DB에는 해시만, 커밋은 호출하는 쪽에서)"""
+    token = secrets.token_urlsafe(32)
+    now = get_korea_time_naive()
+    db.add(RefreshToken(
+        account_id=account.id,
+        token_hash=_hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        token_version=account.token_version or 0,
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+def revoke_refresh_family(db: Session, family_id: str):
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at == None)
+        .values(revoked_at=get_korea_time_naive())
+        .execution_options(synchronize_session=False)
+    )
+
+def _login_response(db: Session, account: Account, family_id: str = None):
+    """액세스 + 리프레시 토큰 발급 후 커밋"""
+    refresh_token = issue_refresh_token(db, account, family_id)
+    db.commit()
+    return {
+        "access_token": create_account_token(account),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user_type": account.type
+    }
+
+def _rotate_refresh_token(db: Session, token: str):
+    """리프레시 토큰 검증 + 교체 → 새 토큰 응답 (실패 시 HTTPException)"""
+    invalid = HTTPException(status_code=401, detail="다시 로그인해주세요", headers={"WWW-Authenticate": "Bearer"})
+    now = get_korea_time_naive()
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == _hash_refresh_token(token)).first()
+    if not stored or stored.revoked_at or stored.expires_at <= now:
+        raise invalid
+    
+    if stored.rotated_at:
+        # 방금 다른 탭이 교체한 경우만 재시도 허용, 그 외에는 재사용(탈취)으로 보고 family 폐기
+        if (now - stored.rotated_at).total_seconds() <= REFRESH_REUSE_GRACE:
+            raise HTTPException(status_code=409, detail="이미 갱신된 토큰입니다")
+        revoke_refresh_family(db, stored.family_id)
+        db.commit()
+        print(f"⚠️ 리프레시 토큰 재사용 감지: 계정 {stored.account_id}, family {stored.family_id} 폐기")
+        raise invalid
+    
+    account = db.get(Account, stored.account_id)
+    if not account or (account.token_version or 0) != stored.token_version:
+        revoke_refresh_family(db, stored.family_id)
+        db.commit()
+        raise invalid
+    
+    # 조건부 UPDATE로 교체 (동시에 같은 토큰으로 요청하면 한 쪽만 성공)
+    rotated = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == stored.id, RefreshToken.rotated_at == None)
+        .values(rotated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if rotated.rowcount != 1:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="이미 갱신된 토큰입니다")
+    return _login_response(db, account, stored.family_id)
+
+def admin_only(current: Principal = Depends(get_current_account)):
     if current.type != "admin":
         raise HTTPException(status_code=403, detail="관리자 전용")
     return current
@@ -61,12 +266,41 @@ def admin_only(current: Account = Depends(get_current_account)):
 router = APIRouter()
 
 @router.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_account_by_username(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(get_account_by_username, db, form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="잘못된 아이디/비밀번호")
+    
+    # 검증 + 해시 설정이 바뀌었으면 새 해시 (passlib verify_and_update)
+    valid, new_hash = await run_password_task(pwd_context.verify_and_update, form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=400, detail="잘못된 아이디/비밀번호")
-    access_token = create_access_token({"sub": user.username, "type": user.type, "seller_id": user.seller_id})
-    return {"access_token": access_token, "token_type": "bearer", "user_type": user.type}
+    if new_hash:
+        user.password_hash = new_hash
+    
+    # 만료된 리프레시 토큰 정리 + 새 토큰 발급
+    await run_in_threadpool(
+        lambda: db.query(RefreshToken).filter(
+            RefreshToken.account_id == user.id,
+            RefreshToken.expires_at < get_korea_time_naive()
+        ).delete(synchronize_session=False)
+    )
+    return await run_in_threadpool(_login_response, db, user)
+
+@router.post("/token/refresh")
+def refresh_access_token(refresh_token: str = Form(...), db: Session = Depends(get_db)):
+    """리프레시 토큰으로 액세스 토큰 재발급 (비밀번호 검증 없음, 리프레시 토큰도 교체)"""
+    return _rotate_refresh_token(db, refresh_token)
+
+@router.post("/logout")
+def logout(refresh_token: str = Form(None), db: Session = Depends(get_db)):
+    """리프레시 토큰 폐기 (같은 family 전체)"""
+    if refresh_token:
+        stored = db.query(RefreshToken).filter(RefreshToken.token_hash == _hash_refresh_token(refresh_token)).first()
+        if stored:
+            revoke_refresh_family(db, stored.family_id)
+            db.commit()
+    return {"success": True}
 
 @router.get("/me")
 def get_current_user_info(current: Account = Depends(get_current_account)):
@@ -81,21 +315,25 @@ def get_current_user_info(current: Account = Depends(get_current_account)):
 async def change_password(
     current_password: str = Form(...),
     new_password: str = Form(...),
-    current: Account = Depends(get_current_account),  # 👈 이렇게 변경
+    current: Principal = Depends(get_current_account),
     db: Session = Depends(get_db)
 ):
     """비밀번호 변경"""
     try:
-        # 현재 비밀번호 확인
-        if not verify_password(current_password, current.password_hash):
+        # 현재 비밀번호 확인 (인증 주체는 캐시 값이므로 계정 행을 다시 읽음)
+        # DB는 기본 스레드풀, bcrypt는 해시 전용 풀에서 실행 (이벤트 루프를 막지 않음)
+        account = await run_in_threadpool(db.get, Account, current.id)
+        if not account or not await run_password_task(verify_password, current_password, account.password_hash):
             raise HTTPException(status_code=400, detail="현재 비밀번호가 올바르지 않습니다")
         
         # 새 비밀번호 해시
-        new_password_hash = get_password_hash(new_password)
+        new_password_hash = await run_password_task(get_password_hash, new_password)
         
-        # 비밀번호 업데이트
-        current.password_hash = new_password_hash
-        db.commit()
+        # 비밀번호 업데이트 + 기존 토큰 무효화
+        account.password_hash = new_password_hash
+        bump_token_version(account)
+        await run_in_threadpool(db.commit)
+        invalidate_principal(current.username)
         
         return {"success": True, "message": "비밀번호가 변경되었습니다"}
         
@@ -103,5 +341,10 @@ async def change_password(
         raise
     except Exception as e:
         print(f"비밀번호 변경 오류: {str(e)}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="비밀번호 변경 실패")
\ No newline at end of file
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=500, detail="비밀번호 변경 실패")
+
+@router.get("/auth/password-pool")
+def get_password_pool_stats(current: Principal = Depends(admin_only)):
+    """비밀번호 해시 풀 상태 (대기 수, 완료/거절 수, 큐 대기 시간)"""
+    return password_pool_stats()
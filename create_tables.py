@@ -1,7 +1,40 @@
-from db import engine, Base
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from db import engine, Base, SessionLocal
+from crud import backfill_inventory_state
 import models
 
 # DB의 테이블을 모두 생성 (이미 있으면 스킵)
 Base.metadata.create_all(bind=engine)
 
+inspector = inspect(engine)
+
+# 기존 테이블에 새로 추가된 컬럼 생성 (create_all은 기존 테이블을 변경하지 않음)
+for table in Base.metadata.sorted_tables:
+    existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing_columns:
+            column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+            print(f"컬럼 추가: {table.name}.{column.name}")
+
+# 기존 테이블에 새로 추가된 인덱스 생성 (create_all은 기존 테이블의 인덱스를 만들지 않음)
+for table in Base.metadata.sorted_tables:
+    existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            index.create(bind=engine)
+            print(f"인덱스 생성: {table.name}.{index.name}")
+
+# 재고 상태 테이블 채우기 (상태 행이 없는 제품은 목록/상세에서 재고 0, 가격 없음으로 보이므로)
+db = SessionLocal()
+try:
+    filled = backfill_inventory_state(db)
+    if filled:
+        print(f"재고 상태 생성: 제품 {filled}개")
+finally:
+    db.close()
+
 print("DB 테이블 생성 완료!")
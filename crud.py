@@ -1,8 +1,11 @@
 import os
 import pytz
+import threading
+import numpy as np
+import pandas as pd
 from decimal import Decimal
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, case, update, select, and_, Date
 from datetime import datetime, timedelta, timezone
 
 from models import (
@@ -495,6 +498,294 @@ def update_dashboard_summary(db: Session, order_items: list):
         summary.yesterday_quantity += stats['yesterday']['qty']
         
         summary.last_updated = get_korea_time_naive()  
+
+def get_or_create_summary(db: Session, seller_id: int):
+    """DashboardSummary 조회 (없으면 0으로 초기화해서 생성)"""
+    summary = db.query(DashboardSummary).filter(
+        DashboardSummary.seller_id == seller_id
+    ).first()
+    
+    if not summary:
+        summary = DashboardSummary(
+            seller_id=seller_id,
+            total_supply_amount=Decimal('0'),
+            total_sale_amount=Decimal('0'),
+            total_quantity=0,
+            month_supply_amount=Decimal('0'),
+            month_sale_amount=Decimal('0'),
+            month_quantity=0,
+            week_supply_amount=Decimal('0'),
+            week_sale_amount=Decimal('0'),
+            week_quantity=0,
+            yesterday_supply_amount=Decimal('0'),
+            yesterday_sale_amount=Decimal('0'),
+            yesterday_quantity=0,
+            last_updated=get_korea_time_naive()
+        )
+        db.add(summary)
+    return summary
+
+def apply_stats_deltas(db: Session, deltas: dict):
+    """
+    (입점사, 제품, 주문일) 단위 증감분을 DashboardSummary + 제품 판매 지표에 반영
+    deltas: {(seller_id, product_id, order_date): [supply, sale, qty]}
+    seller_id가 None이면 전체(0)에만, 아니면 해당 입점사 + 전체(0)에 반영
+    product_id가 None(미연결)이면 제품 지표에는 반영하지 않음
+    """
+    if not deltas:
+        return
+    
+    current_date = get_korea_time_naive()
+    today = current_date.date()
+    yesterday = today - timedelta(days=1)
+    week_start = get_week_start(today)
+    month_start = get_month_start(today)
+    
+    # 기간 리셋 체크
+    reset_period_if_needed(db, current_date)
+    
+    # seller별 기간 버킷으로 합산
+    seller_stats = {}
+    for (seller_id, _, order_date), (supply, sale, qty) in deltas.items():
+        if hasattr(order_date, 'date'):
+            order_date = order_date.date()
+        
+        periods = ['total']
+        if order_date >= month_start:
+            periods.append('month')
+        if order_date >= week_start:
+            periods.append('week')
+        if order_date == yesterday:
+            periods.append('yesterday')
+        
+        targets = [TOTAL_STATS_SELLER_ID]
+        if seller_id and seller_id != TOTAL_STATS_SELLER_ID:
+            targets.append(seller_id)
+        
+        for sid in targets:
+            stats = seller_stats.setdefault(sid, {
+                period: [Decimal('0'), Decimal('0'), 0]
+                for period in ['total', 'month', 'week', 'yesterday']
+            })
+            for period in periods:
+                stats[period][0] += Decimal(str(supply or 0))
+                stats[period][1] += Decimal(str(sale or 0))
+                stats[period][2] += int(qty or 0)
+    
+    # DB 업데이트
+    for sid, stats in seller_stats.items():
+        summary = get_or_create_summary(db, sid)
+        for period, (supply, sale, qty) in stats.items():
+            setattr(summary, f"{period}_supply_amount", getattr(summary, f"{period}_supply_amount") + supply)
+            setattr(summary, f"{period}_sale_amount", getattr(summary, f"{period}_sale_amount") + sale)
+            setattr(summary, f"{period}_quantity", getattr(summary, f"{period}_quantity") + qty)
+        summary.last_updated = current_date
+    
+    apply_product_sales_deltas(db, deltas)
+
+# ===== 제품별 판매 지표 =====
+SALES_WINDOW_DAYS = 30
+
+def apply_product_sales_deltas(db: Session, deltas: dict):
+    """통계 증감분을 제품/일자별 판매 합계에 더하고 해당 제품 지표 재계산 (커밋은 호출하는 쪽에서)"""
+    from models import ProductDailySales
+    
+    daily = {}
+    for (_, product_id, order_date), (supply, sale, qty) in deltas.items():
+        if not product_id:
+            continue
+        if hasattr(order_date, 'date'):
+            order_date = order_date.date()
+        acc = daily.setdefault((product_id, order_date), [Decimal('0'), Decimal('0'), 0])
+        acc[0] += Decimal(str(supply or 0))
+        acc[1] += Decimal(str(sale or 0))
+        acc[2] += int(qty or 0)
+    if not daily:
+        return
+    
+    product_ids = {pid for pid, _ in daily}
+    existing = {(r.product_id, r.sale_date): r for r in db.query(ProductDailySales).filter(
+        ProductDailySales.product_id.in_(product_ids),
+        ProductDailySales.sale_date.in_({d for _, d in daily})
+    ).all()}
+    
+    for (product_id, sale_date), (supply, sale, qty) in daily.items():
+        row = existing.get((product_id, sale_date))
+        if not row:
+            row = ProductDailySales(
+                product_id=product_id, sale_date=sale_date,
+                quantity=0, supply_amount=Decimal('0'), sale_amount=Decimal('0')
+            )
+            db.add(row)
+        row.quantity += qty
+        row.supply_amount += supply
+        row.sale_amount += sale
+    
+    refresh_product_sales_metrics(db, product_ids)
+
+def refresh_product_sales_metrics(db: Session, product_ids=None):
+    """product_daily_sales 기준으로 제품 판매 지표 재계산 (product_ids 없으면 전체)"""
+    from models import ProductDailySales, ProductSalesMetrics
+    
+    db.flush()  # autoflush=False라서 변경된 일자별 합계를 먼저 반영
+    now = get_korea_time_naive()
+    
+    query = db.query(
+        ProductDailySales.product_id,
+        func.sum(ProductDailySales.quantity).label('quantity'),
+        func.sum(ProductDailySales.supply_amount).label('supply_amount'),
+        func.sum(ProductDailySales.sale_amount).label('sale_amount'),
+        func.max(case(
+            (ProductDailySales.quantity > 0, ProductDailySales.sale_date), else_=None
+        )).label('last_sold_at')
+    ).group_by(ProductDailySales.product_id)
+    
+    metrics_query = db.query(ProductSalesMetrics)
+    if product_ids is not None:
+        product_ids = list(set(product_ids))
+        query = query.filter(ProductDailySales.product_id.in_(product_ids))
+        metrics_query = metrics_query.filter(ProductSalesMetrics.product_id.in_(product_ids))
+    metrics = {m.product_id: m for m in metrics_query.all()}
+    
+    for row in query.all():
+        m = metrics.pop(row.product_id, None)
+        if not m:
+            m = ProductSalesMetrics(product_id=row.product_id)
+            db.add(m)
+        m.sold_quantity = int(row.quantity or 0)
+        m.sold_supply_amount = row.supply_amount or Decimal('0')
+        m.sold_sale_amount = row.sale_amount or Decimal('0')
+        m.last_sold_at = row.last_sold_at
+        m.updated_at = now
+    
+    # 판매 합계가 없어진 제품
+    for m in metrics.values():
+        db.delete(m)
+
+def recent_sales_subquery(db: Session):
+    """
+    최근 SALES_WINDOW_DAYS일 제품별 판매 수량 (product_id, sold_last_30d) 서브쿼리
+    날짜가 바뀌어도 저장값 갱신 없이 조회 시점 기준으로 계산 (sale_date 인덱스 범위 조회)
+    """
+    from models import ProductDailySales
+    
+    window_start = get_korea_time_naive().date() - timedelta(days=SALES_WINDOW_DAYS - 1)
+    return db.query(
+        ProductDailySales.product_id.label('product_id'),
+        func.sum(ProductDailySales.quantity).label('sold_last_30d')
+    ).filter(
+        ProductDailySales.sale_date >= window_start
+    ).group_by(ProductDailySales.product_id).subquery()
+
+def rebuild_product_sales(db: Session):
+    """주문 아이템에서 제품/일자별 판매 합계 + 지표 전체 재구성 (INSERT ... SELECT 1회)"""
+    from models import ProductDailySales, ProductSalesMetrics
+    from sqlalchemy import insert, select
+    
+    order_date = func.date(Order.order_time, type_=Date)
+    source = select(
+        OrderItem.product_id,
+        order_date,
+        func.sum(OrderItem.quantity),
+        func.sum(OrderItem.quantity * OrderItem.supply_price),
+        func.sum(OrderItem.quantity * OrderItem.sale_price)
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    ).where(
+        OrderItem.product_id != None,
+        Order.status.in_(VALID_STATUS_FOR_STATS)
+    ).group_by(OrderItem.product_id, order_date)
+    
+    db.query(ProductSalesMetrics).delete(synchronize_session=False)
+    db.query(ProductDailySales).delete(synchronize_session=False)
+    db.execute(insert(ProductDailySales).from_select(
+        ['product_id', 'sale_date', 'quantity', 'supply_amount', 'sale_amount'], source
+    ))
+    refresh_product_sales_metrics(db)
+
+# ===== 판매 속도 / 재고 소진 예측 =====
+PROJECTION_WINDOWS = (7, 30, 90)
+PROJECTION_HORIZON_DAYS = 3650              # 이 일수 넘게 남는 재고는 소진일 없음 (Timedelta 범위 초과 방지)
+_projection_cache = {"key": None, "frame": None}
+_projection_lock = threading.Lock()
+
+def _projection_cache_key(db: Session, today):
+    """주문 업로드/재고 변경/판매 지표 변경/날짜가 바뀌면 달라지는 키"""
+    from models import ImportBatch, ProductInventoryState, ProductSalesMetrics
+    
+    return (
+        today,
+        db.query(func.max(ImportBatch.id)).scalar(),
+        db.query(func.max(ProductInventoryState.updated_at)).scalar(),
+        db.query(func.max(ProductSalesMetrics.updated_at)).scalar()
+    )
+
+def compute_inventory_projection(db: Session, today):
+    """
+    활성 제품 전체의 7/30/90일 일평균 판매량 (일자별 판매 합계 1쿼리 + 재고 1쿼리, pandas 벡터 연산)
+    반환: product_id 인덱스 DataFrame (product_code, name, seller_id, current_stock, velocity_7d/30d/90d)
+    """
+    from models import ProductDailySales, ProductInventoryState
+    
+    products = pd.DataFrame(db.query(
+        Product.id,
+        Product.product_code,
+        Product.name,
+        Product.seller_id,
+        func.coalesce(ProductInventoryState.current_stock, 0)
+    ).outerjoin(
+        ProductInventoryState, ProductInventoryState.product_id == Product.id
+    ).filter(
+        Product.is_active == 1
+    ).all(), columns=['product_id', 'product_code', 'name', 'seller_id', 'current_stock']).set_index('product_id')
+    products['current_stock'] = products['current_stock'].astype(int)
+    
+    window_start = today - timedelta(days=max(PROJECTION_WINDOWS) - 1)
+    sales = pd.DataFrame(db.query(
+        ProductDailySales.product_id,
+        ProductDailySales.sale_date,
+        ProductDailySales.quantity
+    ).filter(
+        ProductDailySales.sale_date >= window_start,
+        ProductDailySales.sale_date <= today
+    ).all(), columns=['product_id', 'sale_date', 'quantity'])
+    
+    # 오늘 기준 경과일 (0 = 오늘) → 기간별 판매량 합계 / 기간 일수
+    age = (pd.Timestamp(today) - pd.to_datetime(sales['sale_date'])).dt.days.to_numpy()
+    quantity = sales['quantity'].to_numpy(dtype=float)
+    for days in PROJECTION_WINDOWS:
+        totals = pd.Series(
+            np.where(age < days, quantity, 0.0), index=sales['product_id'].to_numpy()
+        ).groupby(level=0).sum()
+        products[f'velocity_{days}d'] = totals.reindex(products.index, fill_value=0.0) / days
+    
+    return products
+
+def get_inventory_projection(db: Session, basis_days: int = 30):
+    """
+    판매 속도/재고 소진일 예측 (다음 주문 업로드나 재고 변경 전까지 캐시)
+    days_of_cover = 현재 재고 / 기준 기간 일평균 판매량 (판매가 없으면 NaN)
+    stockout_date = 오늘 + days_of_cover (PROJECTION_HORIZON_DAYS 초과면 NaT)
+    """
+    today = get_korea_time_naive().date()
+    key = _projection_cache_key(db, today)
+    
+    with _projection_lock:
+        if _projection_cache["key"] != key:
+            _projection_cache["frame"] = compute_inventory_projection(db, today)
+            _projection_cache["key"] = key
+        frame = _projection_cache["frame"].copy()
+    
+    velocity = frame[f'velocity_{basis_days}d'].to_numpy()
+    cover = np.divide(
+        frame['current_stock'].to_numpy(dtype=float), velocity,
+        out=np.full(len(frame), np.nan), where=velocity > 0
+    )
+    frame['days_of_cover'] = cover
+    # 판매가 거의 없는 제품은 cover가 수만~수억 일 → 예측 범위 밖이면 소진일 NaT
+    horizon = np.where(cover <= PROJECTION_HORIZON_DAYS, np.floor(cover), np.nan)
+    frame['stockout_date'] = pd.Timestamp(today) + pd.to_timedelta(horizon, unit='D')
+    return frame
         
 def update_product_rankings(db: Session, seller_id: int = None):
     """제품 TOP5 랭킹 업데이트"""
@@ -684,30 +975,251 @@ def find_product_and_multiplier(db: Session, product_code: str):
     
     return None, 1
 
+def relink_unmatched_items(db: Session, product, product_code: str, multiplier: int = 1):
+    """
+    미연결(product_id NULL) 주문 아이템을 제품에 일괄 연결 (UPDATE 1회)
+    가격이 0인 아이템은 제품 가격으로 채움, 재고 차감 상태 주문의 아이템은 FIFO 할당 (선적가)
+    반환: (연결 건수, apply_stats_deltas용 증감분)
+    """
+    unmatched = (
+        OrderItem.product_code == product_code,
+        OrderItem.product_id == None
+    )
+    new_supply_price = case((OrderItem.supply_price == 0, product.supply_price), else_=OrderItem.supply_price)
+    new_sale_price = case((OrderItem.supply_price == 0, product.sale_price), else_=OrderItem.sale_price)
+    order_date = func.date(Order.order_time, type_=Date)
+    
+    # 일자별 변경 전/후 합계 (통계 반영 대상 상태만)
+    rows = db.query(
+        OrderItem.seller_id_snapshot.label('old_seller_id'),
+        order_date.label('order_date'),
+        func.sum(OrderItem.quantity * OrderItem.supply_price).label('old_supply'),
+        func.sum(OrderItem.quantity * OrderItem.sale_price).label('old_sale'),
+        func.sum(OrderItem.quantity).label('old_qty'),
+        func.sum(OrderItem.quantity * multiplier * new_supply_price).label('new_supply'),
+        func.sum(OrderItem.quantity * multiplier * new_sale_price).label('new_sale')
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    ).filter(
+        *unmatched,
+        Order.status.in_(VALID_STATUS_FOR_STATS)
+    ).group_by(
+        OrderItem.seller_id_snapshot, order_date
+    ).all()
+    
+    deltas = {}
+    for row in rows:
+        # 이전 입점사(있다면)에서 빼고 새 입점사에 더함 - 전체(0)는 차액만 반영됨
+        old = deltas.setdefault((row.old_seller_id, None, row.order_date), [Decimal('0'), Decimal('0'), 0])
+        old[0] -= Decimal(str(row.old_supply or 0))
+        old[1] -= Decimal(str(row.old_sale or 0))
+        old[2] -= int(row.old_qty or 0)
+        
+        new = deltas.setdefault((product.seller_id, product.id, row.order_date), [Decimal('0'), Decimal('0'), 0])
+        new[0] += Decimal(str(row.new_supply or 0))
+        new[1] += Decimal(str(row.new_sale or 0))
+        new[2] += int(row.old_qty or 0) * multiplier
+    
+    # MySQL은 SET을 왼쪽부터 적용하므로 supply_price를 참조하는 sale_price를 먼저 갱신
+    stmt = update(OrderItem).where(*unmatched).ordered_values(
+        (OrderItem.sale_price, new_sale_price),
+        (OrderItem.supply_price, new_supply_price),
+        (OrderItem.quantity, OrderItem.quantity * multiplier),
+        (OrderItem.product_id, product.id),
+        (OrderItem.seller_id_snapshot, product.seller_id)
+    ).execution_options(synchronize_session=False)
+    linked_ids = [row.id for row in db.query(OrderItem.id).filter(*unmatched).all()]
+    updated_count = db.execute(stmt).rowcount
+    
+    # 연결된 아이템도 재고 차감 상태면 FIFO 할당 → 선적가로 바뀐 차액까지 증감분에 포함
+    fifo, allocated_rows = allocate_unallocated_items(db, linked_ids)
+    _merge_deltas(deltas, fifo_price_deltas(allocated_rows, fifo["prices"]))
+    
+    return updated_count, deltas
 
-# ===== 선적 관리 FIFO 함수 =====
-def get_shipment_price_at_date(db: Session, shipment_id: int, order_date):
-    """특정 날짜의 선적 가격 조회"""
-    from models import ShipmentPriceHistory, ProductShipment
+def fill_zero_priced_items(db: Session, product):
+    """
+    제품은 연결됐지만 가격이 0인 주문 아이템에 제품 가격 일괄 설정 (UPDATE 1회)
+    반환: (설정 건수, apply_stats_deltas용 증감분)
+    """
+    if not product.supply_price and not product.sale_price:
+        return 0, {}
     
-    if hasattr(order_date, 'date'):
-        order_date = order_date.date()
+    zero_priced = (
+        OrderItem.product_id == product.id,
+        OrderItem.supply_price == 0,
+        OrderItem.sale_price == 0
+    )
+    order_date = func.date(Order.order_time, type_=Date)
     
-    # 해당 날짜에 유효한 가격 찾기
-    price = db.query(ShipmentPriceHistory).filter(
-        ShipmentPriceHistory.shipment_id == shipment_id,
-        ShipmentPriceHistory.effective_date <= order_date
-    ).order_by(ShipmentPriceHistory.effective_date.desc()).first()
+    rows = db.query(
+        OrderItem.seller_id_snapshot.label('seller_id'),
+        order_date.label('order_date'),
+        func.sum(OrderItem.quantity).label('qty')
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    ).filter(
+        *zero_priced,
+        Order.status.in_(VALID_STATUS_FOR_STATS)
+    ).group_by(
+        OrderItem.seller_id_snapshot, order_date
+    ).all()
     
-    if price:
-        return price.supply_price, price.sale_price
+    # 수량은 이미 반영되어 있으므로 금액만 증가
+    deltas = {
+        (row.seller_id, product.id, row.order_date): [
+            product.supply_price * int(row.qty or 0),
+            product.sale_price * int(row.qty or 0),
+            0
+        ] for row in rows
+    }
     
-    # 이력이 없으면 선적의 현재 가격
-    shipment = db.query(ProductShipment).filter(ProductShipment.id == shipment_id).first()
-    if shipment:
-        return shipment.supply_price, shipment.sale_price
+    updated_count = db.query(OrderItem).filter(*zero_priced).update({
+        "supply_price": product.supply_price,
+        "sale_price": product.sale_price
+    }, synchronize_session=False)
     
-    return Decimal('0'), Decimal('0')
+    return updated_count, deltas
+
+# ===== 미연결 주문 재매칭 =====
+REMATCH_BATCH_SIZE = 500
+_rematch_lock = threading.Lock()
+_rematch_requested = threading.Event()  # 실행 중에 들어온 요청 → 끝난 뒤 다시 실행
+
+def _merge_deltas(target: dict, deltas: dict):
+    for key, (supply, sale, qty) in deltas.items():
+        acc = target.setdefault(key, [Decimal('0'), Decimal('0'), 0])
+        acc[0] += supply
+        acc[1] += sale
+        acc[2] += qty
+
+def rematch_unmatched_items(db: Session, batch_size: int = REMATCH_BATCH_SIZE):
+    """
+    미연결/가격 0 주문 아이템을 배치 단위로 훑어서 제품코드+매핑코드 인덱스로 재연결
+    배치마다 일괄 UPDATE → 통계 증감분 1회 반영 → 커밋
+    """
+    from product_index import product_index
+    
+    result = {"linked": 0, "priced": 0, "batches": 0}
+    affected_sellers = set()
+    
+    # 1) product_id가 없는 아이템 → 코드로 제품 찾아서 연결
+    last_id = 0
+    unresolved_codes = set()
+    while True:
+        rows = db.query(OrderItem.id, OrderItem.product_code).filter(
+            OrderItem.product_id == None,
+            OrderItem.id > last_id
+        ).order_by(OrderItem.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        
+        # 배치 내 코드 해석 (인덱스 조회, DB 조회 없음)
+        resolved = {}
+        for row in rows:
+            code = row.product_code
+            if code in resolved or code in unresolved_codes:
+                continue
+            product_id, multiplier = product_index.resolve(db, code)
+            if product_id:
+                resolved[code] = (product_id, multiplier)
+            else:
+                unresolved_codes.add(code)
+        if not resolved:
+            continue
+        
+        products = {p.id: p for p in db.query(Product).filter(
+            Product.id.in_({pid for pid, _ in resolved.values()})
+        ).all()}
+        
+        batch_deltas = {}
+        for code, (product_id, multiplier) in resolved.items():
+            product = products.get(product_id)
+            if not product:
+                continue
+            count, deltas = relink_unmatched_items(db, product, code, multiplier)
+            if count:
+                result["linked"] += count
+                affected_sellers.add(product.seller_id)
+                _merge_deltas(batch_deltas, deltas)
+        
+        apply_stats_deltas(db, batch_deltas)
+        db.commit()
+        result["batches"] += 1
+    
+    # 2) 제품은 연결됐지만 가격이 0인 아이템 → 제품 가격으로 채움
+    last_id = 0
+    done_products = set()
+    while True:
+        rows = db.query(OrderItem.id, OrderItem.product_id).filter(
+            OrderItem.supply_price == 0,
+            OrderItem.sale_price == 0,
+            OrderItem.product_id != None,
+            OrderItem.id > last_id
+        ).order_by(OrderItem.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        
+        product_ids = {row.product_id for row in rows} - done_products
+        done_products |= product_ids
+        if not product_ids:
+            continue
+        
+        batch_deltas = {}
+        for product in db.query(Product).filter(Product.id.in_(product_ids)).all():
+            count, deltas = fill_zero_priced_items(db, product)
+            if count:
+                result["priced"] += count
+                affected_sellers.add(product.seller_id)
+                _merge_deltas(batch_deltas, deltas)
+        
+        apply_stats_deltas(db, batch_deltas)
+        db.commit()
+        result["batches"] += 1
+    
+    # 랭킹: 입점사 하나면 해당 입점사 + 전체만, 여러 곳이면 전체 한 번
+    if len(affected_sellers) == 1:
+        update_product_rankings(db, seller_id=affected_sellers.pop())
+    elif affected_sellers:
+        update_product_rankings(db)
+    db.commit()
+    
+    if result["linked"] or result["priced"]:
+        print(f"✅ 재매칭 완료: 연결 {result['linked']}건, 가격설정 {result['priced']}건")
+    return result
+
+def run_rematch_sweep():
+    """
+    백그라운드 재매칭 (자체 세션 사용)
+    이미 실행 중이면 재실행 요청만 남기고 반환 → 실행 중인 쪽이 요청이 없어질 때까지 처음부터 다시 실행
+    (실행 중에 추가된 제품/매핑의 아이템이 커서 뒤에 있거나 이번 실행에서 미해결로 넘어간 코드여도 연결됨)
+    """
+    from db import SessionLocal
+    
+    _rematch_requested.set()
+    while _rematch_requested.is_set():
+        if not _rematch_lock.acquire(blocking=False):
+            return
+        try:
+            while _rematch_requested.is_set():
+                _rematch_requested.clear()
+                db = SessionLocal()
+                try:
+                    rematch_unmatched_items(db)
+                except Exception as e:
+                    db.rollback()
+                    print(f"재매칭 오류: {str(e)}")
+                finally:
+                    db.close()
+        finally:
+            _rematch_lock.release()
+        # 해제 직전에 들어와서 락을 못 잡은 요청이 있으면 바깥 루프에서 다시 실행
+
+
+# ===== 선적 관리 FIFO 함수 =====
+STOCK_RETRY_LIMIT = 3  # 재고 동시 변경 충돌 시 재시도 횟수
 
 def get_current_product_price(db: Session, product_id: int):
     """제품의 현재 판매 가격 (가장 오래된 활성 선적)"""
@@ -723,6 +1235,228 @@ def get_current_product_price(db: Session, product_id: int):
         return shipment.supply_price, shipment.sale_price
     return Decimal('0'), Decimal('0')
 
+def query_products_with_inventory(db: Session):
+    """
+    제품 + 현재 가격/재고 + 판매 지표 (product_inventory_state, product_sales_metrics 조인, 인덱스 조회만)
+    반환 행: (Product, supply_price, sale_price, current_stock, ProductSalesMetrics, sold_last_30d)
+    상태가 없으면 가격/재고는 None, 판매 이력이 없으면 지표는 None
+    """
+    from models import ProductInventoryState, ProductSalesMetrics
+    
+    recent = recent_sales_subquery(db)
+    return db.query(
+        Product,
+        ProductInventoryState.current_supply_price,
+        ProductInventoryState.current_sale_price,
+        ProductInventoryState.current_stock,
+        ProductSalesMetrics,
+        func.coalesce(recent.c.sold_last_30d, 0)
+    ).outerjoin(
+        ProductInventoryState, ProductInventoryState.product_id == Product.id
+    ).outerjoin(
+        ProductSalesMetrics, ProductSalesMetrics.product_id == Product.id
+    ).outerjoin(
+        recent, recent.c.product_id == Product.id
+    )
+
+def compute_inventory_from_shipments(db: Session, product_ids=None):
+    """
+    선적 테이블에서 제품별 재고 상태를 한 쿼리로 계산
+    반환 행: (product_id, active_shipment_id, supply_price, sale_price, current_stock, last_received_at)
+    """
+    from models import ProductShipment
+    
+    # 제품별 판매 가능한 선적을 입고순으로 번호 매김 → 1번이 현재 선적
+    ranked = db.query(
+        ProductShipment.id.label('shipment_id'),
+        ProductShipment.product_id.label('product_id'),
+        ProductShipment.supply_price.label('supply_price'),
+        ProductShipment.sale_price.label('sale_price'),
+        func.row_number().over(
+            partition_by=ProductShipment.product_id,
+            order_by=(ProductShipment.arrival_date.asc(), ProductShipment.id.asc())
+        ).label('rn')
+    ).filter(
+        ProductShipment.remaining_quantity > 0,
+        ProductShipment.is_active == 1
+    ).subquery()
+    
+    stock = db.query(
+        ProductShipment.product_id.label('product_id'),
+        func.sum(case(
+            (ProductShipment.is_active == 1, ProductShipment.remaining_quantity), else_=0
+        )).label('current_stock'),
+        func.max(ProductShipment.arrival_date).label('last_received_at')
+    ).group_by(ProductShipment.product_id).subquery()
+    
+    query = db.query(
+        Product.id.label('product_id'),
+        ranked.c.shipment_id.label('active_shipment_id'),
+        ranked.c.supply_price,
+        ranked.c.sale_price,
+        func.coalesce(stock.c.current_stock, 0).label('current_stock'),
+        stock.c.last_received_at
+    ).outerjoin(
+        ranked, and_(ranked.c.product_id == Product.id, ranked.c.rn == 1)
+    ).outerjoin(
+        stock, stock.c.product_id == Product.id
+    )
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    return query.all()
+
+INVENTORY_STATE_FIELDS = (
+    'active_shipment_id', 'current_supply_price', 'current_sale_price', 'current_stock', 'last_received_at'
+)
+
+def _inventory_values(row):
+    return {
+        'active_shipment_id': row.active_shipment_id,
+        'current_supply_price': row.supply_price,
+        'current_sale_price': row.sale_price,
+        'current_stock': int(row.current_stock or 0),
+        'last_received_at': row.last_received_at
+    }
+
+def refresh_product_inventory_state(db: Session, product_ids):
+    """선적 변경 후 해당 제품들의 재고 상태 갱신 (커밋은 호출하는 쪽에서)"""
+    from models import ProductInventoryState
+    
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return
+    db.flush()  # autoflush=False라서 추가/변경된 선적을 먼저 반영
+    
+    now = get_korea_time_naive()
+    states = {s.product_id: s for s in db.query(ProductInventoryState).filter(
+        ProductInventoryState.product_id.in_(product_ids)
+    ).all()}
+    
+    for row in compute_inventory_from_shipments(db, product_ids):
+        state = states.get(row.product_id)
+        if not state:
+            state = ProductInventoryState(product_id=row.product_id)
+            db.add(state)
+            states[row.product_id] = state
+        for field, value in _inventory_values(row).items():
+            setattr(state, field, value)
+        state.updated_at = now
+    
+    sync_stock_alerts(db, states.values())
+
+def sync_stock_alerts(db: Session, states):
+    """
+    재고 상태 기준으로 재고 부족 알림 열기/갱신/해제 (커밋은 호출하는 쪽에서)
+    재고 <= 기준수량이면 알림 (0 이하는 'out', 나머지는 'low'), 기준수량 초과로 회복되면 해제
+    """
+    from models import StockAlert
+    
+    states = [s for s in states if s.reorder_threshold is not None]
+    if not states:
+        return
+    
+    now = get_korea_time_naive()
+    open_alerts = {a.product_id: a for a in db.query(StockAlert).filter(
+        StockAlert.product_id.in_([s.product_id for s in states]),
+        StockAlert.resolved_at == None
+    ).all()}
+    
+    for state in states:
+        alert = open_alerts.get(state.product_id)
+        stock = int(state.current_stock or 0)
+        threshold = state.reorder_threshold
+        
+        if stock <= threshold:
+            alert_type = 'out' if stock <= 0 else 'low'
+            if not alert:
+                db.add(StockAlert(
+                    product_id=state.product_id,
+                    alert_type=alert_type,
+                    current_stock=stock,
+                    threshold=threshold,
+                    created_at=now,
+                    updated_at=now
+                ))
+            elif (alert.alert_type, alert.current_stock, alert.threshold) != (alert_type, stock, threshold):
+                alert.alert_type = alert_type
+                alert.current_stock = stock
+                alert.threshold = threshold
+                alert.updated_at = now
+        elif alert:
+            alert.current_stock = stock
+            alert.resolved_at = now
+            alert.updated_at = now
+
+def resolve_stock_alerts(db: Session, product_id: int):
+    """기준수량 해제/제품 삭제 시 열린 알림 닫기"""
+    from models import StockAlert
+    
+    now = get_korea_time_naive()
+    db.query(StockAlert).filter(
+        StockAlert.product_id == product_id,
+        StockAlert.resolved_at == None
+    ).update({"resolved_at": now, "updated_at": now}, synchronize_session=False)
+
+INVENTORY_BACKFILL_BATCH_SIZE = 1000
+
+def backfill_inventory_state(db: Session):
+    """
+    재고 상태 행이 없는 제품(상태 테이블 도입 전 제품)을 선적 기준으로 채움 (배치마다 커밋)
+    반환: 채운 제품 수
+    """
+    from models import ProductInventoryState
+    
+    missing = [row.id for row in db.query(Product.id).outerjoin(
+        ProductInventoryState, ProductInventoryState.product_id == Product.id
+    ).filter(ProductInventoryState.product_id == None).all()]
+    
+    for start in range(0, len(missing), INVENTORY_BACKFILL_BATCH_SIZE):
+        refresh_product_inventory_state(db, missing[start:start + INVENTORY_BACKFILL_BATCH_SIZE])
+        db.commit()
+    return len(missing)
+
+def reconcile_inventory_state(db: Session, fix: bool = True):
+    """
+    재고 상태 테이블과 선적 테이블 계산값 비교 → 불일치 목록 반환 (fix=True면 복구 후 커밋)
+    """
+    from models import ProductInventoryState
+    
+    now = get_korea_time_naive()
+    states = {s.product_id: s for s in db.query(ProductInventoryState).all()}
+    drift = []
+    fixed = []
+    
+    for row in compute_inventory_from_shipments(db):
+        expected = _inventory_values(row)
+        state = states.pop(row.product_id, None)
+        if state:
+            actual = {field: getattr(state, field) for field in INVENTORY_STATE_FIELDS}
+            if actual == expected:
+                continue
+        else:
+            actual = None
+        
+        drift.append({"product_id": row.product_id, "expected": expected, "actual": actual})
+        if fix:
+            if not state:
+                state = ProductInventoryState(product_id=row.product_id)
+                db.add(state)
+            for field, value in expected.items():
+                setattr(state, field, value)
+            state.updated_at = now
+            fixed.append(state)
+    
+    # 삭제된 제품의 상태 행
+    for product_id, state in states.items():
+        drift.append({"product_id": product_id, "expected": None, "actual": "orphan"})
+        if fix:
+            db.delete(state)
+    
+    if fix:
+        sync_stock_alerts(db, fixed)
+        db.commit()
+    return drift
+
 def get_product_total_stock(db: Session, product_id: int):
     """제품의 총 재고 수량"""
     from models import ProductShipment
@@ -734,64 +1468,583 @@ def get_product_total_stock(db: Session, product_id: int):
     
     return total or 0
 
-def process_order_fifo(db: Session, product_id: int, quantity_needed: int, order_date):
-    """FIFO 방식으로 주문 처리 및 가격 계산"""
+class StockConflictError(Exception):
+    """선적 재고가 읽은 뒤에 다른 요청에서 바뀌어 조건부 차감이 실패함 (다시 읽고 재시도)"""
+
+def decrement_shipment_stock(db: Session, shipment_id: int, quantity: int, now=None, current_quantity: bool = False):
+    """
+    선적 잔량 원자적 차감: remaining_quantity >= quantity인 경우에만 UPDATE (읽고-쓰기 사이 경합 없음)
+    current_quantity=True면 current_quantity도 같이 차감 (재고 조정)
+    반환: 차감 성공 여부 (False면 잔량 부족 또는 선적 없음)
+    """
     from models import ProductShipment
     
-    if hasattr(order_date, 'date'):
-        order_date = order_date.date()
+    values = {
+        "remaining_quantity": ProductShipment.remaining_quantity - quantity,
+        "updated_at": now or get_korea_time_naive()
+    }
+    if current_quantity:
+        values["current_quantity"] = ProductShipment.current_quantity - quantity
+    result = db.execute(
+        update(ProductShipment)
+        .where(ProductShipment.id == shipment_id, ProductShipment.remaining_quantity >= quantity)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def allocate_fifo_batch(db: Session, items):
+    """
+    주문 아이템들을 제품별 주문시간 순으로 활성 선적(입고순)에 FIFO 할당 (메모리에서 계산)
+    items: {"id", "product_id", "quantity", "order_time"} dict 목록 ("keep_price": True면 가격 유지)
+    - 할당 내역(fifo_allocations) 일괄 INSERT (가격은 가격 인덱스로 merge_asof 1회)
+    - 아이템 가격 = 할당된 선적들의 주문 시점 가격 가중평균 (일괄 UPDATE, 결과의 prices에 {id: (공급가, 판매가)})
+    - 선적 remaining_quantity는 선적당 조건부 UPDATE 1회로 차감 (재고 원장에는 할당별 sale 항목)
+      읽은 뒤 다른 요청이 재고를 바꿔서 차감이 실패하면 SAVEPOINT를 되돌리고 다시 읽어서 재시도
+    재고가 모자라면 할당된 만큼만 기록하고 부족분은 shortage로 반환 (커밋은 호출하는 쪽에서)
+    """
+    items = [i for i in items if i["product_id"] and (i["quantity"] or 0) > 0]
+    if not items:
+        return {"items": 0, "quantity": 0, "shortage": 0, "shipments": 0, "prices": {}}
+    product_ids = {i["product_id"] for i in items}
     
-    # 활성 선적을 날짜순으로 조회
-    shipments = db.query(ProductShipment).filter(
-        ProductShipment.product_id == product_id,
+    for attempt in range(1, STOCK_RETRY_LIMIT + 1):
+        try:
+            with db.begin_nested():
+                result = _allocate_fifo_once(db, items, product_ids)
+            break
+        except StockConflictError:
+            if attempt == STOCK_RETRY_LIMIT:
+                raise
+            print(f"FIFO 할당 재시도 ({attempt}/{STOCK_RETRY_LIMIT}): 선적 재고 동시 변경")
+    
+    refresh_product_inventory_state(db, product_ids)
+    return result
+
+def _allocate_fifo_once(db: Session, items, product_ids):
+    """allocate_fifo_batch 1회 시도 (SAVEPOINT 안에서 호출)"""
+    from collections import defaultdict, deque
+    from sqlalchemy import insert
+    from models import ProductShipment, FifoAllocation
+    from shipment_price_index import shipment_price_index
+    
+    result = {"items": 0, "quantity": 0, "shortage": 0, "shipments": 0, "prices": {}}
+    
+    # 1) 활성 선적 (제품별 입고순) - 1쿼리
+    queues = defaultdict(deque)
+    current_prices = {}
+    for s in db.query(
+        ProductShipment.id, ProductShipment.product_id, ProductShipment.remaining_quantity,
+        ProductShipment.supply_price, ProductShipment.sale_price
+    ).filter(
+        ProductShipment.product_id.in_(product_ids),
         ProductShipment.remaining_quantity > 0,
         ProductShipment.is_active == 1
-    ).order_by(ProductShipment.arrival_date.asc()).all()
-    
-    total_supply_price = Decimal('0')
-    total_sale_price = Decimal('0')
-    shipments_used = []
+    ).order_by(ProductShipment.product_id, ProductShipment.arrival_date, ProductShipment.id).all():
+        queues[s.product_id].append([s.id, s.remaining_quantity])
+        current_prices[s.id] = (s.supply_price, s.sale_price)
     
-    for shipment in shipments:
-        if quantity_needed <= 0:
-            break
+    # 2) 제품별 주문시간 순으로 선적 소진 (수량만)
+    now = get_korea_time_naive()
+    allocations = []
+    used = defaultdict(int)
+    for item in sorted(items, key=lambda i: (i["product_id"], i["order_time"], i["id"])):
+        queue = queues.get(item["product_id"])
+        need = item["quantity"]
+        allocated = 0
         
-        # 이 선적에서 사용할 수량
-        use_qty = min(quantity_needed, shipment.remaining_quantity)
+        while need > 0 and queue:
+            entry = queue[0]
+            take = min(need, entry[1])
+            allocations.append({
+                "order_item_id": item["id"],
+                "shipment_id": entry[0],
+                "product_id": item["product_id"],
+                "quantity": take,
+                "order_time": item["order_time"],
+                "allocated_at": now
+            })
+            used[entry[0]] += take
+            allocated += take
+            need -= take
+            entry[1] -= take
+            if entry[1] == 0:
+                queue.popleft()
         
-        # 해당 날짜의 선적 가격 조회
-        supply_price, sale_price = get_shipment_price_at_date(
-            db, shipment.id, order_date
+        result["shortage"] += need
+        if allocated:
+            result["items"] += 1
+            result["quantity"] += allocated
+    
+    if not allocations:
+        return result
+    
+    # 3) 할당별 주문 시점 가격 (가격 이력 as-of 조인, 이력 없는 선적은 현재 가격)
+    priced = shipment_price_index.prices_asof(db, pd.DataFrame(allocations)[["shipment_id", "order_time"]])
+    totals = defaultdict(lambda: [0, Decimal('0'), Decimal('0')])
+    for allocation, supply, sale in zip(allocations, priced["supply_price"], priced["sale_price"]):
+        if pd.isna(supply):
+            supply, sale = current_prices[allocation["shipment_id"]]
+        allocation["supply_price"] = supply
+        allocation["sale_price"] = sale
+        total = totals[allocation["order_item_id"]]
+        total[0] += allocation["quantity"]
+        total[1] += supply * allocation["quantity"]
+        total[2] += sale * allocation["quantity"]
+    
+    keep_price = {i["id"] for i in items if i.get("keep_price")}
+    item_prices = [{
+        "id": item_id,
+        "supply_price": (supply_total / quantity).quantize(Decimal('0.01')),
+        "sale_price": (sale_total / quantity).quantize(Decimal('0.01'))
+    } for item_id, (quantity, supply_total, sale_total) in totals.items() if item_id not in keep_price]
+    result["prices"] = {p["id"]: (p["supply_price"], p["sale_price"]) for p in item_prices}
+    
+    # 4) 선적당 조건부 차감 먼저 (읽은 뒤 재고가 줄었으면 충돌 → 재시도)
+    for shipment_id, quantity in used.items():
+        if not decrement_shipment_stock(db, shipment_id, quantity, now):
+            raise StockConflictError(shipment_id)
+    result["shipments"] = len(used)
+    
+    # 5) 일괄 반영: 할당 내역 INSERT / 아이템 가격 UPDATE (executemany)
+    db.execute(insert(FifoAllocation), allocations)
+    if item_prices:
+        db.execute(update(OrderItem), item_prices)
+    record_inventory_movements(db, [{
+        "shipment_id": a["shipment_id"],
+        "product_id": a["product_id"],
+        "entry_type": "sale",
+        "quantity_delta": -a["quantity"],
+        "occurred_at": now,
+        "reference_type": "order_item",
+        "reference_id": a["order_item_id"]
+    } for a in allocations])
+    return result
+
+def release_fifo_allocations(db: Session, order_item_ids, note: str = None):
+    """
+    주문 아이템의 FIFO 할당 해제 (재고 차감 상태에서 벗어난 주문, 커밋은 호출하는 쪽에서)
+    - 선적 remaining_quantity를 할당 수량만큼 되돌림 (선적당 UPDATE 1회)
+    - 재고 원장에 할당별 반대 sale 항목 (+수량) 기록 후 할당 내역 삭제
+    아이템 가격은 그대로 둠 (다시 차감 상태가 되면 allocate_fifo_batch로 재할당)
+    """
+    from collections import defaultdict
+    from models import ProductShipment, FifoAllocation
+    
+    order_item_ids = list(order_item_ids)
+    if not order_item_ids:
+        return {"items": 0, "quantity": 0}
+    
+    allocations = db.query(
+        FifoAllocation.id, FifoAllocation.order_item_id, FifoAllocation.shipment_id,
+        FifoAllocation.product_id, FifoAllocation.quantity
+    ).filter(FifoAllocation.order_item_id.in_(order_item_ids)).all()
+    if not allocations:
+        return {"items": 0, "quantity": 0}
+    
+    now = get_korea_time_naive()
+    returned = defaultdict(int)
+    for a in allocations:
+        returned[a.shipment_id] += a.quantity
+    for shipment_id, quantity in returned.items():
+        db.execute(
+            update(ProductShipment)
+            .where(ProductShipment.id == shipment_id)
+            .values(remaining_quantity=ProductShipment.remaining_quantity + quantity, updated_at=now)
+            .execution_options(synchronize_session=False)
         )
+    
+    record_inventory_movements(db, [{
+        "shipment_id": a.shipment_id,
+        "product_id": a.product_id,
+        "entry_type": "sale",
+        "quantity_delta": a.quantity,
+        "occurred_at": now,
+        "reference_type": "order_item",
+        "reference_id": a.order_item_id,
+        "note": note or "주문 상태 변경으로 할당 해제"
+    } for a in allocations])
+    db.query(FifoAllocation).filter(
+        FifoAllocation.id.in_([a.id for a in allocations])
+    ).delete(synchronize_session=False)
+    
+    refresh_product_inventory_state(db, {a.product_id for a in allocations})
+    return {
+        "items": len({a.order_item_id for a in allocations}),
+        "quantity": sum(returned.values())
+    }
+
+def allocate_unallocated_items(db: Session, order_item_ids):
+    """
+    재고 차감 상태 주문의 아이템 중 할당 내역이 없는 것만 FIFO 할당 (재연결/상태 복귀)
+    관리자가 직접 가격을 수정한 아이템은 가격 유지
+    반환: allocate_fifo_batch 결과 + 할당 전 가격 rows (통계 차액 계산용)
+    """
+    from models import FifoAllocation
+    
+    order_item_ids = list(order_item_ids)
+    if not order_item_ids:
+        return allocate_fifo_batch(db, []), []
+    
+    rows = db.query(
+        OrderItem.id, OrderItem.product_id, OrderItem.seller_id_snapshot, OrderItem.quantity,
+        OrderItem.supply_price, OrderItem.sale_price, OrderItem.last_modified_at,
+        Order.order_time, Order.status
+    ).join(
+        Order, OrderItem.order_id == Order.id
+    ).filter(
+        OrderItem.id.in_(order_item_ids),
+        OrderItem.product_id != None,
+        Order.status.in_(DEDUCT_STOCK_STATUSES),
+        ~OrderItem.id.in_(db.query(FifoAllocation.order_item_id).distinct())
+    ).all()
+    
+    fifo = allocate_fifo_batch(db, [{
+        "id": row.id, "product_id": row.product_id, "quantity": row.quantity,
+        "order_time": row.order_time, "keep_price": row.last_modified_at is not None
+    } for row in rows])
+    return fifo, rows
+
+def fifo_price_deltas(rows, prices):
+    """FIFO로 바뀐 아이템 가격의 apply_stats_deltas용 차액 (통계 반영 상태만)"""
+    deltas = {}
+    for row in rows:
+        if row.id not in prices or row.status not in VALID_STATUS_FOR_STATS:
+            continue
+        supply, sale = prices[row.id]
+        key = (row.seller_id_snapshot, row.product_id, row.order_time.date())
+        acc = deltas.setdefault(key, [Decimal('0'), Decimal('0'), 0])
+        acc[0] += (supply - row.supply_price) * row.quantity
+        acc[1] += (sale - row.sale_price) * row.quantity
+    return deltas
+
+def reprice_shipment_allocations(db: Session, shipment_id: int, effective_date, changed_by: int, note: str = None):
+    """
+    소급 적용된 선적 가격을 이미 판매된 아이템에 반영 (FIFO 할당 내역 기준, 커밋은 호출하는 쪽에서)
+    - 해당 선적에서 effective_date 이후 주문으로 할당된 아이템만 다시 계산
+    - 할당 내역 가격 / 아이템 가격 일괄 UPDATE, 가격 변경 Audit 일괄 INSERT
+    - 차액은 (입점사, 제품, 주문일) 증감분으로 통계에 반영
+    관리자가 직접 가격을 수정한 아이템(last_modified_at 있음)은 덮어쓰지 않음
+    """
+    from collections import defaultdict
+    from sqlalchemy import insert
+    from models import ShipmentPriceHistory, FifoAllocation, OrderItemAudit
+    from shipment_price_index import shipment_price_index
+    
+    result = {"items": 0, "skipped_manual": 0}
+    
+    # 새 가격이 가장 이른 이력이면 그 이전 주문도 최초 가격이 바뀌므로 하한 없음
+    earlier = db.query(func.min(ShipmentPriceHistory.effective_date)).filter(
+        ShipmentPriceHistory.shipment_id == shipment_id
+    ).scalar()
+    affected = db.query(FifoAllocation.order_item_id).filter(FifoAllocation.shipment_id == shipment_id)
+    if earlier is not None and effective_date > earlier:
+        affected = affected.filter(FifoAllocation.order_time >= effective_date)
+    
+    # 1) 영향받는 아이템의 할당 내역 전체 (여러 선적에 나뉜 아이템은 가중평균을 다시 내야 하므로)
+    allocations = db.query(
+        FifoAllocation.id, FifoAllocation.order_item_id, FifoAllocation.shipment_id,
+        FifoAllocation.quantity, FifoAllocation.order_time,
+        FifoAllocation.supply_price, FifoAllocation.sale_price
+    ).filter(
+        FifoAllocation.order_item_id.in_(affected.distinct())
+    ).all()
+    if not allocations:
+        return result
+    
+    # 2) 할당별 주문 시점 가격 (as-of 조인 1회)
+    priced = shipment_price_index.prices_asof(
+        db, pd.DataFrame([(a.shipment_id, a.order_time) for a in allocations], columns=["shipment_id", "order_time"])
+    )
+    allocation_updates = []
+    totals = defaultdict(lambda: [0, Decimal('0'), Decimal('0')])
+    for a, supply, sale in zip(allocations, priced["supply_price"], priced["sale_price"]):
+        if pd.isna(supply):
+            supply, sale = a.supply_price, a.sale_price
+        if (supply, sale) != (a.supply_price, a.sale_price):
+            allocation_updates.append({"id": a.id, "supply_price": supply, "sale_price": sale})
+        total = totals[a.order_item_id]
+        total[0] += a.quantity
+        total[1] += supply * a.quantity
+        total[2] += sale * a.quantity
+    
+    # 3) 아이템별 새 가중평균 가격과 비교
+    items = db.query(
+        OrderItem.id, OrderItem.product_id, OrderItem.seller_id_snapshot, OrderItem.quantity,
+        OrderItem.supply_price, OrderItem.sale_price, OrderItem.last_modified_at,
+        Order.order_time, Order.status
+    ).join(Order, OrderItem.order_id == Order.id).filter(
+        OrderItem.id.in_(totals.keys())
+    ).all()
+    
+    now = get_korea_time_naive()
+    item_updates = []
+    audits = []
+    deltas = {}
+    for item in items:
+        if item.last_modified_at is not None:
+            result["skipped_manual"] += 1
+            continue
+        quantity, supply_total, sale_total = totals[item.id]
+        new_supply = (supply_total / quantity).quantize(Decimal('0.01'))
+        new_sale = (sale_total / quantity).quantize(Decimal('0.01'))
+        if new_supply == item.supply_price and new_sale == item.sale_price:
+            continue
         
-        # 가격 계산
-        total_supply_price += supply_price * use_qty
-        total_sale_price += sale_price * use_qty
-        
-        # 사용 내역 기록
-        shipments_used.append({
-            'shipment_id': shipment.id,
-            'quantity': use_qty,
-            'supply_price': supply_price,
-            'sale_price': sale_price
+        item_updates.append({"id": item.id, "supply_price": new_supply, "sale_price": new_sale})
+        audits.append({
+            "order_item_id": item.id,
+            "changed_by": changed_by,
+            "changed_at": now,
+            "from_supply_price": item.supply_price,
+            "to_supply_price": new_supply,
+            "from_sale_price": item.sale_price,
+            "to_sale_price": new_sale,
+            "note": note or "선적 가격 소급 적용"
         })
-        
-        # 재고 차감 (실제로는 주문 확정시에만)
-        quantity_needed -= use_qty
+        if item.status in VALID_STATUS_FOR_STATS:
+            key = (item.seller_id_snapshot, item.product_id, item.order_time.date())
+            acc = deltas.setdefault(key, [Decimal('0'), Decimal('0'), 0])
+            acc[0] += (new_supply - item.supply_price) * item.quantity
+            acc[1] += (new_sale - item.sale_price) * item.quantity
     
-    # 평균 가격 계산
-    if shipments_used:
-        total_qty = sum(s['quantity'] for s in shipments_used)
-        avg_supply_price = total_supply_price / total_qty
-        avg_sale_price = total_sale_price / total_qty
-    else:
-        avg_supply_price = Decimal('0')
-        avg_sale_price = Decimal('0')
+    # 4) 일괄 반영 (executemany)
+    if allocation_updates:
+        db.execute(update(FifoAllocation), allocation_updates)
+    if item_updates:
+        db.execute(update(OrderItem), item_updates)
+        db.execute(insert(OrderItemAudit), audits)
+        apply_stats_deltas(db, deltas)
     
-    return {
-        'supply_price': avg_supply_price,
-        'sale_price': avg_sale_price,
-        'shipments_used': shipments_used,
-        'total_supply_amount': total_supply_price,
-        'total_sale_amount': total_sale_price
-    }
\ No newline at end of file
+    result["items"] = len(item_updates)
+    return result
+
+# ===== 재고 원장 / 스냅샷 =====
+# 선적 재고의 모든 증감을 inventory_ledger에 추가만 하고, 제품별 스냅샷을 주기적으로 저장
+# 시점 재고 = 그 이전 마지막 스냅샷 + 스냅샷 이후 원장 합계 (스냅샷 주기만큼만 재생)
+LEDGER_ENTRY_TYPES = ('opening', 'receipt', 'sale', 'adjustment', 'disposal')
+SNAPSHOT_INTERVAL_DAYS = 7
+_snapshot_checked_date = None
+
+def record_inventory_movements(db: Session, entries):
+    """
+    재고 증감 원장 일괄 INSERT (executemany, 커밋은 호출하는 쪽에서)
+    entries: {"shipment_id", "product_id", "entry_type", "quantity_delta", ...} dict 목록
+    occurred_at을 생략하면 현재 시각
+    """
+    from sqlalchemy import insert
+    from models import InventoryLedger
+    
+    now = get_korea_time_naive()
+    rows = [{
+        "occurred_at": now,
+        "reference_type": None,
+        "reference_id": None,
+        "note": None,
+        "created_by": None,
+        **entry
+    } for entry in entries if entry["quantity_delta"]]
+    if rows:
+        db.execute(insert(InventoryLedger), rows)
+
+def get_stock_at(db: Session, when, product_ids=None):
+    """
+    when 시각 직전의 제품별 재고 {product_id: quantity}
+    제품별 마지막 스냅샷(as_of <= when) + [as_of, when) 원장 합계
+    원장 재생은 (product_id, occurred_at) 인덱스 범위 조회로 스냅샷 이후분만 읽음
+    """
+    from models import InventoryLedger, InventorySnapshot
+    
+    latest = db.query(
+        InventorySnapshot.product_id.label('product_id'),
+        func.max(InventorySnapshot.snapshot_date).label('snapshot_date')
+    ).filter(InventorySnapshot.as_of <= when)
+    if product_ids is not None:
+        latest = latest.filter(InventorySnapshot.product_id.in_(product_ids))
+    latest = latest.group_by(InventorySnapshot.product_id).subquery()
+    
+    snapshots = db.query(
+        InventorySnapshot.product_id, InventorySnapshot.as_of, InventorySnapshot.quantity
+    ).join(latest, and_(
+        InventorySnapshot.product_id == latest.c.product_id,
+        InventorySnapshot.snapshot_date == latest.c.snapshot_date
+    )).subquery()
+    
+    stock = {}
+    for row in db.query(snapshots.c.product_id, snapshots.c.quantity).all():
+        stock[row.product_id] = row.quantity
+    
+    # 1) 스냅샷 있는 제품: 스냅샷 as_of를 조인 조건에 넣어서 제품별 [as_of, when) 범위만 조회
+    replay = db.query(
+        snapshots.c.product_id, func.sum(InventoryLedger.quantity_delta).label('quantity')
+    ).join(InventoryLedger, and_(
+        InventoryLedger.product_id == snapshots.c.product_id,
+        InventoryLedger.occurred_at >= snapshots.c.as_of,
+        InventoryLedger.occurred_at < when
+    )).group_by(snapshots.c.product_id)
+    for row in replay.all():
+        stock[row.product_id] += int(row.quantity or 0)
+    
+    # 2) 스냅샷 없는 제품: 스냅샷은 그 시점 원장이 있는 모든 제품을 저장하므로
+    #    when 이전 마지막 스냅샷 이후에 처음 생긴 제품뿐 → 그 as_of부터만 조회
+    floor = db.query(func.max(InventorySnapshot.as_of)).filter(InventorySnapshot.as_of <= when).scalar()
+    replay = db.query(
+        InventoryLedger.product_id, func.sum(InventoryLedger.quantity_delta).label('quantity')
+    ).filter(
+        InventoryLedger.occurred_at < when,
+        ~InventoryLedger.product_id.in_(select(snapshots.c.product_id))
+    )
+    if floor is not None:
+        replay = replay.filter(InventoryLedger.occurred_at >= floor)
+    if product_ids is not None:
+        replay = replay.filter(InventoryLedger.product_id.in_(product_ids))
+    for row in replay.group_by(InventoryLedger.product_id).all():
+        stock[row.product_id] = int(row.quantity or 0)
+    
+    return stock
+
+def get_inventory_movements(db: Session, start, end, product_ids=None):
+    """
+    [start, end) 기간 제품별 기초재고 / 유형별 증감 / 기말재고
+    반환: {product_id: {"opening_stock", "receipt", "sale", "adjustment", "disposal", "opening", "closing_stock"}}
+    """
+    from models import InventoryLedger
+    
+    opening = get_stock_at(db, start, product_ids)
+    report = {
+        product_id: {"opening_stock": quantity, **{t: 0 for t in LEDGER_ENTRY_TYPES}}
+        for product_id, quantity in opening.items()
+    }
+    
+    movements = db.query(
+        InventoryLedger.product_id, InventoryLedger.entry_type,
+        func.sum(InventoryLedger.quantity_delta).label('quantity')
+    ).filter(
+        InventoryLedger.occurred_at >= start,
+        InventoryLedger.occurred_at < end
+    )
+    if product_ids is not None:
+        movements = movements.filter(InventoryLedger.product_id.in_(product_ids))
+    for row in movements.group_by(InventoryLedger.product_id, InventoryLedger.entry_type).all():
+        entry = report.setdefault(row.product_id, {"opening_stock": 0, **{t: 0 for t in LEDGER_ENTRY_TYPES}})
+        entry[row.entry_type] = entry.get(row.entry_type, 0) + int(row.quantity or 0)
+    
+    for entry in report.values():
+        entry["closing_stock"] = entry["opening_stock"] + sum(entry[t] for t in LEDGER_ENTRY_TYPES)
+    return report
+
+def take_inventory_snapshots(db: Session, snapshot_date):
+    """snapshot_date 말일 기준 제품별 재고 스냅샷 저장 (같은 날짜가 있으면 교체)"""
+    from sqlalchemy import insert
+    from models import InventorySnapshot
+    
+    as_of = datetime.combine(snapshot_date + timedelta(days=1), datetime.min.time())
+    stock = get_stock_at(db, as_of)
+    
+    db.query(InventorySnapshot).filter(InventorySnapshot.snapshot_date == snapshot_date).delete(synchronize_session=False)
+    now = get_korea_time_naive()
+    if stock:
+        db.execute(insert(InventorySnapshot), [{
+            "product_id": product_id,
+            "snapshot_date": snapshot_date,
+            "as_of": as_of,
+            "quantity": quantity,
+            "created_at": now
+        } for product_id, quantity in stock.items()])
+    return len(stock)
+
+def take_inventory_snapshots_if_needed(db: Session):
+    """
+    마지막 스냅샷이 SNAPSHOT_INTERVAL_DAYS보다 오래됐으면 어제 날짜로 스냅샷 (프로세스당 하루 1회 확인)
+    주문 업로드 커밋 후 / snapshot_inventory.py에서 호출 (조회 API에서는 호출하지 않음)
+    다른 워커가 같은 날짜를 먼저 저장했으면 건너뜀
+    """
+    global _snapshot_checked_date
+    from sqlalchemy.exc import IntegrityError
+    from models import InventorySnapshot
+    
+    today = get_korea_time_naive().date()
+    if _snapshot_checked_date == today:
+        return 0
+    
+    yesterday = today - timedelta(days=1)
+    last_date = db.query(func.max(InventorySnapshot.snapshot_date)).scalar()
+    count = 0
+    if last_date is None or (yesterday - last_date).days >= SNAPSHOT_INTERVAL_DAYS:
+        try:
+            count = take_inventory_snapshots(db, yesterday)
+            db.commit()
+            print(f"✅ 재고 스냅샷 저장: {yesterday} ({count}개 제품)")
+        except IntegrityError:
+            db.rollback()
+            count = 0
+    _snapshot_checked_date = today
+    return count
+
+def backfill_inventory_opening(db: Session):
+    """
+    원장 도입 전 선적에 opening 항목 추가 (opening/receipt 항목이 없는 선적만)
+    수량 = 현재 remaining_quantity - 이미 기록된 증감 합계 → 원장 합계가 현재 잔량과 일치
+    """
+    from models import ProductShipment, InventoryLedger
+    
+    recorded = db.query(
+        InventoryLedger.shipment_id.label('shipment_id'),
+        func.sum(InventoryLedger.quantity_delta).label('total'),
+        func.sum(case((InventoryLedger.entry_type.in_(('opening', 'receipt')), 1), else_=0)).label('base_entries')
+    ).group_by(InventoryLedger.shipment_id).subquery()
+    
+    rows = db.query(
+        ProductShipment.id, ProductShipment.product_id, ProductShipment.remaining_quantity,
+        func.coalesce(recorded.c.total, 0).label('total')
+    ).outerjoin(
+        recorded, recorded.c.shipment_id == ProductShipment.id
+    ).filter(
+        func.coalesce(recorded.c.base_entries, 0) == 0
+    ).all()
+    
+    record_inventory_movements(db, [{
+        "shipment_id": row.id,
+        "product_id": row.product_id,
+        "entry_type": "opening",
+        "quantity_delta": (row.remaining_quantity or 0) - int(row.total or 0),
+        "note": "원장 도입 시 잔량"
+    } for row in rows])
+    return len(rows)
+
+def reconcile_shipment_ledger(db: Session, fix: bool = True):
+    """
+    선적 remaining_quantity와 원장 합계 비교 → 불일치 목록 반환
+    fix=True면 원장 합계로 remaining_quantity 복구 + 재고 상태 갱신 후 커밋
+    """
+    from models import ProductShipment, InventoryLedger
+    
+    ledger = db.query(
+        InventoryLedger.shipment_id.label('shipment_id'),
+        func.sum(InventoryLedger.quantity_delta).label('total')
+    ).group_by(InventoryLedger.shipment_id).subquery()
+    
+    rows = db.query(
+        ProductShipment.id, ProductShipment.product_id, ProductShipment.remaining_quantity,
+        ledger.c.total
+    ).join(
+        ledger, ledger.c.shipment_id == ProductShipment.id
+    ).filter(
+        func.coalesce(ProductShipment.remaining_quantity, 0) != ledger.c.total
+    ).all()
+    
+    drift = [{
+        "shipment_id": row.id,
+        "product_id": row.product_id,
+        "actual": row.remaining_quantity,
+        "expected": int(row.total)
+    } for row in rows]
+    
+    if fix and drift:
+        now = get_korea_time_naive()
+        db.execute(update(ProductShipment), [
+            {"id": d["shipment_id"], "remaining_quantity": d["expected"], "updated_at": now} for d in drift
+        ])
+        refresh_product_inventory_state(db, {d["product_id"] for d in drift})
+        db.commit()
+    return drift
@@ -13,7 +13,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # 라우터 import
-from auth import router as auth_router, get_current_account  # get_current_account 추가
+from auth import router as auth_router, get_current_account, Principal  # get_current_account 추가
 from api_routes_sellers import router as sellers_router
 from api_routes_products import router as products_router
 from api_routes_accounts import router as accounts_router
@@ -23,9 +23,9 @@ from api_routes_dashboard import router as dashboard_router
 from crud import UPLOAD_DIR  # crud에서 가져오기
 # 라우터 import 부분 바로 아래에 추가
 
-from models import Account  # Account 모델 추가
 # FastAPI 앱 생성 (반드시 라우터 등록 전에!)
 from api_routes_shipments import router as shipments_router
+from media import router as media_router
 
 app = FastAPI()
 
@@ -63,6 +63,9 @@ app.include_router(dashboard_router)
 app.include_router(products_router, prefix="/api")  # prefix 확인
 app.include_router(shipments_router, prefix="/api")
 
+# 업로드 파일/썸네일 (/static 마운트보다 먼저 등록해야 가려지지 않음)
+app.include_router(media_router)
+
 # === 정적 파일 서빙 ===
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -98,13 +101,6 @@ async def read_index():
 async def read_main():
     return FileResponse('static/index.html')
 
-@app.get("/static/uploads/{filename}")
-async def get_upload_file(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="File not found")
-
 @app.get("/health")
 def health_check():
     """서버 상태 확인용"""
@@ -152,7 +148,7 @@ async def delete_from_imagekit(url: str = Form(...)):
 
 # main.py에 추가
 @app.get("/api/imagekit/auth")
-async def get_imagekit_auth(current_account: Account = Depends(get_current_account)):
+async def get_imagekit_auth(current_account: Principal = Depends(get_current_account)):
     """ImageKit 업로드 인증 정보 반환"""
     
     try:
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from crud import UPLOAD_DIR
+
+# Pillow가 없으면 썸네일 없이 원본만 서빙
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+router = APIRouter()
+
+# === 업로드 파일 서빙 ===
+# - 경로 탐색(../) 차단: 실제 경로가 UPLOAD_DIR 안인지 확인
+# - ETag/Last-Modified + If-None-Match/If-Modified-Since → 304
+# - Range 요청은 FileResponse가 처리 (206)
+# - ?w=너비 → 썸네일을 첫 요청 때 만들어서 THUMBNAIL_DIR에 저장, 이후에는 파일로 서빙
+
+UPLOAD_ROOT = os.path.realpath(UPLOAD_DIR)
+THUMBNAIL_DIR = os.path.join(UPLOAD_ROOT, ".thumbs")
+THUMBNAIL_WIDTHS = (120, 240, 480, 960)  # 요청 너비는 이 중 하나로 올림 (변형 파일 수 제한)
+THUMBNAIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP", ".gif": "GIF"}
+MEDIA_CACHE_CONTROL = "public, max-age=2592000"  # 30일
+
+_thumbnail_lock = threading.Lock()
+
+
+def resolve_upload_path(path: str):
+    """요청 경로 → UPLOAD_DIR 안의 실제 파일 경로 (밖이거나 숨김 경로면 None)"""
+    if not path or "\x00" in path:
+        return None
+    if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+        return None
+    full_path = os.path.realpath(os.path.join(UPLOAD_ROOT, path))
+    if os.path.commonpath([UPLOAD_ROOT, full_path]) != UPLOAD_ROOT:
+        return None
+    return full_path if os.path.isfile(full_path) else None
+
+
+def thumbnail_width(requested: int):
+    for width in THUMBNAIL_WIDTHS:
+        if requested <= width:
+            return width
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def get_thumbnail(source_path: str, width: int):
+    """썸네일 파일 경로 (없거나 원본보다 오래됐으면 생성), 만들 수 없으면 None"""
+    format_name = THUMBNAIL_FORMATS.get(os.path.splitext(source_path)[1].lower())
+    if Image is None or not format_name:
+        return None
+
+    relative = os.path.relpath(source_path, UPLOAD_ROOT)
+    thumb_path = os.path.join(THUMBNAIL_DIR, str(width), relative)
+    source_mtime = os.stat(source_path).st_mtime
+    if os.path.isfile(thumb_path) and os.stat(thumb_path).st_mtime >= source_mtime:
+        return thumb_path
+
+    with _thumbnail_lock:
+        # 다른 요청이 먼저 만들었으면 그대로 사용
+        if os.path.isfile(thumb_path) and os.stat(thumb_path).st_mtime >= source_mtime:
+            return thumb_path
+        try:
+            with Image.open(source_path) as img:
+                if img.width <= width:
+                    return None  # 원본이 더 작으면 원본 사용
+                img.thumbnail((width, img.height * width // img.width + 1))
+                if format_name == "JPEG" and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+
+                os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+                tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+                img.save(tmp_path, format=format_name, quality=85, optimize=True)
+                os.replace(tmp_path, thumb_path)  # 완성된 파일만 보이도록
+        except (OSError, ValueError) as e:
+            print(f"썸네일 생성 실패: {relative} ({e})")
+            return None
+    return thumb_path
+
+
+def _validators(file_path: str):
+    stat = os.stat(file_path)
+    etag = '"' + hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest() + '"'
+    return etag, stat.st_mtime
+
+
+def _not_modified(request: Request, etag: str, mtime: float):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/static/uploads/{path:path}")
+def get_upload_file(path: str, request: Request, w: int = None):
+    file_path = resolve_upload_path(path)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if w:
+        file_path = get_thumbnail(file_path, thumbnail_width(w)) or file_path
+
+    etag, mtime = _validators(file_path)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": MEDIA_CACHE_CONTROL
+    }
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(file_path, headers=headers)
@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, ForeignKey, DateTime, Text, TIMESTAMP, Numeric, Date
+    Column, Integer, String, ForeignKey, DateTime, Text, TIMESTAMP, Numeric, Date, Index
 )
 from sqlalchemy.orm import relationship
     # NOTE: relationship은 필요한 곳만 설정
@@ -46,6 +46,9 @@ class Product(Base):
 
     is_active = Column(Integer, nullable=False, default=1)  # 1/0
 
+    # 상세 이미지 변경 시 증가 (이미지 응답 캐시 검증용)
+    images_version = Column(Integer, nullable=False, default=0, server_default=text("0"))
+
     created_at = Column(
         TIMESTAMP, nullable=False
     )
@@ -57,6 +60,13 @@ class Product(Base):
 
     seller = relationship("Seller", back_populates="products")
 
+    __table_args__ = (
+        # 제품 목록 서버 필터/정렬용
+        Index("ix_products_seller_active", "seller_id", "is_active"),
+        Index("ix_products_name", "name"),
+        Index("ix_products_created_at", "created_at"),
+    )
+
 
 # -------------------------
 # accounts
@@ -69,6 +79,8 @@ class Account(Base):
     # DB는 enum('admin','seller')지만 ORM은 문자열로 관리
     type = Column(String(20), nullable=False)  # 'admin' | 'seller'
     seller_id = Column(Integer, ForeignKey("sellers.id"), nullable=True)
+    # 토큰 버전: 권한/비밀번호 변경·삭제 시 증가 → 이전에 발급된 토큰(ver 클레임) 무효
+    token_version = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     created_at = Column(
         TIMESTAMP, nullable=False
@@ -119,6 +131,12 @@ class OrderItem(Base):
         TIMESTAMP, nullable=False
     )
 
+    __table_args__ = (
+        # 미연결 코드 집계용: product_id IS NULL / supply_price = 0 조건을 각각 인덱스로 처리
+        Index("ix_order_items_product_id_code", "product_id", "product_code"),
+        Index("ix_order_items_supply_price_code", "supply_price", "product_code"),
+    )
+
 
 # -------------------------
 # import_batches (관리자 전용)
@@ -227,6 +245,11 @@ class ProductImage(Base):
     display_order = Column(Integer, default=0)
     created_at = Column(TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
 
+    __table_args__ = (
+        # 제품별 이미지 순서 조회 (일괄 조회 포함)
+        Index('ix_product_images_product_order', 'product_id', 'display_order'),
+    )
+
     # models.py 끝에 추가
 class ProductCodeMapping(Base):
     __tablename__ = "product_code_mappings"
@@ -268,6 +291,11 @@ class ShipmentPriceHistory(Base):
     changed_by = Column(Integer, ForeignKey('accounts.id'))
     created_at = Column(DateTime)
 
+    __table_args__ = (
+        # 선적별 최근 가격 이력 조회
+        Index('ix_shipment_price_history_shipment_created', 'shipment_id', 'created_at'),
+    )
+
 class ShipmentStockAdjustment(Base):
     __tablename__ = 'shipment_stock_adjustments'
     
@@ -277,4 +305,137 @@ class ShipmentStockAdjustment(Base):
     quantity_delta = Column(Integer)
     reason = Column(String(255))
     adjusted_by = Column(Integer, ForeignKey('accounts.id'))
-    adjusted_at = Column(DateTime)
\ No newline at end of file
+    adjusted_at = Column(DateTime)
+
+    __table_args__ = (
+        # 선적별 최근 재고 조정 이력 조회
+        Index('ix_shipment_stock_adjustments_shipment_adjusted', 'shipment_id', 'adjusted_at'),
+    )
+
+class ProductInventoryState(Base):
+    __tablename__ = 'product_inventory_state'
+    
+    # 선적 테이블에서 계산되는 재고/현재가를 제품별로 유지 (선적 변경 시 같은 트랜잭션에서 갱신)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    current_stock = Column(Integer, nullable=False, default=0, index=True)
+    current_supply_price = Column(Numeric(18, 2), nullable=True)
+    current_sale_price = Column(Numeric(18, 2), nullable=True, index=True)
+    active_shipment_id = Column(Integer, ForeignKey('product_shipments.id'), nullable=True)
+    last_received_at = Column(DateTime, nullable=True)
+    reorder_threshold = Column(Integer, nullable=True)  # 이 수량 이하면 재고 부족 알림 (NULL이면 알림 없음)
+    updated_at = Column(DateTime, nullable=True)
+
+class StockAlert(Base):
+    __tablename__ = 'stock_alerts'
+    
+    # 재고 부족 알림 - 재고 상태 갱신 시 같은 트랜잭션에서 열림/갱신/해제
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    alert_type = Column(String(20), nullable=False)  # 'low' | 'out'
+    current_stock = Column(Integer, nullable=False)
+    threshold = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    resolved_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # 제품별 열린 알림 조회 / 피드 (열린 알림 최신순)
+        Index('ix_stock_alerts_product_resolved', 'product_id', 'resolved_at'),
+        Index('ix_stock_alerts_resolved_updated', 'resolved_at', 'updated_at'),
+    )
+
+class ProductDailySales(Base):
+    __tablename__ = 'product_daily_sales'
+    
+    # 제품/주문일별 판매 합계 (통계 반영 상태만) - 통계 증감분과 같은 트랜잭션에서 갱신
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    sale_date = Column(Date, primary_key=True, index=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    supply_amount = Column(Numeric(18, 2), nullable=False, default=0)
+    sale_amount = Column(Numeric(18, 2), nullable=False, default=0)
+
+class ProductSalesMetrics(Base):
+    __tablename__ = 'product_sales_metrics'
+    
+    # 제품별 누적 판매 지표 (product_daily_sales에서 계산, 최근 30일은 조회 시 계산)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    sold_quantity = Column(Integer, nullable=False, default=0, index=True)
+    sold_supply_amount = Column(Numeric(18, 2), nullable=False, default=0)
+    sold_sale_amount = Column(Numeric(18, 2), nullable=False, default=0, index=True)
+    last_sold_at = Column(Date, nullable=True, index=True)
+    updated_at = Column(DateTime, nullable=True)
+
+class FifoAllocation(Base):
+    __tablename__ = 'fifo_allocations'
+    
+    # 주문 아이템 → 선적 FIFO 할당 내역 (주문 시점 선적 가격으로 기록)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_item_id = Column(Integer, ForeignKey('order_items.id'), nullable=False)
+    shipment_id = Column(Integer, ForeignKey('product_shipments.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    supply_price = Column(Numeric(18, 2), nullable=False)
+    sale_price = Column(Numeric(18, 2), nullable=False)
+    order_time = Column(DateTime, nullable=False)
+    allocated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_fifo_allocations_order_item', 'order_item_id'),
+        Index('ix_fifo_allocations_shipment_allocated', 'shipment_id', 'allocated_at'),
+        # 소급 가격 적용 시 선적의 특정 시점 이후 할당 조회
+        Index('ix_fifo_allocations_shipment_order_time', 'shipment_id', 'order_time'),
+    )
+
+class InventoryLedger(Base):
+    __tablename__ = 'inventory_ledger'
+    
+    # 선적별 재고 증감 원장 (추가만 함, 수정/삭제 없음) → 선적 remaining_quantity = quantity_delta 합계
+    # entry_type: opening(원장 도입 시 잔량) / receipt(입고) / sale(FIFO 판매 할당) / adjustment(조정) / disposal(폐기)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shipment_id = Column(Integer, ForeignKey('product_shipments.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    entry_type = Column(String(20), nullable=False)
+    quantity_delta = Column(Integer, nullable=False)
+    occurred_at = Column(DateTime, nullable=False)
+    reference_type = Column(String(20), nullable=True)  # order_item / shipment / shipment_adjustment
+    reference_id = Column(Integer, nullable=True)
+    note = Column(String(255), nullable=True)
+    created_by = Column(Integer, ForeignKey('accounts.id'), nullable=True)
+
+    __table_args__ = (
+        # 시점 재고 / 기간 입출고 집계
+        Index('ix_inventory_ledger_product_occurred', 'product_id', 'occurred_at'),
+        # 스냅샷 없는 제품 재생 / 기간 집계 (제품 조건 없이 시각 범위만)
+        Index('ix_inventory_ledger_occurred', 'occurred_at'),
+        # 선적별 원장 합계 (remaining_quantity 점검)
+        Index('ix_inventory_ledger_shipment', 'shipment_id'),
+    )
+
+class InventorySnapshot(Base):
+    __tablename__ = 'inventory_snapshots'
+    
+    # 제품별 주기 스냅샷: snapshot_date 말일 기준 재고 (as_of = 다음날 00:00 이전 원장 합계)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    snapshot_date = Column(Date, primary_key=True)
+    as_of = Column(DateTime, nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+
+class RefreshToken(Base):
+    __tablename__ = 'refresh_tokens'
+    
+    # 리프레시 토큰 (원문은 저장하지 않고 sha256만) - 사용할 때마다 같은 family 안에서 새 토큰으로 교체
+    # 이미 교체된 토큰이 다시 쓰이면 탈취로 보고 family 전체 폐기
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    token_version = Column(Integer, nullable=False, default=0)  # 발급 시점 계정 token_version
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    rotated_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_refresh_tokens_account_expires', 'account_id', 'expires_at'),
+    )
@@ -0,0 +1,216 @@
+import re
+import time
+import threading
+from collections import defaultdict
+
+from sqlalchemy.orm import Session
+
+from models import Product, ProductCodeMapping
+
+# === 제품코드 인메모리 인덱스 ===
+# - 제품코드/매핑코드 → (product_id, 수량배수) 정확 매칭
+# - 제품코드/매핑코드/제품명 n-gram 역색인 → 미연결 코드 후보 추천
+# 프로세스(워커)별 메모리에 유지되므로 RELOAD_INTERVAL마다 DB에서 다시 읽어 수렴시킴
+
+NGRAM_SIZE = 3
+MIN_SUGGEST_SCORE = 0.3
+RELOAD_INTERVAL = 600  # 초
+
+
+def normalize_code(text):
+    """대소문자/공백/구분자를 제거한 비교용 문자열"""
+    if text is None:
+        return ""
+    return re.sub(r"[\W_]+", "", str(text).lower())
+
+
+def make_ngrams(normalized):
+    """정규화된 문자열의 n-gram 집합 (짧으면 문자열 자체)"""
+    if len(normalized) <= NGRAM_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + NGRAM_SIZE] for i in range(len(normalized) - NGRAM_SIZE + 1)}
+
+
+class ProductIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._products = {}                    # product_id -> 제품 요약 dict
+        self._aliases = defaultdict(dict)      # product_id -> {mapped_code: multiplier}
+        self._codes = {}                       # 원본 코드 -> (product_id, multiplier)
+        self._texts = {}                       # (product_id, field, text) -> (정규화 문자열, n-gram 집합)
+        self._keys_by_product = defaultdict(set)
+        self._postings = defaultdict(set)      # n-gram -> {(product_id, field, text)}
+
+    # --- 로드 / 무효화 ---
+    def ensure_loaded(self, db: Session):
+        """최초 사용 시 또는 RELOAD_INTERVAL 경과 시 전체 로드"""
+        with self._lock:
+            if self._loaded_at and time.monotonic() - self._loaded_at < RELOAD_INTERVAL:
+                return
+            self._load(db)
+
+    def invalidate(self):
+        """다음 사용 시 전체 재로드"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _load(self, db: Session):
+        products = db.query(
+            Product.id, Product.product_code, Product.name, Product.seller_id, Product.is_active
+        ).all()
+        mappings = db.query(
+            ProductCodeMapping.product_id, ProductCodeMapping.mapped_code, ProductCodeMapping.quantity_multiplier
+        ).all()
+
+        self._products.clear()
+        self._aliases.clear()
+        self._codes.clear()
+        self._texts.clear()
+        self._keys_by_product.clear()
+        self._postings.clear()
+
+        for p in products:
+            self._products[p.id] = self._summary(p)
+        for m in mappings:
+            if m.product_id in self._products:
+                self._aliases[m.product_id][m.mapped_code] = m.quantity_multiplier or 1
+        for product_id in self._products:
+            self._index_product(product_id)
+
+        self._loaded_at = time.monotonic()
+        print(f"✅ 제품코드 인덱스 로드: 제품 {len(products)}개, 매핑 {len(mappings)}개")
+
+    @staticmethod
+    def _summary(p):
+        return {
+            "id": p.id,
+            "product_code": p.product_code,
+            "name": p.name,
+            "seller_id": p.seller_id,
+            "is_active": p.is_active
+        }
+
+    # --- 내부 색인 ---
+    def _add_text(self, product_id, field, text):
+        normalized = normalize_code(text)
+        if not normalized:
+            return
+        key = (product_id, field, text)
+        grams = make_ngrams(normalized)
+        self._texts[key] = (normalized, grams)
+        self._keys_by_product[product_id].add(key)
+        for gram in grams:
+            self._postings[gram].add(key)
+
+    def _unindex_product(self, product_id):
+        for key in self._keys_by_product.pop(product_id, set()):
+            _, grams = self._texts.pop(key)
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(key)
+                    if not posting:
+                        del self._postings[gram]
+        product = self._products.get(product_id)
+        codes = list(self._aliases.get(product_id, {}))
+        if product:
+            codes.append(product["product_code"])
+        for code in codes:
+            if self._codes.get(code, (None, 1))[0] == product_id:
+                del self._codes[code]
+
+    def _index_product(self, product_id):
+        product = self._products[product_id]
+        self._codes[product["product_code"]] = (product_id, 1)
+        self._add_text(product_id, "code", product["product_code"])
+        self._add_text(product_id, "name", product["name"])
+        for mapped_code, multiplier in self._aliases[product_id].items():
+            self._codes[mapped_code] = (product_id, multiplier)
+            self._add_text(product_id, "alias", mapped_code)
+
+    # --- 변경 반영 (커밋 후 호출) ---
+    def upsert_product(self, product):
+        with self._lock:
+            if not self._loaded_at:
+                return  # 아직 로드 전이면 다음 로드 때 반영됨
+            self._unindex_product(product.id)
+            self._products[product.id] = self._summary(product)
+            self._index_product(product.id)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if not self._loaded_at:
+                return
+            self._unindex_product(product_id)
+            self._products.pop(product_id, None)
+            self._aliases.pop(product_id, None)
+
+    def add_mapping(self, mapping):
+        with self._lock:
+            if not self._loaded_at or mapping.product_id not in self._products:
+                return
+            self._unindex_product(mapping.product_id)
+            self._aliases[mapping.product_id][mapping.mapped_code] = mapping.quantity_multiplier or 1
+            self._index_product(mapping.product_id)
+
+    def remove_mapping(self, mapping):
+        with self._lock:
+            if not self._loaded_at or mapping.product_id not in self._products:
+                return
+            self._unindex_product(mapping.product_id)
+            self._aliases[mapping.product_id].pop(mapping.mapped_code, None)
+            self._index_product(mapping.product_id)
+
+    # --- 조회 ---
+    def resolve(self, db: Session, code):
+        """코드 정확 매칭 → (product_id, multiplier), 없으면 (None, 1)"""
+        self.ensure_loaded(db)
+        with self._lock:
+            return self._codes.get(code, (None, 1))
+
+    def suggest(self, db: Session, code, limit: int = 5):
+        """코드와 유사한 제품 후보 (점수 내림차순)"""
+        self.ensure_loaded(db)
+        query = normalize_code(code)
+        query_grams = make_ngrams(query)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            # 공유 n-gram 개수 집계
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for key in self._postings.get(gram, ()):
+                    shared[key] += 1
+
+            best = {}
+            for key, common in shared.items():
+                normalized, grams = self._texts[key]
+                # Dice 계수 + 접두 일치 보정
+                score = 2.0 * common / (len(query_grams) + len(grams))
+                if normalized == query:
+                    score = 1.0
+                elif normalized.startswith(query) or query.startswith(normalized):
+                    score = min(1.0, score + 0.1)
+                if score < MIN_SUGGEST_SCORE:
+                    continue
+
+                product_id, field, text = key
+                if product_id not in best or score > best[product_id]["score"]:
+                    product = self._products[product_id]
+                    best[product_id] = {
+                        "product_id": product_id,
+                        "product_code": product["product_code"],
+                        "name": product["name"],
+                        "seller_id": product["seller_id"],
+                        "is_active": product["is_active"],
+                        "score": round(score, 3),
+                        "matched_on": field,
+                        "matched_text": text
+                    }
+
+        return sorted(best.values(), key=lambda c: (-c["score"], c["product_code"]))[:limit]
+
+
+product_index = ProductIndex()
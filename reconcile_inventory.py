@@ -0,0 +1,30 @@
+import sys
+
+from db import SessionLocal
+from crud import reconcile_inventory_state, backfill_inventory_opening, reconcile_shipment_ledger
+
+# 선적 잔량(remaining_quantity)을 재고 원장 기준으로, 제품 재고 상태(product_inventory_state)를 선적 테이블 기준으로 점검/복구
+# 원장 항목이 없는 선적(원장 도입 전)은 먼저 opening 항목으로 현재 잔량을 기록
+# 사용법: python reconcile_inventory.py          → 불일치 복구
+#         python reconcile_inventory.py --check  → 점검만
+fix = "--check" not in sys.argv
+
+db = SessionLocal()
+try:
+    if fix:
+        opened = backfill_inventory_opening(db)
+        db.commit()
+        if opened:
+            print(f"원장 opening 기록: 선적 {opened}개")
+
+    drift = reconcile_shipment_ledger(db, fix=fix)
+    for d in drift:
+        print(f"선적 {d['shipment_id']} (제품 {d['product_id']}): 잔량={d['actual']} / 원장={d['expected']}")
+    print(f"선적 원장 불일치 {len(drift)}건" + (" 복구 완료!" if fix and drift else ""))
+
+    drift = reconcile_inventory_state(db, fix=fix)
+    for d in drift:
+        print(f"제품 {d['product_id']}: 저장값={d['actual']} / 계산값={d['expected']}")
+    print(f"불일치 {len(drift)}건" + (" 복구 완료!" if fix and drift else ""))
+finally:
+    db.close()
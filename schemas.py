@@ -1,6 +1,6 @@
 from typing import Optional
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, date
 from pydantic import BaseModel, validator
 from fastapi import UploadFile  # 추가!
 
@@ -37,6 +37,12 @@ class ProductOut(ProductBase):
     thumbnail_url: Optional[str]
     detail_image_url: Optional[str]
     current_stock: Optional[int] = None  # 현재 재고
+    # 판매 지표 (통계 반영 상태 기준)
+    sold_quantity: int = 0
+    sold_supply_amount: Decimal = Decimal('0')
+    sold_sale_amount: Decimal = Decimal('0')
+    sold_last_30d: int = 0
+    last_sold_at: Optional[date] = None
     class Config:
         orm_mode = True
 
@@ -0,0 +1,111 @@
+import threading
+
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import ShipmentPriceHistory
+
+# === 선적 가격 이력 인메모리 인덱스 ===
+# - 가격 이력 행 목록 (shipment_id, effective_date, id, 공급가, 판매가) → 조회 시 적용일순 DataFrame 1회 생성
+# - 최초 사용 시 전체 로드, 이후에는 (MAX(id), COUNT(*)) 워터마크만 비교해서
+#   새 이력은 id 이후분만 추가, 삭제 등으로 맞지 않으면 전체 재로드
+#   (다른 워커에서 수정한 가격도 다음 조회 때 반영됨)
+# - (선적, 주문시간) 목록의 시점 가격은 prices_asof (merge_asof 1회)
+
+
+class ShipmentPriceIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watermark = None                          # (max_id, count)
+        self._rows = []                                 # [(shipment_id, effective_date, id, supply, sale)]
+        self._frame = None                              # prices_asof용 DataFrame 캐시 (이력 추가 시 다시 생성)
+
+    # --- 로드 / 무효화 ---
+    def ensure_loaded(self, db: Session):
+        """워터마크가 바뀌었으면 새 이력만 추가 (맞지 않으면 전체 재로드)"""
+        max_id, count = db.query(func.max(ShipmentPriceHistory.id), func.count(ShipmentPriceHistory.id)).one()
+        watermark = (max_id or 0, count or 0)
+        with self._lock:
+            if self._watermark == watermark:
+                return
+            if self._watermark and watermark[0] > self._watermark[0]:
+                rows = self._query(db).filter(ShipmentPriceHistory.id > self._watermark[0]).all()
+                if self._watermark[1] + len(rows) == watermark[1]:
+                    self._rows.extend(self._record(row) for row in rows)
+                    self._watermark = watermark
+                    self._frame = None
+                    return
+            self._load(db, watermark)
+
+    def invalidate(self):
+        """다음 사용 시 전체 재로드"""
+        with self._lock:
+            self._watermark = None
+
+    @staticmethod
+    def _query(db: Session):
+        return db.query(
+            ShipmentPriceHistory.id, ShipmentPriceHistory.shipment_id, ShipmentPriceHistory.effective_date,
+            ShipmentPriceHistory.supply_price, ShipmentPriceHistory.sale_price
+        ).filter(ShipmentPriceHistory.effective_date != None)
+
+    @staticmethod
+    def _record(row):
+        return (row.shipment_id, row.effective_date, row.id, row.supply_price, row.sale_price)
+
+    def _load(self, db: Session, watermark):
+        self._rows = [self._record(row) for row in self._query(db).all()]
+        self._watermark = watermark
+        self._frame = None
+        shipments = len({row[0] for row in self._rows})
+        print(f"✅ 선적 가격 인덱스 로드: 선적 {shipments}개, 이력 {len(self._rows)}건")
+
+    # --- 변경 반영 (커밋 후 호출) ---
+    def refresh(self, db: Session):
+        """add_shipment / update_shipment_price 커밋 직후 새 이력 반영"""
+        self.ensure_loaded(db)
+
+    # --- 조회 ---
+    def _history_frame(self):
+        """적용일, id순 정렬 (같은 적용일이면 나중 이력이 우선)"""
+        if self._frame is None:
+            frame = pd.DataFrame(self._rows, columns=["shipment_id", "effective_date", "id", "supply_price", "sale_price"])
+            frame["effective_date"] = pd.to_datetime(frame["effective_date"])
+            frame = frame.sort_values(["effective_date", "id"], kind="stable")
+            self._frame = frame.drop(columns=["id"]).reset_index(drop=True)
+        return self._frame
+
+    def prices_asof(self, db: Session, frame: pd.DataFrame, time_column: str = "order_time"):
+        """
+        frame의 (shipment_id, time_column) 행마다 시점 가격을 붙여서 반환 (원래 행 순서 유지)
+        적용일 이전이면 최초 가격, 이력이 없으면 supply_price/sale_price가 NaN
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            history = self._history_frame()
+
+        left = frame.drop(columns=["supply_price", "sale_price"], errors="ignore").copy()
+        if history.empty or left.empty:
+            left["supply_price"] = None
+            left["sale_price"] = None
+            return left.reset_index(drop=True)
+
+        left["_row"] = range(len(left))
+        left["_asof"] = pd.to_datetime(left[time_column])
+        left = left.sort_values("_asof", kind="stable")
+
+        right = history.rename(columns={"effective_date": "_asof"})
+        merged = pd.merge_asof(left, right, on="_asof", by="shipment_id", direction="backward")
+
+        # 적용일 이전 주문 → 최초 가격
+        missing = merged["supply_price"].isna()
+        if missing.any():
+            first = history.drop_duplicates("shipment_id").set_index("shipment_id")
+            merged.loc[missing, "supply_price"] = merged.loc[missing, "shipment_id"].map(first["supply_price"])
+            merged.loc[missing, "sale_price"] = merged.loc[missing, "shipment_id"].map(first["sale_price"])
+
+        return merged.sort_values("_row").drop(columns=["_row", "_asof"]).reset_index(drop=True)
+
+
+shipment_price_index = ShipmentPriceIndex()
@@ -0,0 +1,24 @@
+import sys
+from datetime import datetime
+
+from db import SessionLocal
+from crud import get_korea_time_naive, take_inventory_snapshots, take_inventory_snapshots_if_needed
+
+# 제품별 재고 스냅샷 저장 (시점 재고 조회 시 원장 재생 구간을 스냅샷 주기로 제한)
+# 주문 업로드가 없는 기간에도 스냅샷이 쌓이도록 매일 실행 (cron 등)
+# 사용법: python snapshot_inventory.py                    → 마지막 스냅샷이 오래됐으면 어제 날짜로 저장
+#         python snapshot_inventory.py --date 2025-01-31  → 해당 날짜 말일 기준으로 저장 (같은 날짜는 교체)
+db = SessionLocal()
+try:
+    if "--date" in sys.argv:
+        snapshot_date = datetime.strptime(sys.argv[sys.argv.index("--date") + 1], "%Y-%m-%d").date()
+        if snapshot_date >= get_korea_time_naive().date():
+            sys.exit("오늘 이전 날짜만 저장할 수 있습니다")
+        count = take_inventory_snapshots(db, snapshot_date)
+        db.commit()
+        print(f"재고 스냅샷 저장: {snapshot_date} ({count}개 제품)")
+    else:
+        count = take_inventory_snapshots_if_needed(db)
+        print(f"재고 스냅샷 저장: {count}개 제품" if count else "스냅샷이 최신입니다")
+finally:
+    db.close()
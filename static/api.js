@@ -18,6 +18,80 @@ function getToken() {
 
 function removeToken() {
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
+}
+
+function saveTokens(data) {
+    saveToken(data.access_token);
+    if (data.refresh_token) {
+        localStorage.setItem('refreshToken', data.refresh_token);
+    }
+    scheduleTokenRefresh();
+}
+
+// === 토큰 자동 갱신 ===
+// 액세스 토큰 만료 전에 리프레시 토큰으로 재발급 (비밀번호 재입력 없음)
+// 여러 탭이 localStorage를 공유하므로 동시에 갱신하면 409 → 다른 탭이 저장한 새 토큰을 사용
+const TOKEN_REFRESH_MARGIN = 5 * 60 * 1000;  // 만료 5분 전
+let refreshPromise = null;
+let refreshTimer = null;
+
+function tokenExpiresAt(token) {
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return payload.exp * 1000;
+    } catch (e) {
+        return null;
+    }
+}
+
+async function requestTokenRefresh() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) return false;
+    
+    const formData = new FormData();
+    formData.append('refresh_token', refreshToken);
+    const response = await fetch(`${window.API_BASE_URL}/token/refresh`, {
+        method: 'POST',
+        body: formData
+    });
+    
+    if (response.ok) {
+        saveTokens(await response.json());
+        return true;
+    }
+    if (response.status === 409) {
+        // 다른 탭이 방금 갱신함 → 잠시 뒤 그 탭이 저장한 토큰 사용
+        await new Promise(resolve => setTimeout(resolve, 500));
+        return localStorage.getItem('refreshToken') !== refreshToken;
+    }
+    return false;
+}
+
+function refreshAccessToken() {
+    // 동시에 여러 요청이 401을 받아도 갱신은 한 번만
+    if (!refreshPromise) {
+        refreshPromise = requestTokenRefresh()
+            .catch(() => false)
+            .finally(() => { refreshPromise = null; });
+    }
+    return refreshPromise;
+}
+
+function scheduleTokenRefresh() {
+    clearTimeout(refreshTimer);
+    const token = getToken();
+    const expiresAt = token && tokenExpiresAt(token);
+    if (!expiresAt || !localStorage.getItem('refreshToken')) return;
+    
+    const delay = Math.max(expiresAt - Date.now() - TOKEN_REFRESH_MARGIN, 0);
+    refreshTimer = setTimeout(async () => {
+        if (getToken() === token) {
+            await refreshAccessToken();
+        } else {
+            scheduleTokenRefresh();  // 다른 탭이 이미 갱신함
+        }
+    }, delay);
 }
 
 function isLoggedIn() {
@@ -25,7 +99,7 @@ function isLoggedIn() {
 }
 
 // === API 호출 헬퍼 함수 ===
-async function apiCall(endpoint, options = {}) {
+async function apiCall(endpoint, options = {}, retried = false) {
     const token = getToken();
     
     const config = {
@@ -48,8 +122,11 @@ async function apiCall(endpoint, options = {}) {
     try {
         const response = await fetch(`${window.API_BASE_URL}${endpoint}`, config);
         
-        // 401 에러시 로그인 페이지로 리다이렉트
+        // 401 에러시 토큰 갱신 후 1회 재시도, 실패하면 로그인 페이지로 리다이렉트
         if (response.status === 401) {
+            if (!retried && await refreshAccessToken()) {
+                return await apiCall(endpoint, options, true);
+            }
             removeToken();
             window.location.href = '/static/login.html';
             throw new Error('인증이 만료되었습니다.');
@@ -87,7 +164,7 @@ async function login(username, password) {
     
     const data = await response.json();
     if (data.access_token) {
-        saveToken(data.access_token);
+        saveTokens(data);
         localStorage.setItem('userType', data.user_type);
         return true;
     }
@@ -96,6 +173,13 @@ async function login(username, password) {
 
 // === 로그아웃 함수 ===
 function logout() {
+    // 서버의 리프레시 토큰 폐기 (응답은 기다리지 않음)
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+        const formData = new FormData();
+        formData.append('refresh_token', refreshToken);
+        fetch(`${window.API_BASE_URL}/logout`, { method: 'POST', body: formData, keepalive: true }).catch(() => {});
+    }
     removeToken();
     localStorage.removeItem('userType');
     window.location.href = '/static/login.html';
@@ -148,6 +232,32 @@ window.productsAPI = window.productsAPI || {
         return await apiCall(`/products${params}`);
     },
     
+    // 제품 목록 서버 조회 (페이지네이션/필터/정렬/필드 선택)
+    // params: { skip, limit, seller_id, is_active, min_stock, max_stock, q, sort, order, fields }
+    async search(params = {}) {
+        const query = new URLSearchParams();
+        Object.keys(params).forEach(key => {
+            if (params[key] !== null && params[key] !== undefined && params[key] !== '') {
+                query.append(key, params[key]);
+            }
+        });
+        return await apiCall(`/products/search?${query.toString()}`);
+    },
+    
+    // 여러 제품의 상세 이미지 일괄 조회 ({images: {id: [...]}, versions})
+    async images(ids) {
+        return await apiCall(`/products/images?ids=${ids.join(',')}`);
+    },
+    
+    // 제품 선적 타임라인 (가격 변경/재고 조정/판매 할당, 최신순) - next_cursor로 다음 페이지
+    async timeline(productId, cursor = null, types = null) {
+        const params = new URLSearchParams();
+        if (cursor) params.append('cursor', cursor);
+        if (types) params.append('types', types);
+        const query = params.toString();
+        return await apiCall(`/products/${productId}/timeline${query ? '?' + query : ''}`);
+    },
+    
     // 제품 생성 (FormData로)
     async create(productData) {
         const formData = new FormData();
@@ -245,6 +355,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!isLoggedIn()) {
            window.location.href = '/static/login.html';
         } else {
+            scheduleTokenRefresh();
+            
             // 토큰이 유효한지 확인
             getCurrentUser().then(user => {
                 if (!user) {
@@ -271,6 +383,7 @@ document.addEventListener('DOMContentLoaded', function() {
 window.API = {
     login,
     logout,
+    refreshAccessToken,
     getCurrentUser,
     sellers: window.sellersAPI,
     products: productsAPI,
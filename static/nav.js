@@ -430,6 +430,7 @@ async function changePassword() {
             alert('비밀번호가 성공적으로 변경되었습니다.\n다시 로그인해주세요.');
             window.closeModal();
             localStorage.removeItem('token');
+            localStorage.removeItem('refreshToken');
             window.location.href = '/';
         } else {
             errorDiv.textContent = result.detail || '비밀번호 변경에 실패했습니다.';
@@ -13,6 +13,7 @@ let imageOrder = [];
 let draggedIndex = null;
 let tempShipments = [];  // 임시 선적 데이터
 let editingShipmentId = null;  // 수정 중인 선적 ID
+let shipmentHistoryCache = {};  // 선적 ID -> {price_history, stock_history} (상세 조회 결과, 잘린 이력은 null)
 
 // chart.js와 공유하는 전역 변수 - 이미 chart.js에 선언되어 있으면 사용
 if (typeof selectedProductIds === 'undefined') {
@@ -26,6 +27,29 @@ const selectedProductSet = new Set();  // 내부적으로 Set 사용
 let currentPage = 1;
 const itemsPerPage = 20;
 
+// 목록/미리보기용 썸네일 너비 (원본 대신 축소 이미지 요청)
+const LIST_THUMBNAIL_WIDTH = 120;    // 목록 50px (고해상도 화면 2배)
+const PREVIEW_THUMBNAIL_WIDTH = 240; // 수정 모달 미리보기
+
+// 이미지 URL → 너비 지정 URL
+// - 서버 업로드 파일(/static/uploads/...): ?w=너비 (서버에서 썸네일 생성/캐시)
+// - ImageKit URL: ?tr=w-너비 (ImageKit 변환)
+// - blob:/data: 미리보기나 그 밖의 외부 URL은 그대로
+function sizedImageUrl(url, width) {
+    if (!url) return url;
+    if (!/^(https?:|blob:|data:|\/)/.test(url)) {
+        url = `/static/${url}`;
+    }
+    const separator = url.includes('?') ? '&' : '?';
+    if (url.startsWith('/static/uploads/')) {
+        return `${url}${separator}w=${width}`;
+    }
+    if (/^https?:\/\/ik\.imagekit\.io\//.test(url)) {
+        return `${url}${separator}tr=w-${width}`;
+    }
+    return url;
+}
+
 // ===== 페이지 로드시 초기화 =====
 document.addEventListener('DOMContentLoaded', function() {
     // 제품관리 메뉴 클릭시 데이터 로드
@@ -140,12 +164,12 @@ function renderProductTable() {
         // renderProductTable 함수에서 썸네일 부분만 수정
 const thumbnailHtml = product.thumbnail_url ? 
     (product.thumbnail_url.startsWith('http') ? 
-        `<img src="${product.thumbnail_url}" 
+        `<img src="${sizedImageUrl(product.thumbnail_url, LIST_THUMBNAIL_WIDTH)}" 
               alt="${product.name}" 
               style="width: 50px; height: 50px; object-fit: cover; cursor: pointer;" 
               onclick="showImageLarge('${product.thumbnail_url}', '${product.name.replace(/'/g, "\\'")}')"
               title="클릭하면 확대">` :
-        `<img src="/static/${product.thumbnail_url}" 
+        `<img src="${sizedImageUrl(product.thumbnail_url, LIST_THUMBNAIL_WIDTH)}" 
               alt="${product.name}" 
               style="width: 50px; height: 50px; object-fit: cover; cursor: pointer;" 
               onclick="showImageLarge('/static/${product.thumbnail_url}', '${product.name.replace(/'/g, "\\'")}')"
@@ -478,14 +502,12 @@ async function openEditProductModal(productId) {
     const product = allProducts.find(p => p.id === productId);
     if (!product) return;
     
-    // 기존 상세 이미지들 로드
+    // 상세 이미지/매핑/선적/이력 한 번에 로드
+    let detail = null;
     try {
-        const response = await fetch(`/api/products/${productId}/images`, {
-            headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
-        });
-        if (response.ok) {
-            const existingImages = await response.json();
-            imageOrder = existingImages.map(img => ({
+        detail = await fetchProductDetail(productId);
+        if (detail) {
+            imageOrder = detail.images.map(img => ({
                 url: img.url,
                 order: img.order,
                 preview: img.url,
@@ -493,7 +515,7 @@ async function openEditProductModal(productId) {
             }));
         }
     } catch (error) {
-        console.log('상세 이미지 로드 실패');
+        console.log('제품 상세 로드 실패');
     }
     
     const seller = allSellersForProduct.find(s => s.id === product.seller_id);
@@ -595,8 +617,13 @@ async function openEditProductModal(productId) {
             renderImagePreviews();
         }
         
-        // 매핑 데이터 로드 (추가)
-        loadProductMappings(productId);
+        // 매핑/선적 표시 (상세 조회 결과 사용)
+        if (detail) {
+            detail.mappings.forEach(mapping => addCodeMappingRow(mapping));
+            displayShipmentsList(detail.shipments);
+        } else {
+            loadProductMappings(productId);
+        }
     }, 100);
 }
 async function handleAdditionalImages(input) {
@@ -671,7 +698,7 @@ function renderImagePreviews() {
                      ondragover="dragOver(event)"
                      ondrop="drop(event, ${index})"
                      style="position: relative; border: 2px solid #ddd; padding: 5px; cursor: move;">
-                    <img src="${item.preview || item.url}" 
+                    <img src="${sizedImageUrl(item.preview || item.url, PREVIEW_THUMBNAIL_WIDTH)}" 
                          style="width: 100%; height: 80px; object-fit: cover;">
                     <div style="position: absolute; top: 2px; left: 2px; 
                                 background: rgba(0,0,0,0.7); color: white; 
@@ -1787,15 +1814,28 @@ function closeShipmentModal() {
     if (modal) modal.remove();
 }
 
+// 제품 상세 일괄 조회 (선적별 이력은 캐시에 저장)
+async function fetchProductDetail(productId) {
+    const response = await fetch(`/api/products/${productId}/detail`, {
+        headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
+    });
+    if (!response.ok) return null;
+    
+    const detail = await response.json();
+    detail.shipments.forEach(ship => {
+        shipmentHistoryCache[ship.id] = {
+            price_history: ship.price_history_has_more ? null : ship.price_history,
+            stock_history: ship.stock_history_has_more ? null : ship.stock_history
+        };
+    });
+    return detail;
+}
+
 async function loadProductShipments(productId) {
     try {
-        const response = await fetch(`/api/products/${productId}/shipments`, {
-            headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
-        });
-        
-        if (response.ok) {
-            const shipments = await response.json();
-            displayShipmentsList(shipments);
+        const detail = await fetchProductDetail(productId);
+        if (detail) {
+            displayShipmentsList(detail.shipments);
         }
     } catch (error) {
         console.error('선적 목록 로드 실패:', error);
@@ -1885,6 +1925,9 @@ function openShipmentStockModal(shipmentId) {
                 <label style="margin-left: 20px;">
                     <input type="radio" name="adjustType" value="subtract"> 차감
                 </label>
+                <label style="margin-left: 20px;">
+                    <input type="radio" name="adjustType" value="dispose"> 폐기
+                </label>
             </div>
             <div style="margin-bottom: 15px;">
                 <label>수량 *</label>
@@ -1946,6 +1989,7 @@ async function saveShipmentPrice(shipmentId) {
         
         if (response.ok) {
             alert('가격이 수정되었습니다.');
+            delete shipmentHistoryCache[shipmentId];  // 이력 다시 조회
             closePriceModal();
             // 목록 새로고침
             const productId = editingProductId;
@@ -1981,6 +2025,7 @@ async function saveShipmentStock(shipmentId) {
         
         if (response.ok) {
             alert('재고가 조정되었습니다.');
+            delete shipmentHistoryCache[shipmentId];  // 이력 다시 조회
             closeStockModal();
             // 목록 새로고침
             const productId = editingProductId;
@@ -2095,16 +2140,19 @@ function closeNewShipmentModal() {
 // === 선적 이력 조회 함수 ===
 async function viewShipmentPriceHistory(shipmentId) {
     try {
-        const response = await fetch(`/api/shipments/${shipmentId}/price-history`, {
-            headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
-        });
-        
-        if (!response.ok) {
-            throw new Error('서버 응답 오류');
+        let history = shipmentHistoryCache[shipmentId]?.price_history;
+        if (!history) {
+            const response = await fetch(`/api/shipments/${shipmentId}/price-history`, {
+                headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
+            });
+            
+            if (!response.ok) {
+                throw new Error('서버 응답 오류');
+            }
+            
+            history = await response.json();
         }
         
-        const history = await response.json();
-        
         // 서브 모달 생성
         const subModal = document.createElement('div');
         subModal.id = 'priceHistoryModal';
@@ -2186,16 +2234,19 @@ function closePriceHistoryModal() {
 // 재고 이력도 동일
 async function viewShipmentStockHistory(shipmentId) {
     try {
-        const response = await fetch(`/api/shipments/${shipmentId}/stock-history`, {
-            headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
-        });
-        
-        if (!response.ok) {
-            throw new Error('서버 응답 오류');
+        let history = shipmentHistoryCache[shipmentId]?.stock_history;
+        if (!history) {
+            const response = await fetch(`/api/shipments/${shipmentId}/stock-history`, {
+                headers: {'Authorization': `Bearer ${localStorage.getItem('token')}`}
+            });
+            
+            if (!response.ok) {
+                throw new Error('서버 응답 오류');
+            }
+            
+            history = await response.json();
         }
         
-        const history = await response.json();
-        
         const subModal = document.createElement('div');
         subModal.id = 'stockHistoryModal';
         subModal.style.cssText = `
@@ -2216,7 +2267,7 @@ async function viewShipmentStockHistory(shipmentId) {
             tableRows = '<tr><td colspan="4" style="text-align: center; padding: 20px;">조정 이력이 없습니다.</td></tr>';
         } else {
             history.forEach(item => {
-                const typeText = item.adjustment_type === 'add' ? '추가' : '차감';
+                const typeText = item.adjustment_type === 'add' ? '추가' : (item.adjustment_type === 'dispose' ? '폐기' : '차감');
                 const typeColor = item.adjustment_type === 'add' ? 'green' : 'red';
                 tableRows += `
                     <tr>
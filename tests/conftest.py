@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# db.py가 import 시점에 엔진을 만들기 때문에 모듈 import 전에 DB URL 지정
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import crud
+from db import Base
+from models import OrderItem
+from product_index import product_index
+from shipment_price_index import shipment_price_index
+
+# 미연결 주문 아이템은 product_id/seller_id_snapshot이 NULL (운영 DB 컬럼도 NULL 허용)
+OrderItem.__table__.c.product_id.nullable = True
+OrderItem.__table__.c.seller_id_snapshot.nullable = True
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    crud._projection_cache["key"] = None
+    product_index.invalidate()
+    shipment_price_index.invalidate()
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import text
+
+import crud
+from api_routes_products import delete_product
+from models import (
+    Seller, Product, ProductShipment, ProductCodeMapping, Order, OrderItem,
+    FifoAllocation, InventoryLedger
+)
+
+
+def test_delete_product_with_allocations_and_ledger(db):
+    """FIFO 할당/재고 원장/선적이 있는 제품도 FK 제약 아래에서 삭제되고 주문 아이템은 연결 해제"""
+    now = crud.get_korea_time_naive()
+    db.add(Seller(id=1, name="seller", created_at=now))
+    db.add(Product(
+        id=1, name="p", product_code="P-1", seller_id=1,
+        initial_stock=10, supply_price=1, sale_price=2, is_active=1, created_at=now
+    ))
+    db.add(ProductShipment(
+        id=1, product_id=1, shipment_no="S1", arrival_date=now - timedelta(days=30),
+        initial_quantity=10, current_quantity=10, remaining_quantity=10,
+        supply_price=Decimal("5"), sale_price=Decimal("9"), is_active=1, created_at=now, updated_at=now
+    ))
+    db.add(ProductCodeMapping(product_id=1, mapped_code="P-1-SET", quantity_multiplier=2))
+    order = Order(order_no="O1", buyer_id="b", order_time=now - timedelta(days=1), status="已完成", created_at=datetime.now())
+    db.add(order)
+    db.flush()
+    item = OrderItem(
+        order_id=order.id, product_id=1, product_code="P-1", seller_id_snapshot=1,
+        quantity=3, supply_price=Decimal("0"), sale_price=Decimal("0"), created_at=datetime.now()
+    )
+    db.add(item)
+    db.flush()
+    crud.record_inventory_movements(db, [{
+        "shipment_id": 1, "product_id": 1, "entry_type": "receipt", "quantity_delta": 10,
+        "occurred_at": now - timedelta(days=30), "reference_type": "shipment", "reference_id": 1
+    }])
+    crud.allocate_fifo_batch(db, [{"id": item.id, "product_id": 1, "quantity": 3, "order_time": order.order_time}])
+    db.commit()
+    assert db.query(FifoAllocation).count() == 1
+
+    db.execute(text("PRAGMA foreign_keys=ON"))
+    assert delete_product(1, db=db, current=None)["ok"]
+
+    db.expire_all()
+    assert db.query(Product).count() == 0
+    assert db.query(FifoAllocation).count() == 0
+    assert db.query(InventoryLedger).count() == 0
+    assert db.query(ProductShipment).count() == 0
+    assert db.query(OrderItem).one().product_id is None
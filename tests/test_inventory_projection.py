@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import crud
+from models import Seller, Product, ProductDailySales, ProductInventoryState
+
+
+def _add_product(db, product_id, code, stock, sold):
+    """재고 stock, 오늘 판매량 sold인 제품"""
+    db.add(Product(
+        id=product_id, name=code, product_code=code, seller_id=1,
+        initial_stock=stock, supply_price=1, sale_price=2, is_active=1, created_at=datetime.now()
+    ))
+    db.add(ProductInventoryState(product_id=product_id, current_stock=stock))
+    if sold:
+        today = crud.get_korea_time_naive().date()
+        db.add(ProductDailySales(
+            product_id=product_id, sale_date=today - timedelta(days=1),
+            quantity=sold, supply_amount=sold, sale_amount=sold * 2
+        ))
+
+
+def test_slow_mover_has_no_stockout_date(db):
+    db.add(Seller(id=1, name="seller", created_at=datetime.now()))
+    _add_product(db, 1, "SLOW", stock=1000, sold=1)    # 90일 1개 → 약 90,000일
+    _add_product(db, 2, "FAST", stock=90, sold=9)      # 90일 9개 → 900일
+    _add_product(db, 3, "NONE", stock=10, sold=0)
+    db.commit()
+
+    frame = crud.get_inventory_projection(db, basis_days=90)
+
+    slow = frame.loc[1]
+    assert slow['days_of_cover'] == pytest.approx(90000)
+    assert slow['days_of_cover'] > crud.PROJECTION_HORIZON_DAYS
+    assert slow['stockout_date'] is crud.pd.NaT
+
+    fast = frame.loc[2]
+    today = crud.get_korea_time_naive().date()
+    assert fast['stockout_date'].date() == today + timedelta(days=900)
+
+    assert crud.pd.isna(frame.loc[3]['days_of_cover'])
+    assert crud.pd.isna(frame.loc[3]['stockout_date'])
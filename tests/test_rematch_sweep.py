@@ -0,0 +1,167 @@
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import crud
+from product_index import product_index
+import db as db_module
+from models import (
+    Seller, Product, ProductShipment, ProductCodeMapping, Order, OrderItem,
+    DashboardSummary, FifoAllocation
+)
+
+
+@pytest.fixture
+def sweep_db(session_factory, monkeypatch):
+    """run_rematch_sweep이 자체 세션을 테스트 DB로 열도록"""
+    monkeypatch.setattr(db_module, "SessionLocal", session_factory)
+    session = session_factory()
+    now = datetime.now()
+    session.add(Seller(id=1, name="seller", created_at=now))
+    session.add(Product(
+        id=1, name="existing", product_code="OLD-1", seller_id=1,
+        initial_stock=0, supply_price=1, sale_price=2, is_active=1, created_at=now
+    ))
+    session.commit()
+    yield session
+    session.close()
+
+
+def _add_unmatched_order(db, order_no, code, quantity, status="已完成"):
+    """주문 업로드와 같이 미연결 아이템 저장 + 수량은 전체(0) 통계에 반영"""
+    order_time = crud.get_korea_time_naive() - timedelta(days=2)
+    order = Order(order_no=order_no, buyer_id="b", order_time=order_time, status=status, created_at=datetime.now())
+    db.add(order)
+    db.flush()
+    db.add(OrderItem(
+        order_id=order.id, product_id=None, product_code=code, seller_id_snapshot=None,
+        quantity=quantity, supply_price=Decimal("0"), sale_price=Decimal("0"), created_at=datetime.now()
+    ))
+    if status in crud.VALID_STATUS_FOR_STATS:
+        crud.apply_stats_deltas(db, {(None, None, order_time.date()): [Decimal("0"), Decimal("0"), quantity]})
+    db.commit()
+
+
+def _add_product_with_shipment(db, product_id, code, quantity):
+    """재고 quantity, 선적가 공급 5 / 판매 9인 제품"""
+    now = crud.get_korea_time_naive()
+    db.add(Product(
+        id=product_id, name=code, product_code=code, seller_id=1,
+        initial_stock=quantity, supply_price=3, sale_price=7, is_active=1, created_at=now
+    ))
+    db.add(ProductShipment(
+        product_id=product_id, shipment_no="S1", arrival_date=now - timedelta(days=30),
+        initial_quantity=quantity, current_quantity=quantity, remaining_quantity=quantity,
+        supply_price=Decimal("5"), sale_price=Decimal("9"), is_active=1, created_at=now, updated_at=now
+    ))
+    db.commit()
+
+
+def _summaries(db):
+    db.expire_all()
+    return {
+        s.seller_id: tuple(
+            getattr(s, f"{period}_{field}")
+            for period in ("total", "month", "week", "yesterday")
+            for field in ("supply_amount", "sale_amount", "quantity")
+        ) for s in db.query(DashboardSummary).all()
+    }
+
+
+def _assert_stats_converged(db):
+    """증감분으로 반영된 통계 == 주문 아이템 기준 전체 재계산"""
+    incremental = _summaries(db)
+    crud.recalculate_dashboard_summary_full(db)
+    db.commit()
+    assert incremental == _summaries(db)
+
+
+def _seller_total(db, seller_id):
+    """(누적 공급가, 누적 판매가, 누적 수량)"""
+    return _summaries(db)[seller_id][:3]
+
+
+def test_sweep_links_items_of_new_product(sweep_db):
+    db = sweep_db
+    _add_unmatched_order(db, "O1", "NEW-1", 2)
+    _add_unmatched_order(db, "O2", "NEW-1", 3)
+    _add_unmatched_order(db, "O3", "NEW-1", 4, status="已取消")
+    _add_product_with_shipment(db, 2, "NEW-1", 10)
+
+    crud.run_rematch_sweep()
+
+    db.expire_all()
+    items = db.query(OrderItem).filter(OrderItem.product_code == "NEW-1").all()
+    assert {i.product_id for i in items} == {2}
+    assert {i.seller_id_snapshot for i in items} == {1}
+
+    # 통계 반영 상태(已完成) 아이템만 FIFO 할당 → 선적가, 재고 차감, 대시보드 반영
+    allocated = {a.order_item_id: a.quantity for a in db.query(FifoAllocation).all()}
+    assert sorted(allocated.values()) == [2, 3]
+    shipment = db.query(ProductShipment).filter(ProductShipment.product_id == 2).one()
+    assert shipment.remaining_quantity == 5
+
+    assert _seller_total(db, 1) == (Decimal("25"), Decimal("45"), 5)
+    assert _seller_total(db, crud.TOTAL_STATS_SELLER_ID) == (Decimal("25"), Decimal("45"), 5)
+    _assert_stats_converged(db)
+
+
+def test_sweep_links_items_of_new_mapping(sweep_db):
+    db = sweep_db
+    _add_unmatched_order(db, "O1", "OLD-1-SET2", 3)
+    db.add(ProductCodeMapping(product_id=1, mapped_code="OLD-1-SET2", quantity_multiplier=2))
+    db.commit()
+
+    crud.run_rematch_sweep()
+
+    db.expire_all()
+    item = db.query(OrderItem).filter(OrderItem.product_code == "OLD-1-SET2").one()
+    assert item.product_id == 1
+    assert item.quantity == 6
+
+    # 선적이 없으므로 제품 가격으로 채움, 수량은 배수 적용
+    assert _seller_total(db, 1) == (Decimal("6"), Decimal("12"), 6)
+    assert _seller_total(db, crud.TOTAL_STATS_SELLER_ID) == (Decimal("6"), Decimal("12"), 6)
+    _assert_stats_converged(db)
+
+
+def test_sweep_triggered_while_running_runs_again(sweep_db, monkeypatch):
+    """실행 중에 추가된 제품도 연결됨 (이번 실행에서 미해결로 넘어간 코드)"""
+    db = sweep_db
+    _add_unmatched_order(db, "O1", "LATE-1", 2)
+
+    rematch = crud.rematch_unmatched_items
+    first_pass_done = threading.Event()
+    product_added = threading.Event()
+    passes = []
+
+    def slow_rematch(session, *args, **kwargs):
+        result = rematch(session, *args, **kwargs)
+        passes.append(result["linked"])
+        if len(passes) == 1:
+            first_pass_done.set()
+            product_added.wait(5)
+        return result
+
+    monkeypatch.setattr(crud, "rematch_unmatched_items", slow_rematch)
+    sweep = threading.Thread(target=crud.run_rematch_sweep)
+    sweep.start()
+    assert first_pass_done.wait(5)
+
+    # 첫 실행이 LATE-1을 미해결로 넘긴 뒤 제품 추가 → 새 요청은 실행 중이라 재실행 요청만 남김
+    session = db_module.SessionLocal()
+    _add_product_with_shipment(session, 3, "LATE-1", 10)
+    session.close()
+    product_index.invalidate()
+    crud.run_rematch_sweep()
+    product_added.set()
+    sweep.join(5)
+
+    assert passes == [0, 1]
+    db.expire_all()
+    item = db.query(OrderItem).filter(OrderItem.product_code == "LATE-1").one()
+    assert item.product_id == 3
+    assert _seller_total(db, 1) == (Decimal("10"), Decimal("18"), 2)
+    _assert_stats_converged(db)